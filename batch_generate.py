@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""
+Offline batch generation over a JSONL prompt file.
+Runs every prompt through the bot's own GeminiService/TogetherService pipeline
+(system instruction, history formatting, model routing) with bounded
+concurrency and per-provider rate limits. Results are appended to a JSONL file
+as they complete, and a checkpoint lets an interrupted run resume without
+repeating finished lines.
+
+Input lines are JSON objects:
+    {"id": "q1", "message": "What is TCP?", "history": [{"role": "user", "content": "..."}],
+     "provider": "gemini", "model": "gemini-2.5-flash"}
+Only "message" (or "prompt") is required.
+
+Examples:
+    python batch_generate.py prompts.jsonl results.jsonl --concurrency 16
+    python batch_generate.py prompts.jsonl results.jsonl      # rerun to resume after a crash
+    python batch_generate.py prompts.jsonl results.jsonl --restart
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from config import Config
+
+# Replies the services return instead of raising when a request fails
+ERROR_PREFIX = "❌"
+
+
+class ProviderRateLimit:
+    """Spaces out requests to one provider to stay under a requests-per-minute limit."""
+
+    def __init__(self, per_minute: float):
+        """
+        Initialize the limit.
+
+        Args:
+            per_minute: Maximum requests per minute, 0 for unlimited
+        """
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self._next_slot = 0.0
+
+    async def acquire(self):
+        """Wait for the next free request slot."""
+        if not self.interval:
+            return
+        now = time.monotonic()
+        slot = max(now, self._next_slot)
+        self._next_slot = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+class Checkpoint:
+    """
+    Resume point of a batch run, stored next to the output file.
+
+    Every input line before next_line is finished; lines in `ahead` finished out of
+    order. Output written after output_bytes is scanned on resume, so records that
+    completed after the last checkpoint are not repeated either.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.next_line = 0
+        self.input_offset = 0
+        self.output_bytes = 0
+        self.ahead: Set[int] = set()
+
+    def load(self) -> bool:
+        """Read the checkpoint file; returns False if there is none."""
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path) as f:
+            state = json.load(f)
+        self.next_line = state["next_line"]
+        self.input_offset = state["input_offset"]
+        self.output_bytes = state["output_bytes"]
+        self.ahead = set(state["ahead"])
+        return True
+
+    def save(self):
+        """Write the checkpoint atomically."""
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "w") as f:
+            json.dump({
+                "next_line": self.next_line,
+                "input_offset": self.input_offset,
+                "output_bytes": self.output_bytes,
+                "ahead": sorted(self.ahead),
+                "saved_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            }, f)
+        os.replace(temporary, self.path)
+
+    def remove(self):
+        """Delete the checkpoint file (after a completed run or on restart)."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class BatchRunner:
+    """Streams a JSONL prompt file through the AI services."""
+
+    def __init__(self, input_path: str, output_path: str, concurrency: int = None,
+                 provider: str = None, gemini_rpm: float = None, together_rpm: float = None,
+                 retries: int = 2, checkpoint_every: int = 100):
+        """
+        Initialize the runner.
+
+        Args:
+            input_path: JSONL prompts
+            output_path: JSONL results, appended to when resuming
+            concurrency: Requests in flight at once (default Config.BATCH_CONCURRENCY)
+            provider: Provider for lines that do not name one: "auto", "gemini" or "together"
+            gemini_rpm: Gemini requests per minute, 0 for unlimited (default Config.BATCH_GEMINI_RPM)
+            together_rpm: Together AI requests per minute, 0 for unlimited (default Config.BATCH_TOGETHER_RPM)
+            retries: Extra attempts for failed requests, with exponential backoff
+            checkpoint_every: Completed lines between checkpoints
+        """
+        self.input_path = input_path
+        self.output_path = output_path
+        self.concurrency = concurrency or Config.BATCH_CONCURRENCY
+        self.provider = provider or ("auto" if Config.MODEL_ROUTING else "gemini")
+        self.retries = retries
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint = Checkpoint(f"{output_path}.checkpoint")
+        self.logger = logging.getLogger(__name__)
+
+        self.services: Dict[str, Any] = {}
+        self.router = None
+        self.rate_limits = {
+            "gemini": ProviderRateLimit(gemini_rpm if gemini_rpm is not None else Config.BATCH_GEMINI_RPM),
+            "together": ProviderRateLimit(together_rpm if together_rpm is not None else Config.BATCH_TOGETHER_RPM),
+        }
+
+        # Lines started but not finished, in input order: line -> input byte offset
+        self._pending: Dict[int, int] = {}
+        self._next_line = 0
+        self._next_offset = 0
+        self._output = None
+        self.counts = {"ok": 0, "error": 0, "invalid": 0, "skipped": 0}
+
+    def _create_services(self):
+        """Create the AI services the same way the bot does."""
+        from gemini_service import GeminiService
+        from model_router import ModelRouter
+        from together_service import TogetherService
+
+        self.services["gemini"] = GeminiService()
+        try:
+            self.services["together"] = TogetherService()
+        except ValueError as e:
+            self.logger.warning("Together AI not available: %s", e)
+        self.router = ModelRouter({"gemini": self.services["gemini"], "together": self.services.get("together")})
+
+    def _resume(self) -> Set[int]:
+        """
+        Restore progress from the checkpoint and the output written after it.
+
+        Returns:
+            Line numbers at or after the checkpoint's next_line that are already done
+        """
+        if not os.path.exists(self.output_path):
+            self.checkpoint.remove()
+            return set()
+
+        has_checkpoint = self.checkpoint.load()
+        done = set(self.checkpoint.ahead)
+        with open(self.output_path, "rb+") as f:
+            f.seek(self.checkpoint.output_bytes if has_checkpoint else 0)
+            position = f.tell()
+            for raw in iter(f.readline, b""):
+                if not raw.endswith(b"\n"):
+                    # Drop a record cut short by a crash
+                    f.truncate(position)
+                    break
+                position += len(raw)
+                try:
+                    done.add(json.loads(raw)["line"])
+                except (ValueError, KeyError, TypeError):
+                    continue
+
+        done = {line for line in done if line >= self.checkpoint.next_line}
+        self.logger.info("Resuming at line %d with %d later lines already done",
+                         self.checkpoint.next_line, len(done))
+        return done
+
+    def _read_lines(self) -> Iterator[Tuple[int, int, bytes]]:
+        """Yield (line number, byte offset, raw line) from the resume point on."""
+        with open(self.input_path, "rb") as f:
+            f.seek(self.checkpoint.input_offset)
+            line, offset = self.checkpoint.next_line, self.checkpoint.input_offset
+            for raw in f:
+                yield line, offset, raw
+                line += 1
+                offset += len(raw)
+
+    async def run(self, restart: bool = False) -> Dict[str, Any]:
+        """
+        Process the whole input file.
+
+        Args:
+            restart: Discard previous output and checkpoint instead of resuming
+
+        Returns:
+            Counts per outcome and elapsed time
+        """
+        if restart:
+            self.checkpoint.remove()
+            if os.path.exists(self.output_path):
+                os.remove(self.output_path)
+        done = self._resume()
+        self.checkpoint.ahead = set(done)
+        self._create_services()
+
+        started = time.monotonic()
+        slots = asyncio.Semaphore(self.concurrency)
+        tasks: Set[asyncio.Task] = set()
+        since_checkpoint = 0
+        self._output = open(self.output_path, "ab")
+        try:
+            for line, offset, raw in self._read_lines():
+                self._next_line, self._next_offset = line + 1, offset + len(raw)
+                if line in done:
+                    self.counts["skipped"] += 1
+                    continue
+                if not raw.strip():
+                    continue
+
+                await slots.acquire()
+                self._pending[line] = offset
+                task = asyncio.create_task(self._process(line, raw))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                task.add_done_callback(lambda _: slots.release())
+
+                since_checkpoint += 1
+                if since_checkpoint >= self.checkpoint_every:
+                    since_checkpoint = 0
+                    self._save_checkpoint()
+                    self._log_progress(started)
+
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            self._save_checkpoint()
+            self._output.close()
+
+        elapsed = time.monotonic() - started
+        return {**self.counts, "elapsed_s": round(elapsed, 1)}
+
+    async def _process(self, line: int, raw: bytes):
+        """Generate and write the result for one input line."""
+        try:
+            job = json.loads(raw)
+            message = job.get("message") or job.get("prompt")
+            if not isinstance(message, str) or not message:
+                raise ValueError("missing \"message\"")
+            # The services expect the history to end with the current message, as in the bot
+            history = [{"role": entry["role"], "content": entry["content"]} for entry in job.get("history") or []]
+        except (ValueError, AttributeError, KeyError, TypeError) as e:
+            self._write({"line": line, "status": "invalid", "error": str(e)})
+            return
+
+        history.append({"role": "user", "content": message})
+        route = self.router.route(message, history, provider=job.get("provider") or self.provider, model=job.get("model"))
+        provider = route.provider if route.provider in self.services else "gemini"
+
+        attempts, response, latency = 0, "", 0.0
+        while attempts <= self.retries:
+            if attempts:
+                await asyncio.sleep(min(60.0, 2.0 ** attempts))
+            attempts += 1
+            await self.rate_limits[provider].acquire()
+            request_started = time.monotonic()
+            response = await self._generate(provider, message, history, route.model)
+            latency = time.monotonic() - request_started
+            if not response.startswith(ERROR_PREFIX):
+                break
+
+        status = "error" if response.startswith(ERROR_PREFIX) else "ok"
+        self._write({
+            "line": line,
+            "id": job.get("id", line),
+            "provider": provider,
+            "model": route.model,
+            "status": status,
+            "response": response,
+            "latency_s": round(latency, 3),
+            "attempts": attempts,
+        })
+
+    async def _generate(self, provider: str, message: str, history: List[Dict[str, str]], model: str) -> str:
+        """Run one service call, turning exceptions into error replies like the services' own."""
+        try:
+            return await self.services[provider].generate_response(message, history, model_name=model)
+        except Exception as e:
+            return f"{ERROR_PREFIX} {type(e).__name__}: {e}"
+
+    def _write(self, record: Dict[str, Any]):
+        """Append a result and mark its line done."""
+        self._output.write(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n")
+        self._output.flush()
+        self.counts[record["status"]] += 1
+
+        line = record["line"]
+        first_pending = next(iter(self._pending))
+        del self._pending[line]
+        if line != first_pending:
+            self.checkpoint.ahead.add(line)
+
+    def _save_checkpoint(self):
+        """Persist the lowest unfinished line, after syncing the results written so far."""
+        self._output.flush()
+        os.fsync(self._output.fileno())
+
+        if self._pending:
+            line, offset = next(iter(self._pending.items()))
+        else:
+            line, offset = self._next_line, self._next_offset
+        self.checkpoint.next_line = line
+        self.checkpoint.input_offset = offset
+        self.checkpoint.output_bytes = self._output.tell()
+        self.checkpoint.ahead = {done for done in self.checkpoint.ahead if done > line}
+        self.checkpoint.save()
+
+    def _log_progress(self, started: float):
+        """Log throughput so far."""
+        finished = self.counts["ok"] + self.counts["error"] + self.counts["invalid"]
+        elapsed = time.monotonic() - started
+        self.logger.info("Line %d: %d done (%d errors), %.1f lines/s",
+                         self._next_line, finished, self.counts["error"], finished / elapsed if elapsed else 0.0)
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Run a JSONL prompt file through the bot's AI pipeline")
+    parser.add_argument("input", help="JSONL file with one {\"message\": ...} object per line")
+    parser.add_argument("output", help="JSONL results file (appended to when resuming)")
+    parser.add_argument("--concurrency", type=int, default=Config.BATCH_CONCURRENCY, help="Requests in flight")
+    parser.add_argument("--provider", choices=["auto", "gemini", "together"],
+                        help="Provider for lines that do not set one (default: auto when routing is enabled)")
+    parser.add_argument("--gemini-rpm", type=float, default=Config.BATCH_GEMINI_RPM,
+                        help="Gemini requests per minute (0 = unlimited)")
+    parser.add_argument("--together-rpm", type=float, default=Config.BATCH_TOGETHER_RPM,
+                        help="Together AI requests per minute (0 = unlimited)")
+    parser.add_argument("--retries", type=int, default=2, help="Extra attempts for failed requests")
+    parser.add_argument("--checkpoint-every", type=int, default=100, help="Lines between checkpoints")
+    parser.add_argument("--restart", action="store_true", help="Ignore previous output and start over")
+    parser.add_argument("--log-level", default="INFO")
+    return parser.parse_args(argv)
+
+
+def main():
+    """Run a batch from the command line."""
+    args = parse_args()
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=args.log_level.upper()
+    )
+    # Per-request service logs would drown the progress lines
+    for name in ("gemini_service", "together_service", "httpx"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    runner = BatchRunner(
+        args.input,
+        args.output,
+        concurrency=args.concurrency,
+        provider=args.provider,
+        gemini_rpm=args.gemini_rpm,
+        together_rpm=args.together_rpm,
+        retries=args.retries,
+        checkpoint_every=args.checkpoint_every
+    )
+
+    try:
+        summary = asyncio.run(runner.run(restart=args.restart))
+    except KeyboardInterrupt:
+        print(f"\nInterrupted; rerun the same command to resume from {runner.checkpoint.path}")
+        return
+    print(f"\n📦 Batch finished in {summary['elapsed_s']}s: {summary['ok']} ok, {summary['error']} errors, "
+          f"{summary['invalid']} invalid, {summary['skipped']} already done")
+
+
+if __name__ == "__main__":
+    main()
@@ -13,26 +13,161 @@ class Config:
     
     # Conversation settings
     MAX_CONVERSATION_LENGTH = int(os.getenv("MAX_CONVERSATION_LENGTH", "20"))  # Max messages to keep in memory
+    CONVERSATION_MEMORY_LIMIT_MB = int(os.getenv("CONVERSATION_MEMORY_LIMIT_MB", "192"))  # LRU-evict whole conversations above this (0 = no cap)
+    CONVERSATION_COMPRESS_AFTER = float(os.getenv("CONVERSATION_COMPRESS_AFTER", "600"))  # Idle seconds before zlib compression (0 = never)
     
     # Gemini AI settings
     GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.5-flash")
+    GEMINI_MODELS = [  # Routable Gemini models; GEMINI_MODEL is the default
+        model.strip() for model in os.getenv("GEMINI_MODELS", f"{GEMINI_MODEL},gemini-2.5-flash-lite").split(",")
+        if model.strip()
+    ]
     GEMINI_TEMPERATURE = float(os.getenv("GEMINI_TEMPERATURE", "0.7"))
     GEMINI_MAX_TOKENS = int(os.getenv("GEMINI_MAX_TOKENS", "1000"))
+    GEMINI_THINKING_BUDGET = os.getenv("GEMINI_THINKING_BUDGET", "auto").lower()  # "auto", "dynamic" or a token count
+    GEMINI_THINKING_BUDGET_SIMPLE = int(os.getenv("GEMINI_THINKING_BUDGET_SIMPLE", "0"))        # auto: greetings, chit-chat
+    GEMINI_THINKING_BUDGET_MODERATE = int(os.getenv("GEMINI_THINKING_BUDGET_MODERATE", "1024")) # auto: questions needing some reasoning
+    GEMINI_THINKING_BUDGET_COMPLEX = int(os.getenv("GEMINI_THINKING_BUDGET_COMPLEX", "8192"))   # auto: code, long or deep requests
+    GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "")  # Override API endpoint (e.g. local simulator)
     
     # Together AI settings
     TOGETHER_DEFAULT_MODEL = os.getenv("TOGETHER_DEFAULT_MODEL", "meta-llama/Llama-2-70b-chat-hf")
     TOGETHER_TEMPERATURE = float(os.getenv("TOGETHER_TEMPERATURE", "0.7"))
     TOGETHER_MAX_TOKENS = int(os.getenv("TOGETHER_MAX_TOKENS", "1000"))
+    TOGETHER_BASE_URL = os.getenv("TOGETHER_BASE_URL", "")  # Override API endpoint (e.g. local simulator)
+    
+    # Model routing settings
+    MODEL_ROUTING = os.getenv("MODEL_ROUTING", "false").lower() == "true"     # Route by prompt features and latency (opt-in)
+    ROUTER_LONG_PROMPT_CHARS = int(os.getenv("ROUTER_LONG_PROMPT_CHARS", "1500"))  # Prompts this long prefer long-context models
+    ROUTER_DEEP_CONVERSATION = int(os.getenv("ROUTER_DEEP_CONVERSATION", "12"))    # History messages treated as a deep conversation
+    ROUTER_EWMA_ALPHA = float(os.getenv("ROUTER_EWMA_ALPHA", "0.2"))          # Weight of the newest latency/error sample
+    ROUTER_EXPLORE_RATE = float(os.getenv("ROUTER_EXPLORE_RATE", "0.05"))     # Share of requests sent to a random suitable model
+    ROUTER_MAX_ERROR_RATE = float(os.getenv("ROUTER_MAX_ERROR_RATE", "0.3"))  # Models above this error rate are avoided
+    ROUTER_PRIOR_LATENCY = float(os.getenv("ROUTER_PRIOR_LATENCY", "3.0"))    # Least seconds assumed for models without samples
+    
+    # API key pools (GEMINI_API_KEYS / TOGETHER_API_KEYS hold "key1,key2:weight")
+    GEMINI_KEY_RPM = int(os.getenv("GEMINI_KEY_RPM", "0"))              # Requests per minute per Gemini key (0 = unknown)
+    GEMINI_KEY_TPM = int(os.getenv("GEMINI_KEY_TPM", "0"))              # Tokens per minute per Gemini key (0 = unknown)
+    TOGETHER_KEY_RPM = int(os.getenv("TOGETHER_KEY_RPM", "0"))          # Requests per minute per Together key (0 = unknown)
+    TOGETHER_KEY_TPM = int(os.getenv("TOGETHER_KEY_TPM", "0"))          # Tokens per minute per Together key (0 = unknown)
+    KEY_QUARANTINE_SECONDS = float(os.getenv("KEY_QUARANTINE_SECONDS", "60"))  # Rest for a rate-limited key without Retry-After
+    
+    # Concurrency and fair scheduling settings
+    CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "256"))            # Updates handled at once in polling mode
+    PROVIDER_CONCURRENCY = int(os.getenv("PROVIDER_CONCURRENCY", "16"))         # Provider calls in flight, shared fairly
+    SCHEDULER_QUANTUM = float(os.getenv("SCHEDULER_QUANTUM", "1.0"))            # Deficit round robin credit per user per round
+    SCHEDULER_COST_CHARS = int(os.getenv("SCHEDULER_COST_CHARS", "2000"))       # Prompt chars that count as one extra request
+    SCHEDULER_AGING_SECONDS = float(os.getenv("SCHEDULER_AGING_SECONDS", "15")) # Waits beyond this jump the queue (0 = off)
+    SUPERSEDE_POLICY = os.getenv("SUPERSEDE_POLICY", "merge").lower()            # New message during a generation: cancel, queue or merge
+    DEBOUNCE_SECONDS = float(os.getenv("DEBOUNCE_SECONDS", "0.5"))              # Wait for more messages after a quick follow-up (0 = off)
+    DEBOUNCE_MAX_SECONDS = float(os.getenv("DEBOUNCE_MAX_SECONDS", "3.0"))      # Longest a burst of messages is held
+    DEBOUNCE_MAX_MESSAGES = int(os.getenv("DEBOUNCE_MAX_MESSAGES", "8"))        # Messages merged into one turn at most
+    
+    # Event-loop monitoring settings
+    LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.1"))            # Seconds between loop lag samples (0 = off)
+    LOOP_STALL_THRESHOLD_MS = float(os.getenv("LOOP_STALL_THRESHOLD_MS", "500")) # Lag that captures the blocking stack (0 = off)
+    
+    # Admin profiling settings (/profile and the /profile HTTP route)
+    PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.01"))  # Seconds between stack samples
+    PROFILE_DEFAULT_SECONDS = float(os.getenv("PROFILE_DEFAULT_SECONDS", "10"))    # Duration when none is given
+    PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))            # Longest profile allowed
+    
+    # Memory introspection settings (/memstats and the /memstats HTTP route)
+    MEMSTATS_TRACEMALLOC = os.getenv("MEMSTATS_TRACEMALLOC", "false").lower() == "true"  # Trace allocations from startup
+    MEMSTATS_TRACEMALLOC_FRAMES = int(os.getenv("MEMSTATS_TRACEMALLOC_FRAMES", "1"))      # Frames kept per traced allocation
+    MEMSTATS_TOP = int(os.getenv("MEMSTATS_TOP", "10"))                                   # Allocation sites listed per report
+    
+    # FAQ answer settings (common questions answered from a local index without a provider call)
+    FAQ_ENABLED = os.getenv("FAQ_ENABLED", "true").lower() == "true"            # Look messages up before generating
+    FAQ_FILE = os.getenv("FAQ_FILE", "faq.json")                                # Admin-managed entries ("" = in memory only)
+    FAQ_BUILTIN = os.getenv("FAQ_BUILTIN", "false").lower() == "true"           # Start from entries about the bot until FAQ_FILE exists
+    FAQ_MIN_CONFIDENCE = float(os.getenv("FAQ_MIN_CONFIDENCE", "0.75"))         # Match confidence answered from the FAQ
+    FAQ_MAX_CHARS = int(os.getenv("FAQ_MAX_CHARS", "300"))                      # Longer messages always go to a model
+    FAQ_FOLLOW_UP_WINDOW = float(os.getenv("FAQ_FOLLOW_UP_WINDOW", "600"))      # Seconds after a turn in which referring messages go to a model
+    FAQ_RELOAD_INTERVAL = float(os.getenv("FAQ_RELOAD_INTERVAL", "5"))          # Seconds between checks for edits by other processes
+    
+    # Load shedding settings (each threshold alone means pressure 1.0; 0 ignores that signal)
+    SHED_QUEUE_DEPTH = int(os.getenv("SHED_QUEUE_DEPTH", "64"))                 # Requests waiting for a provider slot
+    SHED_LOOP_LAG_MS = float(os.getenv("SHED_LOOP_LAG_MS", "200"))              # Event-loop lag in milliseconds
+    SHED_LATENCY_P95 = float(os.getenv("SHED_LATENCY_P95", "20"))               # 95th percentile provider latency in seconds
+    SHED_LATENCY_WINDOW = float(os.getenv("SHED_LATENCY_WINDOW", "60"))         # Seconds of provider requests in the percentile
+    SHED_LEVELS = [  # Pressure entering no_typing, cache_first, fastest_model and busy
+        float(level) for level in os.getenv("SHED_LEVELS", "1,1.5,2,3").split(",") if level.strip()
+    ]
+    SHED_INTERVAL = float(os.getenv("SHED_INTERVAL", "0.5"))                    # Seconds between overload checks
+    SHED_COOLDOWN_SECONDS = float(os.getenv("SHED_COOLDOWN_SECONDS", "10"))     # Calm seconds before stepping down a level
+    SHED_CACHE_SIZE = int(os.getenv("SHED_CACHE_SIZE", "2048"))                 # First-turn answers cached for cache_first (0 = off)
+    SHED_CACHE_TTL = float(os.getenv("SHED_CACHE_TTL", "3600"))                 # Seconds a cached answer may be served
+    SHED_CACHE_MAX_CHARS = int(os.getenv("SHED_CACHE_MAX_CHARS", "200"))        # Longer prompts are never cached
     
     # Bot settings
     BOT_USERNAME = os.getenv("BOT_USERNAME", "GeminiAIBot")
     BOT_DESCRIPTION = os.getenv("BOT_DESCRIPTION", "AI Assistant powered by Gemini AI")
+    TELEGRAM_API_BASE_URL = os.getenv("TELEGRAM_API_BASE_URL", "")  # e.g. local Bot API server or fake
     
     # Logging settings
     LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
     LOG_FILE = os.getenv("LOG_FILE", "bot.log")
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "text")                                # "text" or "json"
+    LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))     # Rotate the log file at this size
+    LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))                  # Rotated files to keep
+    LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))                  # Records buffered before dropping
+    LOG_MESSAGE_SAMPLE_RATE = float(os.getenv("LOG_MESSAGE_SAMPLE_RATE", "0.0"))  # Share of users whose text is logged
+    LOG_MESSAGE_MAX_CHARS = int(os.getenv("LOG_MESSAGE_MAX_CHARS", "50"))       # Truncate logged message text
+    
+    # Provider startup settings
+    PROVIDER_PREWARM = os.getenv("PROVIDER_PREWARM", "true").lower() == "true"  # Load SDKs in background after start
+    PROVIDER_PREWARM_DELAY = float(os.getenv("PROVIDER_PREWARM_DELAY", "2.0"))  # Seconds to wait before pre-warming
+    PROVIDER_PREWARM_CONNECT = os.getenv("PROVIDER_PREWARM_CONNECT", "true").lower() == "true"  # Also open each key's connection
+    
+    # Warm restart settings
+    SNAPSHOT_FILE = os.getenv("SNAPSHOT_FILE", "")                              # State snapshot path (empty = off)
+    SNAPSHOT_INTERVAL = float(os.getenv("SNAPSHOT_INTERVAL", "300"))            # Seconds between snapshots (0 = on shutdown only)
+    
+    # Provider health settings
+    HEALTH_CHECK_TTL = float(os.getenv("HEALTH_CHECK_TTL", "60"))              # Seconds health data stays fresh
+    HEALTH_PROBE_INTERVAL = float(os.getenv("HEALTH_PROBE_INTERVAL", "15"))    # Seconds between prober passes
+    HEALTH_ERROR_THRESHOLD = float(os.getenv("HEALTH_ERROR_THRESHOLD", "0.5")) # Error rate marking a provider unhealthy
+    HEALTH_MIN_SAMPLES = int(os.getenv("HEALTH_MIN_SAMPLES", "5"))             # Requests needed to trust traffic data
+    
+    # Tracing settings (disabled unless TRACE_SAMPLE_RATE > 0)
+    TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.0"))        # Fraction of updates traced
+    TRACE_EXPORT_FILE = os.getenv("TRACE_EXPORT_FILE", "traces.jsonl")      # OTLP/JSON output file
+    TRACE_EXPORT_URL = os.getenv("TRACE_EXPORT_URL", "")                    # e.g. http://localhost:4318/v1/traces
+    TRACE_BATCH_SIZE = int(os.getenv("TRACE_BATCH_SIZE", "256"))            # Max spans per export
+    TRACE_FLUSH_INTERVAL = float(os.getenv("TRACE_FLUSH_INTERVAL", "5.0"))  # Seconds between exports
+    TRACE_MAX_QUEUE_SIZE = int(os.getenv("TRACE_MAX_QUEUE_SIZE", "8192"))   # Spans buffered before dropping
+
+    # Update deduplication settings
+    DEDUP_WINDOW = int(os.getenv("DEDUP_WINDOW", "10000"))                      # Recent update IDs remembered (0 = off)
+    DEDUP_STATE_FILE = os.getenv("DEDUP_STATE_FILE", "")                        # Keeps the window across restarts when set
+    DEDUP_SAVE_INTERVAL = float(os.getenv("DEDUP_SAVE_INTERVAL", "5"))          # Seconds between background saves of the window
+    
+    # Webhook settings
+    WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN", "")                # Required on incoming updates when set (A-Z, a-z, 0-9, _ and -)
+    WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))   # Concurrent update deliveries Telegram may open (1-100)
+    
+    # Multi-process webhook settings
+    WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "1"))                    # >1 routes updates to user-sharded processes
+    SHARD_VIRTUAL_NODES = int(os.getenv("SHARD_VIRTUAL_NODES", "128"))          # Hash ring points per worker
+    SHARD_REBALANCE_TIMEOUT = float(os.getenv("SHARD_REBALANCE_TIMEOUT", "60")) # Seconds to wait for workers during scaling
+    
+    # Traffic recording settings (replay with replay_traffic.py)
+    RECORD_TRAFFIC = os.getenv("RECORD_TRAFFIC", "false").lower() == "true"   # Record incoming updates
+    RECORD_DIR = os.getenv("RECORD_DIR", "recordings")                          # Directory for gzip JSONL segments
+    RECORD_SEGMENT_MAX_MB = int(os.getenv("RECORD_SEGMENT_MAX_MB", "64"))       # Uncompressed MB per segment
+    RECORD_SEGMENT_SECONDS = float(os.getenv("RECORD_SEGMENT_SECONDS", "3600")) # Start a new segment after this long
+    RECORD_MAX_SEGMENTS = int(os.getenv("RECORD_MAX_SEGMENTS", "48"))           # Oldest segments beyond this are deleted
+    RECORD_RESPONSES = os.getenv("RECORD_RESPONSES", "false").lower() == "true" # Also record provider replies and latency
+    RECORD_ANONYMIZE_KEY = os.getenv("RECORD_ANONYMIZE_KEY", "")                # Keeps hashed IDs stable across restarts
+    
+    # Offline batch generation settings (batch_generate.py)
+    BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "8"))          # Requests in flight at once
+    BATCH_GEMINI_RPM = float(os.getenv("BATCH_GEMINI_RPM", "60"))         # Gemini requests per minute (0 = unlimited)
+    BATCH_TOGETHER_RPM = float(os.getenv("BATCH_TOGETHER_RPM", "60"))     # Together AI requests per minute (0 = unlimited)
     
     # Admin settings (optional)
+    ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN", "")  # X-Admin-Token for admin HTTP routes (disabled when empty)
     ADMIN_USER_IDS = [
         int(uid.strip()) for uid in os.getenv("ADMIN_USER_IDS", "").split(",") 
         if uid.strip().isdigit()
@@ -0,0 +1,379 @@
+"""
+Compact, memory-bounded conversation storage.
+Messages are slotted records instead of dicts, idle conversations are kept
+zlib-compressed, and whole conversations are evicted least-recently-used
+first once the global memory cap is reached. Conversations restored from a
+state snapshot stay in the snapshot until their user is next seen.
+"""
+
+import gc
+import json
+import sys
+import time
+import zlib
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from config import Config
+
+
+class Message:
+    """One conversation message; supports msg["role"] / msg["content"] like the old dicts."""
+
+    __slots__ = ("role", "content")
+
+    def __init__(self, role: str, content: str):
+        self.role = sys.intern(role)
+        self.content = content
+
+    def __getitem__(self, key: str) -> str:
+        if key == "role":
+            return self.role
+        if key == "content":
+            return self.content
+        raise KeyError(key)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, Message):
+            return self.role == other.role and self.content == other.content
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"Message({self.role!r}, {self.content!r})"
+
+
+class _Conversation:
+    """A stored conversation: live messages when hot, a zlib blob when cold."""
+
+    __slots__ = ("messages", "blob", "nbytes", "last_access", "length")
+
+    def __init__(self, messages: List[Message], now: float):
+        self.messages: Optional[List[Message]] = messages
+        self.blob: Optional[bytes] = None
+        self.nbytes = 0
+        self.last_access = now
+        # Message count while cold (-1 until known for conversations loaded from a snapshot)
+        self.length = -1
+
+
+# Fixed per-entry costs used for memory accounting
+_MESSAGE_OVERHEAD = sys.getsizeof(Message("user", "")) + 8            # record + list slot
+_CONVERSATION_OVERHEAD = sys.getsizeof(_Conversation([], 0.0)) + sys.getsizeof([]) + 100  # + dict entry, key
+
+
+def _messages_size(messages: List[Message]) -> int:
+    """Approximate bytes held by a list of messages."""
+    return _CONVERSATION_OVERHEAD + sum(_MESSAGE_OVERHEAD + sys.getsizeof(m.content) for m in messages)
+
+
+def compress_messages(messages: Iterable[Message]) -> bytes:
+    """Compressed form of a conversation, as kept for idle conversations and in snapshots."""
+    payload = json.dumps([[m.role, m.content] for m in messages], ensure_ascii=False)
+    return zlib.compress(payload.encode("utf-8"))
+
+
+def _to_message(entry: Union[Message, Dict[str, str]]) -> Message:
+    """Accept Message records or legacy {"role", "content"} dicts."""
+    if isinstance(entry, Message):
+        return entry
+    return Message(entry["role"], entry["content"])
+
+
+class ConversationStore(MutableMapping):
+    """
+    Per-user conversation histories with a global memory cap.
+
+    Behaves like a dict of user ID -> message list, plus append(), which trims
+    each conversation to max_length as a ring buffer would.
+    """
+
+    def __init__(self, max_length: int = None, max_bytes: int = None, compress_after: float = None):
+        """
+        Initialize the store.
+
+        Args:
+            max_length: Messages kept per conversation (default Config.MAX_CONVERSATION_LENGTH)
+            max_bytes: Global memory cap in bytes, 0 for unbounded (default Config.CONVERSATION_MEMORY_LIMIT_MB)
+            compress_after: Idle seconds before a conversation is compressed, 0 to disable
+                (default Config.CONVERSATION_COMPRESS_AFTER)
+        """
+        self.max_length = max_length or Config.MAX_CONVERSATION_LENGTH
+        self.max_bytes = max_bytes if max_bytes is not None else Config.CONVERSATION_MEMORY_LIMIT_MB * 1024 * 1024
+        self.compress_after = compress_after if compress_after is not None else Config.CONVERSATION_COMPRESS_AFTER
+
+        # Least recently used first
+        self._hot: "OrderedDict[int, _Conversation]" = OrderedDict()
+        self._cold: "OrderedDict[int, _Conversation]" = OrderedDict()
+        self.total_bytes = 0
+        self.evictions = 0
+        self.compressions = 0
+        self._next_sweep = 0.0
+        # Conversations of a restored snapshot not yet loaded (see attach_snapshot())
+        self._snapshot = None
+
+    def __len__(self) -> int:
+        return len(self._hot) + len(self._cold) + (len(self._snapshot) if self._snapshot else 0)
+
+    def __iter__(self) -> Iterator[int]:
+        if self._snapshot:
+            yield from self._snapshot.pending_ids()
+        yield from list(self._cold)
+        yield from list(self._hot)
+
+    def __contains__(self, user_id) -> bool:
+        return (user_id in self._hot or user_id in self._cold
+                or (self._snapshot is not None and user_id in self._snapshot))
+
+    def __getitem__(self, user_id: int) -> List[Message]:
+        """Return a user's messages, decompressing and marking them recently used."""
+        return self._touch(user_id).messages
+
+    def __setitem__(self, user_id: int, messages: Iterable[Union[Message, Dict[str, str]]]):
+        """Replace a user's conversation (dicts are converted to Message records)."""
+        records = [_to_message(entry) for entry in messages][-self.max_length:]
+        self._discard(user_id)
+        conversation = _Conversation(records, time.monotonic())
+        conversation.nbytes = _messages_size(records)
+        self._hot[user_id] = conversation
+        self.total_bytes += conversation.nbytes
+        self._maintain(conversation.last_access)
+
+    def __delitem__(self, user_id: int):
+        if not self._discard(user_id):
+            raise KeyError(user_id)
+
+    def append(self, user_id: int, role: str, content: str) -> List[Message]:
+        """
+        Add a message to a user's conversation, dropping the oldest beyond max_length.
+
+        Args:
+            user_id: Telegram user ID
+            role: "user" or "assistant"
+            content: Message text
+
+        Returns:
+            The user's (live) message list
+        """
+        now = time.monotonic()
+        # Hot path inlined: this runs twice per handled message
+        conversation = self._hot.get(user_id)
+        if conversation is not None:
+            self._hot.move_to_end(user_id)
+            conversation.last_access = now
+        elif user_id in self._cold or self._load_from_snapshot(user_id):
+            conversation = self._touch(user_id, now)
+        else:
+            conversation = _Conversation([], now)
+            conversation.nbytes = _CONVERSATION_OVERHEAD
+            self._hot[user_id] = conversation
+            self.total_bytes += _CONVERSATION_OVERHEAD
+
+        messages = conversation.messages
+        messages.append(Message(role, content))
+        added = _MESSAGE_OVERHEAD + sys.getsizeof(content)
+        while len(messages) > self.max_length:
+            added -= _MESSAGE_OVERHEAD + sys.getsizeof(messages.pop(0).content)
+        conversation.nbytes += added
+        self.total_bytes += added
+
+        if now >= self._next_sweep or self.total_bytes > self.max_bytes > 0:
+            self._maintain(now)
+        return messages
+
+    def remove_message(self, user_id: int, message: Message) -> bool:
+        """
+        Remove one message (the same object append() stored) from a user's conversation.
+
+        Args:
+            user_id: Telegram user ID
+            message: Message record to remove
+
+        Returns:
+            True if it was found; messages already trimmed, cleared or compressed are not
+        """
+        conversation = self._hot.get(user_id)
+        if conversation is None:
+            return False
+        messages = conversation.messages
+        for index in range(len(messages) - 1, -1, -1):
+            if messages[index] is message:
+                del messages[index]
+                removed = _MESSAGE_OVERHEAD + sys.getsizeof(message.content)
+                conversation.nbytes -= removed
+                self.total_bytes -= removed
+                return True
+        return False
+
+    def attach_snapshot(self, snapshot):
+        """
+        Serve conversations from a restored snapshot, each loaded when its user is next seen.
+
+        Args:
+            snapshot: A snapshot.SnapshotReader
+        """
+        self._snapshot = snapshot
+
+    def snapshot_items(self) -> List[Tuple[int, Union[bytes, memoryview, List[Message]]]]:
+        """
+        Point-in-time copy of every conversation for a state snapshot.
+
+        Hot conversations are returned as (shallow copies of) their message lists and
+        compressed by the caller, so this stays cheap enough to run on the event loop.
+
+        Returns:
+            (user ID, compressed conversation or message list) pairs
+        """
+        items: List[Tuple[int, Union[bytes, memoryview, List[Message]]]] = []
+        # One new list per conversation would set off full collections over every stored message
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            if self._snapshot:
+                items.extend(self._snapshot.pending())
+            items.extend((user_id, conversation.blob) for user_id, conversation in self._cold.items())
+            items.extend((user_id, list(conversation.messages)) for user_id, conversation in self._hot.items())
+        finally:
+            if gc_enabled:
+                gc.enable()
+        return items
+
+    def message_count(self, user_id: int) -> int:
+        """
+        Number of messages in a user's conversation (0 if none), for read-only callers.
+
+        Unlike len(store[user_id]), this neither marks the conversation recently used
+        nor decompresses it into the hot set.
+        """
+        conversation = self._hot.get(user_id)
+        if conversation is not None:
+            return len(conversation.messages)
+        conversation = self._cold.get(user_id)
+        if conversation is None:
+            if not self._load_from_snapshot(user_id):
+                return 0
+            conversation = self._cold[user_id]
+        if conversation.length < 0:
+            conversation.length = len(json.loads(zlib.decompress(conversation.blob)))
+        return conversation.length
+
+    def idle_seconds(self, user_id: int, now: float = None) -> Optional[float]:
+        """
+        Seconds since a user's conversation was last used, for read-only callers.
+
+        None if the conversation is not held in memory (none, or only in a restored
+        snapshot, whose turns predate the restart). Does not mark the conversation used.
+        """
+        conversation = self._hot.get(user_id) or self._cold.get(user_id)
+        if conversation is None:
+            return None
+        return (now if now is not None else time.monotonic()) - conversation.last_access
+
+    def memory_usage(self, user_id: int) -> int:
+        """Approximate bytes held by one user's conversation (0 if none)."""
+        conversation = self._hot.get(user_id) or self._cold.get(user_id)
+        return conversation.nbytes if conversation else 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Memory and eviction statistics for status output."""
+        count = len(self)
+        return {
+            "conversations": count,
+            "hot": len(self._hot),
+            "compressed": len(self._cold),
+            "total_bytes": self.total_bytes,
+            "bytes_per_conversation": self.total_bytes // count if count else 0,
+            "max_bytes": self.max_bytes,
+            "evictions": self.evictions,
+            "compressions": self.compressions,
+            "in_snapshot": len(self._snapshot) if self._snapshot else 0,
+        }
+
+    def _touch(self, user_id: int, now: float = None) -> _Conversation:
+        """Move a conversation to the most recently used end, decompressing it if cold."""
+        now = now if now is not None else time.monotonic()
+        conversation = self._hot.get(user_id)
+        if conversation is not None:
+            self._hot.move_to_end(user_id)
+        else:
+            if user_id not in self._cold:
+                self._load_from_snapshot(user_id)
+            conversation = self._cold.pop(user_id)  # KeyError for unknown users
+            conversation.messages = [Message(role, content) for role, content in
+                                     json.loads(zlib.decompress(conversation.blob))]
+            conversation.blob = None
+            self.total_bytes -= conversation.nbytes
+            conversation.nbytes = _messages_size(conversation.messages)
+            self.total_bytes += conversation.nbytes
+            self._hot[user_id] = conversation
+        conversation.last_access = now
+        return conversation
+
+    def _take_from_snapshot(self, user_id: int) -> Optional[bytes]:
+        """Remove a conversation from the attached snapshot and return its blob, if it holds one."""
+        if self._snapshot is None:
+            return None
+        blob = self._snapshot.take(user_id)
+        if not self._snapshot:
+            # Every conversation has been taken; release the mapping
+            self._snapshot = None
+        return blob
+
+    def _load_from_snapshot(self, user_id: int) -> bool:
+        """Move a conversation from the attached snapshot into the cold set, if it holds one."""
+        blob = self._take_from_snapshot(user_id)
+        if blob is None:
+            return False
+        conversation = _Conversation(None, time.monotonic())
+        conversation.blob = blob
+        conversation.nbytes = _CONVERSATION_OVERHEAD + sys.getsizeof(blob)
+        self._cold[user_id] = conversation
+        self.total_bytes += conversation.nbytes
+        return True
+
+    def _discard(self, user_id: int) -> bool:
+        """Remove a conversation if present."""
+        conversation = self._hot.pop(user_id, None) or self._cold.pop(user_id, None)
+        if conversation is None:
+            # Also forget it in the snapshot, so it is not loaded again later
+            return self._take_from_snapshot(user_id) is not None
+        self.total_bytes -= conversation.nbytes
+        return True
+
+    def _maintain(self, now: float):
+        """Compress idle conversations, then evict the least recently used until under the cap."""
+        # Idle sweeps need only run about once a second
+        self._next_sweep = now + 1.0
+        if self.compress_after > 0:
+            hot = self._hot
+            while hot and now - hot[next(iter(hot))].last_access >= self.compress_after:
+                user_id, conversation = hot.popitem(last=False)
+                self._compress(conversation)
+                self._cold[user_id] = conversation
+
+        if self.max_bytes > 0 and self.total_bytes > self.max_bytes:
+            # Never evict the conversation that was just used (snapshot entries are not in memory)
+            while self.total_bytes > self.max_bytes and len(self._hot) + len(self._cold) > 1:
+                _, conversation = (self._cold or self._hot).popitem(last=False)
+                self.total_bytes -= conversation.nbytes
+                self.evictions += 1
+
+    def _compress(self, conversation: _Conversation):
+        """Replace a conversation's messages with a zlib blob."""
+        conversation.blob = compress_messages(conversation.messages)
+        conversation.length = len(conversation.messages)
+        conversation.messages = None
+        self.total_bytes -= conversation.nbytes
+        conversation.nbytes = _CONVERSATION_OVERHEAD + sys.getsizeof(conversation.blob)
+        self.total_bytes += conversation.nbytes
+        self.compressions += 1
+
+
+def format_bytes(size: float) -> str:
+    """Human-readable byte count for status messages."""
+    if size < 1024:
+        return f"{size:.0f} B"
+    for unit in ("KB", "MB", "GB"):
+        size /= 1024
+        if size < 1024 or unit == "GB":
+            return f"{size:.1f} {unit}"
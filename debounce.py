@@ -0,0 +1,104 @@
+"""
+Debouncing of rapid-fire messages.
+Users often split one thought across several quick messages. A message that
+follows another from the same user in the same chat within DEBOUNCE_MAX_SECONDS
+waits a short window; if yet another arrives, the window restarts and the texts
+are merged, so the burst becomes a single turn answered by one provider call.
+A message with no recent predecessor is answered at once, so single messages
+are never delayed.
+"""
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional
+
+from config import Config
+
+
+class _Burst:
+    """Messages collected for one chat and user."""
+
+    __slots__ = ("texts", "started", "latest")
+
+    def __init__(self, started: float):
+        self.texts: List[str] = []
+        self.started = started
+        # Sequence number of the newest message; its handler owns the burst
+        self.latest = 0
+
+
+class MessageDebouncer:
+    """Merges consecutive messages that arrive within a short window."""
+
+    def __init__(self, window: float = None, max_wait: float = None, max_messages: int = None):
+        """
+        Initialize the debouncer.
+
+        Args:
+            window: Seconds to wait for a follow-up message (default Config.DEBOUNCE_SECONDS, 0 disables)
+            max_wait: Longest a burst is held after its first message (default Config.DEBOUNCE_MAX_SECONDS)
+            max_messages: Messages after which a burst is answered at once (default Config.DEBOUNCE_MAX_MESSAGES)
+        """
+        self.window = window if window is not None else Config.DEBOUNCE_SECONDS
+        self.max_wait = max_wait if max_wait is not None else Config.DEBOUNCE_MAX_SECONDS
+        self.max_messages = max_messages or Config.DEBOUNCE_MAX_MESSAGES
+        self._bursts: Dict[Hashable, _Burst] = {}
+        # Conversation -> arrival of its latest message, oldest first (kept for max_wait seconds)
+        self._recent: "OrderedDict[Hashable, float]" = OrderedDict()
+        self.merged = 0
+
+    async def collect(self, key: Hashable, text: str) -> Optional[str]:
+        """
+        Add a message to its burst and wait for follow-ups, unless it starts a new burst.
+
+        Args:
+            key: Identifies the conversation, e.g. (chat ID, user ID)
+            text: The message text
+
+        Returns:
+            The merged text of the burst if this message ends it, or None if a later
+            message (or /clear) took over and the caller should not reply
+        """
+        if self.window <= 0:
+            return text
+
+        now = time.monotonic()
+        previous = self._recent.pop(key, None)
+        self._recent[key] = now
+        recent = self._recent
+        while now - next(iter(recent.values())) > self.max_wait:
+            recent.popitem(last=False)
+
+        burst = self._bursts.get(key)
+        if burst is None:
+            if previous is None or now - previous > self.max_wait:
+                # Most messages stand alone: answer at once, and let a quick follow-up supersede the reply
+                return text
+            burst = self._bursts[key] = _Burst(now)
+        burst.texts.append(text)
+        burst.latest += 1
+        sequence = burst.latest
+
+        if len(burst.texts) < self.max_messages:
+            delay = min(self.window, burst.started + self.max_wait - now)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if self._bursts.get(key) is not burst or burst.latest != sequence:
+                return None
+
+        del self._bursts[key]
+        self.merged += len(burst.texts) - 1
+        return "\n".join(burst.texts)
+
+    def discard(self, key: Hashable) -> bool:
+        """Drop a pending burst (for /clear); its messages are not answered."""
+        return self._bursts.pop(key, None) is not None
+
+    def __contains__(self, key: Hashable) -> bool:
+        """Whether a burst is waiting for follow-ups in a conversation."""
+        return key in self._bursts
+
+    def __len__(self) -> int:
+        """Bursts currently waiting for follow-ups."""
+        return len(self._bursts)
@@ -0,0 +1,141 @@
+"""
+Deduplication of Telegram updates by update_id.
+Telegram redelivers webhook updates that were not acknowledged in time, and
+polling after a crash fetches updates again that were never confirmed. Each
+duplicate would cost a full generation and a second reply, so the IDs of the
+most recent updates are remembered in a fixed-size window (slot = update_id
+modulo the window size) as they are claimed for processing, and repeats are
+dropped before they are processed; a claim is given up again if the update
+cannot be handed off. The window can be saved to a file by a background
+thread so it survives restarts.
+"""
+
+import array
+import logging
+import os
+import threading
+from typing import Optional
+
+from config import Config
+
+# Marks an empty slot; update IDs are never negative
+_EMPTY = -1
+
+
+class UpdateDeduplicator:
+    """Remembers the last `window` update IDs; safe to use from several threads."""
+
+    def __init__(self, window: int = None, state_file: str = None, save_interval: float = None):
+        """
+        Initialize the deduplicator, loading a saved window if there is one.
+
+        Args:
+            window: Update IDs remembered (default Config.DEDUP_WINDOW, 0 disables)
+            state_file: File the window is saved to, "" for none (default Config.DEDUP_STATE_FILE)
+            save_interval: Seconds between background saves (default Config.DEDUP_SAVE_INTERVAL)
+        """
+        self.window = window if window is not None else Config.DEDUP_WINDOW
+        self.state_file = state_file if state_file is not None else Config.DEDUP_STATE_FILE
+        self.save_interval = save_interval if save_interval is not None else Config.DEDUP_SAVE_INTERVAL
+        self.logger = logging.getLogger(__name__)
+
+        self._slots = array.array("q", [_EMPTY]) * max(self.window, 0)
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.duplicates = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        if self.window > 0 and self.state_file:
+            self.load()
+
+    def claim(self, update_id: int) -> bool:
+        """
+        Reserve an update ID for processing, atomically with the duplicate check.
+
+        Two threads receiving the same redelivered update cannot both claim it. If
+        the update then fails to decode or dispatch, release() the ID so Telegram's
+        next delivery is accepted.
+
+        Args:
+            update_id: The update's update_id
+
+        Returns:
+            True if the update should be processed, False if it was already claimed
+        """
+        if self.window <= 0:
+            return True
+        slot = update_id % self.window
+        with self._lock:
+            if self._slots[slot] == update_id:
+                self.duplicates += 1
+                return False
+            self._slots[slot] = update_id
+            self._dirty = True
+        return True
+
+    def release(self, update_id: int):
+        """
+        Give up a claim whose update could not be handed off for processing.
+
+        Args:
+            update_id: An update_id returned True by claim()
+        """
+        if self.window <= 0:
+            return
+        slot = update_id % self.window
+        with self._lock:
+            if self._slots[slot] == update_id:
+                self._slots[slot] = _EMPTY
+                self._dirty = True
+
+    def start(self):
+        """Save the window every save_interval seconds in a daemon thread (no-op without a state file)."""
+        if self.window > 0 and self.state_file and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="dedup-saver", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the saving thread and write any unsaved IDs."""
+        self._stop.set()
+        self.save()
+
+    def _run(self):
+        """Write the window to disk periodically, off the request threads and the event loop."""
+        while not self._stop.wait(self.save_interval):
+            self.save()
+
+    def load(self):
+        """Restore the window from the state file (IDs only; the window size may have changed)."""
+        saved = array.array("q")
+        try:
+            with open(self.state_file, "rb") as f:
+                saved.frombytes(f.read())
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            self.logger.warning("Could not load update dedup state from %s: %s", self.state_file, e)
+            return
+
+        with self._lock:
+            for update_id in saved:
+                if update_id != _EMPTY:
+                    self._slots[update_id % self.window] = update_id
+        self.logger.info("Loaded update dedup state from %s", self.state_file)
+
+    def save(self):
+        """Write the window to the state file, if anything changed since the last save."""
+        if not self.state_file or not self._dirty:
+            return
+        with self._lock:
+            payload = self._slots.tobytes()
+            self._dirty = False
+
+        # Written aside and renamed, so a crash never leaves a truncated file
+        temp_file = f"{self.state_file}.tmp"
+        try:
+            with open(temp_file, "wb") as f:
+                f.write(payload)
+            os.replace(temp_file, self.state_file)
+        except OSError as e:
+            self.logger.warning("Could not save update dedup state to %s: %s", self.state_file, e)
@@ -0,0 +1,297 @@
+"""
+Local stand-in for the Telegram Bot API and a minimal asyncio HTTP server.
+Used by the load-test harness so the bot can be exercised offline.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import threading
+import time
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+from urllib.parse import parse_qsl, urlsplit
+
+
+class HTTPRequest:
+    """A parsed HTTP request."""
+
+    __slots__ = ("method", "path", "query", "headers", "body")
+
+    def __init__(self, method: str, path: str, query: Dict[str, str], headers: Dict[str, str], body: bytes):
+        self.method = method
+        self.path = path
+        self.query = query
+        self.headers = headers
+        self.body = body
+
+    def json(self) -> dict:
+        """Decode the body as JSON."""
+        return json.loads(self.body) if self.body else {}
+
+
+class HTTPResponse:
+    """An HTTP response with a fixed body."""
+
+    REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 429: "Too Many Requests",
+               500: "Internal Server Error", 502: "Bad Gateway", 503: "Service Unavailable"}
+
+    def __init__(self, status: int = 200, body: bytes = b"", headers: Optional[Dict[str, str]] = None):
+        self.status = status
+        self.body = body
+        self.headers = {"Content-Type": "application/json"}
+        if headers:
+            self.headers.update(headers)
+
+    @classmethod
+    def json(cls, payload, status: int = 200, headers: Optional[Dict[str, str]] = None) -> "HTTPResponse":
+        """Build a JSON response."""
+        return cls(status, json.dumps(payload).encode("utf-8"), headers)
+
+    def status_line(self) -> bytes:
+        """Return the encoded status line and headers, without the body."""
+        lines = [f"HTTP/1.1 {self.status} {self.REASONS.get(self.status, 'Unknown')}"]
+        lines.extend(f"{name}: {value}" for name, value in self.headers.items())
+        return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+    async def write(self, writer: asyncio.StreamWriter):
+        """Send the response over the connection."""
+        self.headers["Content-Length"] = str(len(self.body))
+        writer.write(self.status_line() + self.body)
+        await writer.drain()
+
+
+class StreamingHTTPResponse(HTTPResponse):
+    """An HTTP response whose body is produced incrementally with chunked encoding."""
+
+    def __init__(self, chunks: AsyncIterator[bytes], status: int = 200, headers: Optional[Dict[str, str]] = None):
+        super().__init__(status, b"", {"Content-Type": "text/event-stream", **(headers or {})})
+        self.chunks = chunks
+
+    async def write(self, writer: asyncio.StreamWriter):
+        """Send headers, then each chunk as soon as it is produced."""
+        self.headers["Transfer-Encoding"] = "chunked"
+        writer.write(self.status_line())
+        async for chunk in self.chunks:
+            writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            await writer.drain()
+        writer.write(b"0\r\n\r\n")
+        await writer.drain()
+
+
+Handler = Callable[[HTTPRequest], Awaitable[HTTPResponse]]
+
+
+class MiniHTTPServer:
+    """Minimal asyncio HTTP/1.1 server with keep-alive, sufficient for httpx clients."""
+
+    def __init__(self, handler: Handler, host: str = "127.0.0.1", port: int = 0):
+        """Initialize the server; port 0 picks a free port."""
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self.logger = logging.getLogger(__name__)
+        self._server: Optional[asyncio.base_events.Server] = None
+
+    @property
+    def url(self) -> str:
+        """Base URL of the running server."""
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        """Start accepting connections."""
+        self._server = await asyncio.start_server(self._serve, self.host, self.port, limit=2 ** 20)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """Stop the server."""
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _read_request(self, reader: asyncio.StreamReader) -> Optional[HTTPRequest]:
+        """Read one request from the connection, or None on EOF."""
+        request_line = await reader.readline()
+        if not request_line.strip():
+            return None
+
+        method, target, _ = request_line.decode("latin-1").split(" ", 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        if "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            body = b"".join(chunks)
+        else:
+            body = b""
+
+        url = urlsplit(target)
+        return HTTPRequest(method, url.path, dict(parse_qsl(url.query)), headers, body)
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Serve requests on a single connection until it closes."""
+        try:
+            while True:
+                request = await self._read_request(reader)
+                if request is None:
+                    break
+                try:
+                    response = await self.handler(request)
+                except Exception as e:
+                    self.logger.error(f"Fake server handler failed for {request.path}: {str(e)}")
+                    response = HTTPResponse.json({"error": str(e)}, status=500)
+                await response.write(writer)
+                if request.headers.get("connection", "").lower() == "close":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # Cancellation only happens when the server thread shuts down
+            pass
+        finally:
+            writer.close()
+
+
+class ServerThread:
+    """Runs fake servers on their own event loop so blocking clients cannot stall them."""
+
+    def __init__(self):
+        """Initialize the thread; call start() to launch it."""
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="fake-servers", daemon=True)
+
+    def start(self, *apis):
+        """Start the loop thread and each fake API on it."""
+        self._thread.start()
+        for api in apis:
+            asyncio.run_coroutine_threadsafe(api.start(), self.loop).result()
+
+    def stop(self, *apis):
+        """Stop each fake API, drop open connections and then stop the loop."""
+        asyncio.run_coroutine_threadsafe(self._shutdown(apis), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+    async def _shutdown(self, apis):
+        """Stop the servers and cancel connection handlers still waiting on keep-alive sockets."""
+        for api in apis:
+            await api.stop()
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class FakeTelegramAPI:
+    """Fake Telegram Bot API that records replies and notifies waiting clients."""
+
+    def __init__(self):
+        """Initialize the fake API."""
+        self.server = MiniHTTPServer(self.handle)
+        self.bot_user = {
+            "id": 100000001, "is_bot": True, "first_name": "LoadTestBot", "username": "LoadTestBot"
+        }
+        self.message_ids = itertools.count(1)
+        self.method_counts: Dict[str, int] = {}
+        self._waiters: Dict[int, List[asyncio.Future]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        """Value for the bot's Telegram API base URL (the token is appended by the client)."""
+        return f"{self.server.url}/bot"
+
+    async def start(self):
+        """Start the fake API server."""
+        await self.server.start()
+
+    async def stop(self):
+        """Stop the fake API server."""
+        await self.server.stop()
+
+    def wait_for_reply(self, chat_id: int) -> asyncio.Future:
+        """
+        Return a future resolved with the text of the next message sent to a chat.
+
+        The future belongs to the caller's event loop, which may differ from the server's.
+        """
+        future = asyncio.get_running_loop().create_future()
+        with self._lock:
+            self._waiters.setdefault(chat_id, []).append(future)
+        return future
+
+    @staticmethod
+    def _params(request: HTTPRequest) -> dict:
+        """Decode Bot API parameters sent as JSON or as form fields holding JSON values."""
+        if request.headers.get("content-type", "").startswith("application/json"):
+            return request.json()
+
+        params = {}
+        for key, value in parse_qsl(request.body.decode("utf-8")):
+            try:
+                params[key] = json.loads(value)
+            except ValueError:
+                params[key] = value
+        return params
+
+    async def handle(self, request: HTTPRequest) -> HTTPResponse:
+        """Dispatch a Bot API method call."""
+        method = request.path.rsplit("/", 1)[-1]
+        params = self._params(request)
+        self.method_counts[method] = self.method_counts.get(method, 0) + 1
+
+        if method == "getMe":
+            result = self.bot_user
+        elif method == "sendMessage":
+            result = self._send_message(params)
+        elif method == "getUpdates":
+            await asyncio.sleep(min(float(params.get("timeout", 0) or 0), 1.0))
+            result = []
+        elif method == "getWebhookInfo":
+            result = {"url": "", "has_custom_certificate": False, "pending_update_count": 0}
+        else:
+            result = True
+
+        return HTTPResponse.json({"ok": True, "result": result})
+
+    def _send_message(self, params: dict) -> dict:
+        """Record an outgoing message and resolve anyone waiting for it."""
+        chat_id = int(params["chat_id"])
+        text = params.get("text", "")
+
+        with self._lock:
+            waiters = self._waiters.get(chat_id)
+            future = waiters.pop(0) if waiters else None
+            if waiters == []:
+                del self._waiters[chat_id]
+
+        if future is not None:
+            future.get_loop().call_soon_threadsafe(_resolve, future, text)
+
+        return {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": self.bot_user,
+            "text": text,
+        }
+
+
+def _resolve(future: asyncio.Future, result):
+    """Set a future's result unless it was already cancelled."""
+    if not future.done():
+        future.set_result(result)
+
@@ -0,0 +1,402 @@
+"""
+Local FAQ answers for common questions.
+Admins keep a set of entries, each with one or more phrasings of a question and
+one answer. Every phrasing is a document in an inverted index (term -> postings)
+built at startup and updated in place as entries are added or removed. A
+message is ranked against the phrasings with BM25; the best few candidates are
+then scored by IDF-weighted term overlap with the message, which is the match's
+confidence. High-confidence matches are answered straight from the index
+without a provider call, in a few microseconds.
+
+Entries live in FAQ_FILE as JSON. Until an admin adds any, the index is empty,
+or holds a built-in set about the bot itself with FAQ_BUILTIN. Other processes
+sharing the file (webhook workers) pick up changes within FAQ_RELOAD_INTERVAL
+seconds.
+"""
+
+import bisect
+import heapq
+import json
+import logging
+import math
+import os
+import re
+import time
+from typing import Any, Dict, FrozenSet, List, NamedTuple, Optional, Sequence, Tuple
+
+from config import Config
+
+# BM25 term-frequency saturation and document-length normalization
+_K1 = 1.2
+_B = 0.75
+
+# BM25 candidates re-scored for confidence
+_CANDIDATES = 3
+
+# Upper bounds of the confidence histogram buckets
+CONFIDENCE_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+
+_TOKEN = re.compile(r"\w+")
+
+# Filler words that do not count against a match unless some FAQ question uses them
+_STOPWORDS = frozenset({
+    "a", "an", "the", "is", "are", "am", "be", "i", "me", "my", "you", "your", "we", "it", "this", "that",
+    "to", "of", "in", "on", "for", "with", "and", "or", "so", "please", "pls", "hi", "hello", "hey", "thanks",
+})
+
+# Words that refer back to earlier turns ("what about that?"), and openers that continue them
+_BACK_REFERENCES = frozenset({
+    "it", "its", "this", "that", "these", "those", "they", "them", "their", "he", "she", "him", "her",
+    "there", "above", "again", "else", "instead", "also", "more",
+})
+_CONTINUATIONS = frozenset({"and", "but", "so", "or", "then", "ok", "okay", "how about", "what about"})
+
+# Used until FAQ_FILE exists when FAQ_BUILTIN is set: (question phrasings, answer)
+_BUILTIN_ENTRIES = [
+    (("What can you do?", "What are you?", "Who are you?", "How does this bot work?"),
+     "I'm an AI assistant. I can answer questions, write and edit text, explain complex topics, "
+     "help with creative tasks or just chat. Send me a message and I'll reply; /help lists my commands."),
+    (("How do I clear my conversation?", "How do I reset the chat?", "How do I start over?",
+      "Forget our conversation"),
+     "Send /clear to erase our conversation history and start fresh. It also cancels replies I'm still writing."),
+    (("Which AI models do you use?", "What model are you?", "Which models are available?"),
+     "I answer with Google Gemini and, when configured, Together AI models, picking a model for each message. "
+     "/models lists them with their recent latency and /models <name> pins one."),
+    (("How do I switch the AI?", "How do I change the AI model?", "Can I use Gemini or Together?"),
+     "Use /ai gemini or /ai together to choose a service, /ai auto to let me pick per message, "
+     "and /models <name> to pin a specific model."),
+    (("Do you remember our conversation?", "Do you have memory?"),
+     f"I remember the last {Config.MAX_CONVERSATION_LENGTH} messages of our conversation until you send /clear."),
+    (("What is the rate limit?", "How many messages can I send?", "Why am I sending messages too quickly?"),
+     f"To keep things fair, everyone can send {Config.RATE_LIMIT_REQUESTS} messages every "
+     f"{Config.RATE_LIMIT_WINDOW} seconds. Wait a moment and try again."),
+]
+
+
+class FaqEntry(NamedTuple):
+    """An answer and the phrasings of the question it answers."""
+    id: int
+    questions: Tuple[str, ...]
+    answer: str
+
+
+class FaqMatch(NamedTuple):
+    """The entry a message matched, through which phrasing, and how confidently."""
+    entry: FaqEntry
+    question: str
+    confidence: float
+
+
+class _Document(NamedTuple):
+    """One indexed question phrasing."""
+    entry_id: int
+    question: str
+    terms: FrozenSet[str]
+    length: int
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens with plural "s" stripped, as indexed and queried."""
+    tokens = []
+    for token in _TOKEN.findall(text.casefold()):
+        if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def looks_like_follow_up(text: str) -> bool:
+    """
+    Whether a message probably continues the previous turn rather than standing alone.
+
+    Messages that refer back ("how does that work?", "and in Python?") need the
+    conversation's context, so they are not answered from the FAQ in the middle of a conversation.
+    """
+    words = _TOKEN.findall(text.casefold())
+    if not words:
+        return False
+    return (words[0] in _CONTINUATIONS or " ".join(words[:2]) in _CONTINUATIONS
+            or any(word in _BACK_REFERENCES for word in words))
+
+
+class FaqIndex:
+    """Admin-managed FAQ entries with an incrementally updated BM25 index."""
+
+    def __init__(self, path: str = None, min_confidence: float = None, max_chars: int = None,
+                 reload_interval: float = None):
+        """
+        Initialize the index and load the entries.
+
+        Args:
+            path: JSON file holding the entries, "" to keep them in memory only (default Config.FAQ_FILE)
+            min_confidence: Confidence a match needs to be answered (default Config.FAQ_MIN_CONFIDENCE)
+            max_chars: Longer messages are not looked up (default Config.FAQ_MAX_CHARS)
+            reload_interval: Seconds between checks of the file for changes by other processes
+                (default Config.FAQ_RELOAD_INTERVAL, 0 disables)
+        """
+        self.path = path if path is not None else Config.FAQ_FILE
+        self.min_confidence = min_confidence if min_confidence is not None else Config.FAQ_MIN_CONFIDENCE
+        self.max_chars = max_chars if max_chars is not None else Config.FAQ_MAX_CHARS
+        self.reload_interval = reload_interval if reload_interval is not None else Config.FAQ_RELOAD_INTERVAL
+        self.enabled = Config.FAQ_ENABLED
+        self.logger = logging.getLogger(__name__)
+
+        self._entries: Dict[int, FaqEntry] = {}
+        self._documents: Dict[int, _Document] = {}
+        # term -> {document ID: term frequency}
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._total_length = 0
+        self._next_document = 0
+        self._mtime: Optional[float] = None
+        self._next_reload_check = 0.0
+
+        self.lookups = 0
+        self.hits = 0
+        self.skipped = 0
+        self.entry_hits: Dict[int, int] = {}
+        self.confidence_counts = [0] * len(CONFIDENCE_BUCKETS)
+        self._lookup_seconds = 0.0
+        self._max_lookup_seconds = 0.0
+
+        self.load()
+
+    def load(self):
+        """(Re)build the index from the file; without one it is empty or holds the built-in entries."""
+        entries = None
+        if self.path:
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    data = json.load(f)
+                self._mtime = os.stat(self.path).st_mtime
+                entries = [FaqEntry(int(item["id"]), tuple(item["questions"]), item["answer"])
+                           for item in data["entries"]]
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                self.logger.warning("Ignoring unreadable FAQ file %s: %s", self.path, e)
+        if entries is None:
+            entries = [FaqEntry(number, questions, answer)
+                       for number, (questions, answer) in enumerate(_BUILTIN_ENTRIES, start=1)
+                       if Config.FAQ_BUILTIN]
+
+        self._entries.clear()
+        self._documents.clear()
+        self._postings.clear()
+        self._total_length = 0
+        for entry in entries:
+            self._index(entry)
+        self.logger.info("Loaded %d FAQ entries (%d phrasings, %d terms)",
+                         len(self._entries), len(self._documents), len(self._postings))
+
+    @property
+    def entries(self) -> List[FaqEntry]:
+        return sorted(self._entries.values())
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def add(self, questions: Sequence[str], answer: str) -> FaqEntry:
+        """
+        Add an entry, index it and save the file.
+
+        Args:
+            questions: Phrasings of the question
+            answer: Reply sent for matching messages
+
+        Returns:
+            The new entry
+
+        Raises:
+            ValueError: If no phrasing has words or the answer is empty
+        """
+        questions = tuple(question.strip() for question in questions if tokenize(question))
+        answer = answer.strip()
+        if not questions or not answer:
+            raise ValueError("An FAQ entry needs a question and an answer")
+        entry = FaqEntry(max(self._entries, default=0) + 1, questions, answer)
+        self._index(entry)
+        self._save()
+        return entry
+
+    def remove(self, entry_id: int) -> bool:
+        """Remove an entry and its phrasings from the index and save the file; False if there is none."""
+        if self._entries.pop(entry_id, None) is None:
+            return False
+        for document_id in [document_id for document_id, document in self._documents.items()
+                            if document.entry_id == entry_id]:
+            document = self._documents.pop(document_id)
+            self._total_length -= document.length
+            for term in document.terms:
+                postings = self._postings[term]
+                del postings[document_id]
+                if not postings:
+                    del self._postings[term]
+        self.entry_hits.pop(entry_id, None)
+        self._save()
+        return True
+
+    def lookup(self, text: str) -> Optional[FaqMatch]:
+        """
+        Match a message against the FAQ, recording hit rate and confidence.
+
+        Args:
+            text: The user's message
+
+        Returns:
+            The match if its confidence reaches min_confidence, else None
+        """
+        if not self.enabled:
+            return None
+        if len(text) > self.max_chars:
+            self.skipped += 1
+            return None
+        started = time.perf_counter()
+        if self.reload_interval > 0 and started >= self._next_reload_check:
+            self._next_reload_check = started + self.reload_interval
+            self._reload_if_changed()
+
+        match = self.best_match(text)
+        confidence = match.confidence if match else 0.0
+        hit = confidence >= self.min_confidence
+
+        elapsed = time.perf_counter() - started
+        self.lookups += 1
+        self._lookup_seconds += elapsed
+        self._max_lookup_seconds = max(self._max_lookup_seconds, elapsed)
+        self.confidence_counts[min(bisect.bisect_left(CONFIDENCE_BUCKETS, confidence), len(CONFIDENCE_BUCKETS) - 1)] += 1
+        if not hit:
+            return None
+        self.hits += 1
+        self.entry_hits[match.entry.id] = self.entry_hits.get(match.entry.id, 0) + 1
+        return match
+
+    def best_match(self, text: str) -> Optional[FaqMatch]:
+        """
+        Best-matching entry for a message, however low its confidence (no statistics recorded).
+
+        Candidates are ranked with BM25; confidence is the IDF-weighted overlap of
+        the message's terms with a candidate phrasing's terms (weighted Jaccard),
+        so words the phrasing lacks and words the message adds both lower it.
+
+        Args:
+            text: The message
+
+        Returns:
+            The best match, or None if no phrasing shares a term with the message
+        """
+        terms = set(tokenize(text))
+        if not terms or not self._documents:
+            return None
+
+        documents = len(self._documents)
+        average_length = self._total_length / documents
+        scores: Dict[int, float] = {}
+        for term in terms:
+            postings = self._postings.get(term)
+            if not postings:
+                continue
+            idf = self._idf(len(postings), documents)
+            for document_id, frequency in postings.items():
+                length_norm = 1 - _B + _B * self._documents[document_id].length / average_length
+                scores[document_id] = (scores.get(document_id, 0.0)
+                                       + idf * frequency * (_K1 + 1) / (frequency + _K1 * length_norm))
+        if not scores:
+            return None
+
+        # Filler words count only where the FAQ itself uses them
+        terms = {term for term in terms if term in self._postings or term not in _STOPWORDS}
+        best: Optional[FaqMatch] = None
+        for document_id in heapq.nlargest(_CANDIDATES, scores, key=scores.get):
+            document = self._documents[document_id]
+            shared = sum(self._weight(term, documents) for term in terms & document.terms)
+            total = sum(self._weight(term, documents) for term in terms | document.terms)
+            confidence = shared / total if total else 0.0
+            if best is None or confidence > best.confidence:
+                best = FaqMatch(self._entries[document.entry_id], document.question, confidence)
+        return best
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Hit rate, confidence histogram and lookup cost for status output and metrics.
+
+        Returns:
+            Counters, with cumulative confidence counts keyed by bucket bound ("le", as in Prometheus)
+        """
+        buckets: Dict[str, int] = {}
+        cumulative = 0
+        for bound, count in zip(CONFIDENCE_BUCKETS, self.confidence_counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "phrasings": len(self._documents),
+            "terms": len(self._postings),
+            "min_confidence": self.min_confidence,
+            "lookups": self.lookups,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+            "skipped_long": self.skipped,
+            "confidence_buckets": buckets,
+            "avg_lookup_us": round(self._lookup_seconds / self.lookups * 1e6, 1) if self.lookups else 0.0,
+            "max_lookup_us": round(self._max_lookup_seconds * 1e6, 1),
+        }
+
+    def _index(self, entry: FaqEntry):
+        """Add an entry's phrasings to the inverted index."""
+        self._entries[entry.id] = entry
+        for question in entry.questions:
+            tokens = tokenize(question)
+            document_id = self._next_document
+            self._next_document += 1
+            self._documents[document_id] = _Document(entry.id, question, frozenset(tokens), len(tokens))
+            self._total_length += len(tokens)
+            for term in set(tokens):
+                self._postings.setdefault(term, {})[document_id] = tokens.count(term)
+
+    @staticmethod
+    def _idf(document_frequency: int, documents: int) -> float:
+        """BM25 inverse document frequency (always positive)."""
+        return math.log(1 + (documents - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    def _weight(self, term: str, documents: int) -> float:
+        """IDF of a term, treating terms the index lacks as the rarest."""
+        postings = self._postings.get(term)
+        return self._idf(len(postings) if postings else 0, documents)
+
+    def _reload_if_changed(self):
+        """Rebuild the index if another process rewrote the file."""
+        if not self.path:
+            return
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self.load()
+
+    def _save(self):
+        """Write the entries to the file (aside, then renamed, so readers never see half a file)."""
+        if not self.path:
+            return
+        data = {"entries": [entry._asdict() for entry in self.entries]}
+        temp_file = f"{self.path}.tmp"
+        try:
+            with open(temp_file, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(temp_file, self.path)
+            self._mtime = os.stat(self.path).st_mtime
+        except OSError as e:
+            self.logger.warning("Could not save FAQ entries to %s: %s", self.path, e)
+
+
+def format_entries(index: FaqIndex) -> str:
+    """Plain-text overview of the entries and hit rate for the /faq command."""
+    stats = index.stats()
+    lines = [f"FAQ: {stats['entries']} entries, {stats['hits']} of {stats['lookups']} messages answered "
+             f"({stats['hit_rate']:.1%}), min confidence {stats['min_confidence']:g}, "
+             f"{stats['avg_lookup_us']:.0f} µs per lookup"]
+    for entry in index.entries:
+        more = f" (+{len(entry.questions) - 1} more)" if len(entry.questions) > 1 else ""
+        lines.append(f"{entry.id}. {entry.questions[0]}{more}: {index.entry_hits.get(entry.id, 0)} answered")
+    return "\n".join(lines)
@@ -3,11 +3,42 @@ Gemini AI service for generating intelligent responses.
 Handles communication with Google's Gemini API.
 """
 
+import asyncio
+import concurrent.futures
 import logging
 import os
-from typing import List, Dict
-from google import genai
-from google.genai import types
+import threading
+import time
+from typing import TYPE_CHECKING, List, Dict, Optional, Tuple
+
+from config import Config
+from health import ProviderHealth
+from key_pool import ApiKey, KeyPool, parse_keys
+from model_router import model_stats, prompt_complexity
+from tracing import tracer
+
+if TYPE_CHECKING:
+    from google.genai import types
+
+# google.genai takes around half a second to import, so it is loaded on first use
+_genai = None
+_types = None
+
+def _load_genai():
+    """Import the Gemini SDK on first use and return (genai, types)."""
+    global _genai, _types
+    if _genai is None:
+        from google import genai
+        from google.genai import types
+        _genai, _types = genai, types
+    return _genai, _types
+
+# Allowed thinking budgets per model family (pro cannot switch thinking off)
+_THINKING_LIMITS = {"gemini-2.5-pro": (128, 32768)}
+_DEFAULT_THINKING_LIMITS = (0, 24576)
+
+# Models without thinking support get no thinking config at all
+_NO_THINKING_PREFIXES = ("gemini-1.", "gemini-2.0")
 
 class GeminiService:
     """Service class for interacting with Gemini AI API."""
@@ -16,13 +47,31 @@ class GeminiService:
         """Initialize the Gemini service with API client."""
         self.logger = logging.getLogger(__name__)
         
-        # Initialize Gemini client
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
+        # API keys: a pool from GEMINI_API_KEYS ("key1,key2:weight") or the single GEMINI_API_KEY;
+        # each key's client is created on first use
+        keys = parse_keys(os.getenv("GEMINI_API_KEYS") or os.getenv("GEMINI_API_KEY") or "")
+        if not keys:
             raise ValueError("GEMINI_API_KEY environment variable is required")
+        self.keys = KeyPool("gemini", keys, self._create_client, rpm=Config.GEMINI_KEY_RPM, tpm=Config.GEMINI_KEY_TPM)
+        
+        # Threads for the blocking parts of a request: importing the SDK, building clients and
+        # request contents (the API call itself is awaited on the loop, so cancelling aborts it)
+        self._executor = concurrent.futures.ThreadPoolExecutor(Config.PROVIDER_CONCURRENCY, thread_name_prefix="gemini-call")
         
-        self.client = genai.Client(api_key=api_key)
-        self.model_name = "gemini-2.5-flash"
+        # Available models, keyed by model ID; the first is the default
+        self.available_models = {model: model for model in Config.GEMINI_MODELS}
+        self.model_name = Config.GEMINI_MODELS[0]
+        
+        # Thinking budget: "auto" (per prompt complexity), "dynamic" (model decides) or a token count
+        self.thinking_budget = Config.GEMINI_THINKING_BUDGET
+        self.tier_budgets = {
+            "simple": Config.GEMINI_THINKING_BUDGET_SIMPLE,
+            "moderate": Config.GEMINI_THINKING_BUDGET_MODERATE,
+            "complex": Config.GEMINI_THINKING_BUDGET_COMPLEX,
+        }
+        # Per budget tier: [requests, thinking tokens, seconds]
+        self.thinking_stats: Dict[str, List[float]] = {}
+        self._stats_lock = threading.Lock()
         
         # System instruction for the bot
         self.system_instruction = (
@@ -32,45 +81,234 @@ class GeminiService:
             "If you're unsure about something, acknowledge it honestly. "
             "Avoid generating harmful, inappropriate, or misleading content."
         )
+        
+        # Health from real traffic, with cheap model lookups as a fallback probe
+        self.health = ProviderHealth("gemini", self._probe)
     
-    async def generate_response(self, message: str, conversation_history: List[Dict[str, str]] = None) -> str:
+    @staticmethod
+    def _create_client(api_key: str):
+        """Import the SDK if needed and construct a client for one API key."""
+        genai, types = _load_genai()
+        http_options = types.HttpOptions(base_url=Config.GEMINI_BASE_URL) if Config.GEMINI_BASE_URL else None
+        return genai.Client(api_key=api_key, http_options=http_options)
+    
+    @property
+    def client(self):
+        """Gemini API client of the first key (for probes), constructed on first access."""
+        return self.keys.client(self.keys.keys[0])
+    
+    def prewarm(self):
+        """
+        Import the SDK and construct every key's client ahead of the first request.
+        
+        With PROVIDER_PREWARM_CONNECT each client also looks up the default model,
+        which opens its connection so the first generation skips the TLS handshake.
+        """
+        for key in self.keys.keys:
+            client = self.keys.client(key)
+            if Config.PROVIDER_PREWARM_CONNECT:
+                try:
+                    client.models.get(model=self.model_name)
+                except Exception as e:
+                    self.logger.warning("Failed to open a connection for %s: %s", key.label, e)
+    
+    async def generate_response(self, message: str, conversation_history: List[Dict[str, str]] = None, model_name: str = None) -> str:
         """
         Generate a response using Gemini AI.
         
         Args:
             message: The user's message
             conversation_history: List of previous messages in format [{"role": "user/assistant", "content": "text"}]
+            model_name: Specific model to use (one of GEMINI_MODELS)
         
         Returns:
             Generated response text
         """
+        model = self.available_models.get(model_name, self.model_name)
+        
+        with tracer.span("gemini.generate_response", model=model) as span:
+            response_text = await self._generate_response(message, conversation_history, model)
+            if span:
+                span.set_attribute("response_length", len(response_text))
+            return response_text
+    
+    def _build_contents(self, message: str, conversation_history: List[Dict[str, str]] = None) -> List["types.Content"]:
+        """
+        Convert the conversation history and current message into Gemini contents.
+        
+        Args:
+            message: The user's message
+            conversation_history: Previous messages, ending with the current one
+        
+        Returns:
+            Contents list for generate_content
+        """
+        _, types = _load_genai()
+        contents = []
+        
+        # Add conversation history if available
+        if conversation_history:
+            for msg in conversation_history[:-1]:  # Exclude the current message as it's already included
+                role = "user" if msg["role"] == "user" else "model"
+                contents.append(types.Content(role=role, parts=[types.Part(text=msg["content"])]))
+        
+        # Add the current message
+        contents.append(types.Content(role="user", parts=[types.Part(text=message)]))
+        return contents
+    
+    def _build_request(self, message: str, conversation_history: List[Dict[str, str]],
+                       budget: Optional[int]) -> Tuple[List["types.Content"], "types.GenerateContentConfig"]:
+        """
+        Build the contents and config of a generate_content call.
+        
+        Runs on a worker thread: the first request imports the SDK here.
+        
+        Args:
+            message: The user's message
+            conversation_history: Previous messages, ending with the current one
+            budget: Thinking budget from select_thinking_budget()
+        
+        Returns:
+            (contents, config) for generate_content
+        """
+        _, types = _load_genai()
+        thinking_config = types.ThinkingConfig(thinking_budget=budget) if budget is not None else None
+        config = types.GenerateContentConfig(
+            system_instruction=self.system_instruction,
+            temperature=0.7,
+            max_output_tokens=1000,
+            top_p=0.8,
+            top_k=40,
+            thinking_config=thinking_config
+        )
+        return self._build_contents(message, conversation_history), config
+    
+    async def _generate_content(self, key: ApiKey, **kwargs):
+        """
+        Call generate_content through a key's asyncio client.
+        
+        Cancelling the awaiting task aborts the HTTP request, so a superseded request
+        stops spending tokens and its provider slot is free once this returns.
+        """
+        # Building the client may import the SDK, so a new key's client is built on a worker thread
+        client = key.client or await asyncio.get_running_loop().run_in_executor(self._executor, self.keys.client, key)
+        return await client.aio.models.generate_content(**kwargs)
+    
+    def set_thinking_budget(self, value: str):
+        """
+        Change the default thinking budget at runtime.
+        
+        Args:
+            value: "auto", "dynamic", "off" or a token count
+        
+        Raises:
+            ValueError: If the value is not recognised
+        """
+        value = value.strip().lower()
+        if value == "off":
+            value = "0"
+        if value not in ("auto", "dynamic") and not (value.isdigit() and int(value) <= 32768):
+            raise ValueError(f"Invalid thinking budget: {value}")
+        self.thinking_budget = value
+        self.logger.info("Gemini thinking budget set to %s", value)
+    
+    def select_thinking_budget(self, message: str, conversation_history: List[Dict[str, str]], model: str) -> Tuple[str, Optional[int]]:
+        """
+        Choose the thinking budget for one request.
+        
+        Args:
+            message: The user's message
+            conversation_history: Messages so far, including the current one
+            model: Gemini model ID
+        
+        Returns:
+            (tier, budget) where budget is a token count, -1 for dynamic, or None when the model cannot think
+        """
+        if model.startswith(_NO_THINKING_PREFIXES):
+            return "none", None
+        
+        setting = self.thinking_budget
+        if setting == "dynamic":
+            return "dynamic", -1
+        if setting == "auto":
+            tier = prompt_complexity(message, conversation_history)
+            budget = self.tier_budgets[tier]
+        else:
+            tier, budget = "fixed", int(setting)
+        
+        if budget < 0:
+            return tier, -1
+        low, high = _THINKING_LIMITS.get(model, _DEFAULT_THINKING_LIMITS)
+        return tier, min(max(budget, low), high)
+    
+    def _record_thinking(self, tier: str, thinking_tokens: int, latency: float):
+        """Accumulate thinking tokens and latency per budget tier."""
+        with self._stats_lock:
+            stats = self.thinking_stats.setdefault(tier, [0, 0, 0.0])
+            stats[0] += 1
+            stats[1] += thinking_tokens
+            stats[2] += latency
+    
+    def thinking_report(self) -> Dict[str, Dict[str, float]]:
+        """Average thinking tokens and latency per budget tier."""
+        with self._stats_lock:
+            return {
+                tier: {
+                    "requests": int(requests),
+                    "avg_thinking_tokens": round(tokens / requests, 1),
+                    "avg_latency_s": round(seconds / requests, 3),
+                }
+                for tier, (requests, tokens, seconds) in self.thinking_stats.items()
+            }
+    
+    async def _generate_response(self, message: str, conversation_history: List[Dict[str, str]], model: str) -> str:
+        """Build the prompt and call the Gemini API inside the current trace."""
         try:
-            # Prepare the conversation context
-            contents = []
+            loop = asyncio.get_running_loop()
             
-            # Add conversation history if available
-            if conversation_history:
-                for msg in conversation_history[:-1]:  # Exclude the current message as it's already included
-                    role = "user" if msg["role"] == "user" else "model"
-                    contents.append(types.Content(role=role, parts=[types.Part(text=msg["content"])]))
+            # Simple prompts skip (or shorten) thinking to cut latency
+            tier, budget = self.select_thinking_budget(message, conversation_history, model)
             
-            # Add the current message
-            contents.append(types.Content(role="user", parts=[types.Part(text=message)]))
+            # Prepare the conversation context (off the event loop: the first request imports the SDK)
+            with tracer.span("gemini.build_prompt") as span:
+                contents, config = await loop.run_in_executor(
+                    self._executor, self._build_request, message, conversation_history, budget
+                )
+                if span:
+                    span.set_attribute("contents", len(contents))
             
-            self.logger.info(f"Generating response for message: {message[:50]}...")
+            self.logger.info("Generating response with %s for message of %d chars", model, len(message))
             
-            # Generate response
-            response = self.client.models.generate_content(
-                model=self.model_name,
-                contents=contents,
-                config=types.GenerateContentConfig(
-                    system_instruction=self.system_instruction,
-                    temperature=0.7,
-                    max_output_tokens=1000,
-                    top_p=0.8,
-                    top_k=40
-                )
-            )
+            # Generate response, moving to another API key if this one is rate limited or rejected
+            started = time.monotonic()
+            with tracer.span("gemini.generate_content", thinking_tier=tier, thinking_budget=budget if budget is not None else "none") as span:
+                for attempt in range(self.keys.max_attempts):
+                    key = self.keys.acquire()
+                    try:
+                        response = await self._generate_content(
+                            key,
+                            model=model,
+                            contents=contents,
+                            config=config
+                        )
+                        break
+                    except Exception as e:
+                        if self.keys.record_failure(key, e) and attempt + 1 < self.keys.max_attempts:
+                            self.logger.warning("Gemini key %s failed, trying another: %s", key.label, e)
+                            continue
+                        self.health.record_failure(e)
+                        model_stats.record(model, time.monotonic() - started, ok=False)
+                        raise
+                usage = response.usage_metadata
+                self.keys.record_success(key, (usage and usage.total_token_count) or 0)
+                thinking_tokens = (usage and usage.thoughts_token_count) or 0
+                if span:
+                    span.set_attribute("thinking_tokens", thinking_tokens)
+                    span.set_attribute("api_key", key.label)
+            latency = time.monotonic() - started
+            self.health.record_success(latency)
+            model_stats.record(model, latency, ok=True)
+            self._record_thinking(tier, thinking_tokens, latency)
             
             if response.text:
                 self.logger.info("Successfully generated response")
@@ -80,7 +318,7 @@ class GeminiService:
                 return "I'm sorry, I couldn't generate a response right now. Please try again."
                 
         except Exception as e:
-            self.logger.error(f"Error generating response: {str(e)}")
+            self.logger.error("Error generating response: %s", e)
             
             # Provide specific error messages based on the type of error
             error_message = "I'm experiencing technical difficulties. Please try again in a moment."
@@ -94,23 +332,21 @@ class GeminiService:
             
             return f"❌ {error_message}"
     
+    def get_available_models(self) -> Dict[str, str]:
+        """Get list of available models."""
+        return self.available_models.copy()
+    
+    def _probe(self):
+        """Look up the model's metadata; free of generation quota and raises on failure."""
+        self.client.models.get(model=self.model_name)
+    
     def is_healthy(self) -> bool:
         """
-        Check if the Gemini service is healthy by making a simple test request.
+        Check if the Gemini service is healthy using cached health data.
+        
+        Never makes a request; the background prober and real traffic keep it current.
         
         Returns:
-            True if service is healthy, False otherwise
+            True if service is known to be healthy, False otherwise
         """
-        try:
-            response = self.client.models.generate_content(
-                model=self.model_name,
-                contents="Hello",
-                config=types.GenerateContentConfig(
-                    system_instruction=self.system_instruction,
-                    max_output_tokens=50
-                )
-            )
-            return bool(response.text)
-        except Exception as e:
-            self.logger.error(f"Health check failed: {str(e)}")
-            return False
+        return self.health.is_healthy()
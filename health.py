@@ -0,0 +1,164 @@
+"""
+Cached provider health from passive traffic and lightweight background probes.
+Lets /status and the webhook health route report provider health without
+spending quota on test generations.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, List, Optional
+
+from config import Config
+
+
+class ProviderHealth:
+    """Health of one AI provider, derived from real requests and periodic probes."""
+
+    def __init__(self, name: str, probe: Callable[[], None]):
+        """
+        Initialize health tracking.
+
+        Args:
+            name: Provider name used in logs and status output
+            probe: Cheap call that raises if the provider is unreachable (e.g. model lookup)
+        """
+        self.name = name
+        self.probe = probe
+        self.logger = logging.getLogger(__name__)
+
+        self.ttl = Config.HEALTH_CHECK_TTL
+        self.error_threshold = Config.HEALTH_ERROR_THRESHOLD
+        self.min_samples = Config.HEALTH_MIN_SAMPLES
+
+        # Recent real requests: (timestamp, succeeded)
+        self.outcomes: deque = deque(maxlen=200)
+        self.last_latency: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+        # Last active probe
+        self.probe_ok: Optional[bool] = None
+        self.probe_time = 0.0
+        self.probe_latency: Optional[float] = None
+
+        self._lock = threading.Lock()
+
+    def record_success(self, latency: float):
+        """Record a successful real request."""
+        with self._lock:
+            self.outcomes.append((time.monotonic(), True))
+            self.last_latency = latency
+
+    def record_failure(self, error: BaseException):
+        """Record a failed real request."""
+        with self._lock:
+            self.outcomes.append((time.monotonic(), False))
+            self.last_error = f"{type(error).__name__}: {error}"
+
+    def _recent_outcomes(self, now: float) -> List[bool]:
+        """Outcomes of real requests within the TTL."""
+        return [ok for timestamp, ok in self.outcomes if timestamp > now - self.ttl]
+
+    def needs_probe(self) -> bool:
+        """Whether an active probe is needed because there is no fresh signal."""
+        now = time.monotonic()
+        with self._lock:
+            has_traffic = len(self._recent_outcomes(now)) >= self.min_samples
+        return not has_traffic and now - self.probe_time >= self.ttl
+
+    def run_probe(self):
+        """Run the probe and cache its result."""
+        started = time.monotonic()
+        try:
+            self.probe()
+            ok = True
+        except Exception as e:
+            ok = False
+            self.last_error = f"{type(e).__name__}: {e}"
+            self.logger.warning("%s health probe failed: %s", self.name, e)
+
+        with self._lock:
+            self.probe_ok = ok
+            self.probe_time = time.monotonic()
+            self.probe_latency = self.probe_time - started
+
+    def snapshot(self) -> dict:
+        """
+        Current health without any network access.
+
+        Real traffic within the TTL takes precedence over probe results.
+        """
+        now = time.monotonic()
+        with self._lock:
+            recent = self._recent_outcomes(now)
+            if len(recent) >= self.min_samples:
+                error_rate = recent.count(False) / len(recent)
+                return {
+                    "healthy": error_rate < self.error_threshold,
+                    "source": "traffic",
+                    "error_rate": round(error_rate, 3),
+                    "samples": len(recent),
+                    "latency_ms": round(self.last_latency * 1000, 1) if self.last_latency is not None else None,
+                    "last_error": self.last_error,
+                }
+
+            if self.probe_ok is not None:
+                return {
+                    "healthy": self.probe_ok,
+                    "source": "probe",
+                    "age_s": round(now - self.probe_time, 1),
+                    "latency_ms": round(self.probe_latency * 1000, 1),
+                    "last_error": None if self.probe_ok else self.last_error,
+                }
+
+        return {"healthy": None, "source": "unknown"}
+
+    def is_healthy(self) -> bool:
+        """Whether the provider is known to be healthy."""
+        return self.snapshot()["healthy"] is True
+
+
+class HealthProber:
+    """Background thread that probes providers lacking recent traffic."""
+
+    def __init__(self, interval: float = None):
+        """Initialize the prober; interval defaults to Config.HEALTH_PROBE_INTERVAL."""
+        self.interval = interval if interval is not None else Config.HEALTH_PROBE_INTERVAL
+        self.providers: List[ProviderHealth] = []
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def register(self, health: Optional[ProviderHealth]):
+        """Add a provider to probe; None is ignored for unavailable services."""
+        if health is not None:
+            self.providers.append(health)
+
+    def start(self):
+        """Start probing in a daemon thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="health-prober", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the probing thread."""
+        self._stop.set()
+
+    def _run(self):
+        """Probe each provider that has no fresh signal, then sleep."""
+        while not self._stop.is_set():
+            for health in self.providers:
+                if health.needs_probe():
+                    health.run_probe()
+            self._stop.wait(self.interval)
+
+
+def describe(snapshot: dict) -> str:
+    """Short human-readable health for status messages."""
+    if snapshot["healthy"] is None:
+        return "⏳ Checking..."
+    if not snapshot["healthy"]:
+        return "🔴 Unhealthy"
+    if snapshot["source"] == "traffic":
+        return f"⚡ Healthy ({snapshot['error_rate']:.0%} errors)"
+    return "⚡ Healthy"
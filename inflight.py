@@ -0,0 +1,157 @@
+"""
+Per-user tracking of in-flight generations.
+When a user sends a new message while an earlier one is still being answered,
+the earlier generation is cancelled ("cancel"), cancelled with its text folded
+into the new prompt ("merge"), or left to finish first ("queue"). /clear aborts
+all of a user's pending generations. A cancelled generation waiting for a
+provider slot leaves the scheduler queue, and one holding a slot releases it
+immediately for other users.
+"""
+
+import asyncio
+from typing import Dict, List, Optional
+
+from config import Config
+
+POLICIES = ("cancel", "queue", "merge")
+
+
+class Generation:
+    """One message being answered by the handler task that registered it."""
+
+    __slots__ = ("user_id", "text", "task", "superseded", "previous", "_finished")
+
+    def __init__(self, user_id: int, text: str, task: asyncio.Task, previous: Optional["Generation"] = None):
+        self.user_id = user_id
+        self.text = text
+        self.task = task
+        # Set when cancelled by a newer message or /clear (as opposed to shutdown)
+        self.superseded = False
+        # Generation to wait for under the "queue" policy
+        self.previous = previous
+        # Created only when a queued generation waits for this one
+        self._finished: Optional[asyncio.Future] = None
+
+
+class InFlightGenerations:
+    """Registers each user's running generations and applies the supersede policy."""
+
+    def __init__(self, policy: Optional[str] = None):
+        """
+        Initialize the tracker.
+
+        Args:
+            policy: "cancel", "queue" or "merge" (default Config.SUPERSEDE_POLICY)
+
+        Raises:
+            ValueError: If the policy is not recognised
+        """
+        self.policy = policy or Config.SUPERSEDE_POLICY
+        if self.policy not in POLICIES:
+            raise ValueError(f"Invalid supersede policy: {self.policy}")
+        self._pending: Dict[int, List[Generation]] = {}
+        self.superseded = 0
+        self.aborted = 0
+
+    def pending(self, user_id: int) -> int:
+        """Generations registered for a user that have not finished."""
+        return len(self._pending.get(user_id, ()))
+
+    def begin(self, user_id: int, text: str) -> Generation:
+        """
+        Register the current task as answering a message.
+
+        Earlier generations of the user are cancelled ("cancel", "merge") or, under
+        "queue", waited for in wait_turn(). Until finish() is called the current task
+        may be cancelled by a newer message or /clear; the caller should then check
+        dropped().
+
+        Args:
+            user_id: Telegram user ID
+            text: The message text
+
+        Returns:
+            The generation; its text is the prompt to answer, which under "merge"
+            starts with the text of the messages it superseded
+        """
+        earlier = self._pending.get(user_id)
+        previous = None
+        if earlier:
+            if self.policy == "queue":
+                previous = earlier[-1]
+            else:
+                merged = [generation.text for generation in list(earlier) if self._cancel(generation)]
+                self.superseded += len(merged)
+                if self.policy == "merge" and merged:
+                    text = "\n\n".join(merged + [text])
+
+        generation = Generation(user_id, text, asyncio.current_task(), previous)
+        self._pending.setdefault(user_id, []).append(generation)
+        return generation
+
+    @staticmethod
+    async def wait_turn(generation: Generation):
+        """Under "queue", wait until the user's previous generation has finished."""
+        previous = generation.previous
+        if previous is None:
+            return
+        generation.previous = None
+        if previous._finished is None:
+            previous._finished = asyncio.get_running_loop().create_future()
+        # Only the ordering matters here, not how the previous generation ended
+        await asyncio.shield(previous._finished)
+
+    def finish(self, generation: Generation):
+        """Unregister a generation; call before awaiting anything else (e.g. sending the reply)."""
+        generations = self._pending.get(generation.user_id)
+        if generations is not None:
+            try:
+                generations.remove(generation)
+            except ValueError:
+                pass
+            if not generations:
+                del self._pending[generation.user_id]
+        if generation._finished is not None and not generation._finished.done():
+            generation._finished.set_result(None)
+
+    @staticmethod
+    def dropped(generation: Generation) -> bool:
+        """
+        Whether a CancelledError caught by the handler was caused by a newer message or /clear.
+
+        If so, the cancellation is consumed and the handler should return without replying;
+        otherwise (e.g. shutdown) it must be re-raised.
+        """
+        if not generation.superseded:
+            return False
+        generation.task.uncancel()
+        return True
+
+    def abort(self, user_id: int) -> int:
+        """
+        Cancel all of a user's pending generations (for /clear).
+
+        Returns:
+            Number of generations cancelled
+        """
+        cancelled = sum(1 for generation in list(self._pending.get(user_id, ())) if self._cancel(generation))
+        self.aborted += cancelled
+        return cancelled
+
+    def stats(self) -> Dict[str, object]:
+        """Policy and counters for status output."""
+        return {
+            "policy": self.policy,
+            "users": len(self._pending),
+            "pending": sum(len(generations) for generations in self._pending.values()),
+            "superseded": self.superseded,
+            "aborted": self.aborted,
+        }
+
+    def _cancel(self, generation: Generation) -> bool:
+        """Cancel a generation's task, once, and unregister it."""
+        if generation.superseded or generation.task is asyncio.current_task() or not generation.task.cancel():
+            return False
+        generation.superseded = True
+        self.finish(generation)
+        return True
@@ -0,0 +1,270 @@
+"""
+Pools of provider API keys.
+Requests are spread over several keys by smooth weighted round robin, so the
+aggregate quota grows with the number of keys. Each key's requests and tokens
+over the last minute are tracked against its quota, and a key that is rate
+limited or rejected is quarantined for a while so traffic moves to the others.
+"""
+
+import re
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from config import Config
+
+# Gemini reports the wait in a RetryInfo detail ("retryDelay": "17s") rather than a header
+_RETRY_DELAY = re.compile(r"retry[-_ ]?(?:after|delay)\W+(\d+(?:\.\d+)?)", re.IGNORECASE)
+
+# Statuses that concern the key rather than the provider, so another key may succeed
+_KEY_STATUSES = (401, 403, 429)
+
+# Longest quarantine: after repeated rate limits, and for keys the provider rejects
+_MAX_QUARANTINE = 900.0
+
+
+def parse_keys(value: str) -> List[Tuple[str, float]]:
+    """
+    Parse a comma-separated key list; a numeric ":N" suffix sets a key's weight.
+
+    Args:
+        value: e.g. "key1,key2:2"
+
+    Returns:
+        (key, weight) pairs
+    """
+    keys = []
+    for entry in value.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        key, _, weight = entry.rpartition(":")
+        try:
+            keys.append((key, float(weight)) if key else (entry, 1.0))
+        except ValueError:
+            keys.append((entry, 1.0))
+    return keys
+
+
+def error_status(error: BaseException) -> Optional[int]:
+    """HTTP status of a provider SDK error, if it carries one."""
+    for attribute in ("code", "status_code"):
+        status = getattr(error, attribute, None)
+        if isinstance(status, int):
+            return status
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Seconds the provider asked us to wait, from a Retry-After header or the error details."""
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if headers is not None:
+        try:
+            return float(headers.get("retry-after"))
+        except (TypeError, ValueError):
+            pass
+    match = _RETRY_DELAY.search(str(error))
+    return float(match.group(1)) if match else None
+
+
+class ApiKey:
+    """One API key with its client, usage window and quarantine state."""
+
+    __slots__ = ("key", "label", "weight", "client", "async_client", "current", "recent_requests", "recent_tokens",
+                 "window_tokens", "requests", "rate_limited", "failures", "strikes", "quarantined_until")
+
+    def __init__(self, key: str, label: str, weight: float):
+        self.key = key
+        self.label = label
+        self.weight = weight
+        self.client = None
+        self.async_client = None
+        # Smooth weighted round robin state
+        self.current = 0.0
+        # Request timestamps and (timestamp, tokens) of responses in the last minute
+        self.recent_requests: Deque[float] = deque()
+        self.recent_tokens: Deque[Tuple[float, int]] = deque()
+        self.window_tokens = 0
+        self.requests = 0
+        self.rate_limited = 0
+        self.failures = 0
+        # Consecutive rate limits, doubling the quarantine each time
+        self.strikes = 0
+        self.quarantined_until = 0.0
+
+
+class KeyPool:
+    """Spreads requests over a provider's API keys and quarantines exhausted ones."""
+
+    def __init__(self, provider: str, keys: List[Tuple[str, float]], client_factory: Callable[[str], Any],
+                 rpm: int = 0, tpm: int = 0, quarantine_seconds: float = None,
+                 async_client_factory: Optional[Callable[[str], Any]] = None):
+        """
+        Initialize the pool.
+
+        Args:
+            provider: Provider name used in labels and status output
+            keys: (key, weight) pairs; weights set each key's share of requests
+            client_factory: Builds an SDK client for a key (called on first use of the key)
+            rpm: Requests per minute allowed per key (0 = unknown)
+            tpm: Tokens per minute allowed per key (0 = unknown)
+            quarantine_seconds: Default quarantine of a rate-limited key (default Config.KEY_QUARANTINE_SECONDS)
+            async_client_factory: Builds an asyncio SDK client for a key, for SDKs with a separate one
+
+        Raises:
+            ValueError: If no keys are given
+        """
+        if not keys:
+            raise ValueError(f"No API keys configured for {provider}")
+        self.provider = provider
+        self.keys = [ApiKey(key, f"{provider}#{index}", max(weight, 0.01))
+                     for index, (key, weight) in enumerate(keys, 1)]
+        self.client_factory = client_factory
+        self.async_client_factory = async_client_factory
+        self.rpm = rpm
+        self.tpm = tpm
+        self.quarantine_seconds = quarantine_seconds if quarantine_seconds is not None else Config.KEY_QUARANTINE_SECONDS
+        self._lock = threading.Lock()
+        self._client_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @property
+    def max_attempts(self) -> int:
+        """Keys one request may try before giving up."""
+        return min(len(self.keys), 3)
+
+    def acquire(self) -> ApiKey:
+        """
+        Pick the key for the next request.
+
+        Keys in quarantine or at their per-minute quota are skipped; if none is left,
+        the key whose quarantine ends first is used.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if len(self.keys) == 1:
+                key = self.keys[0]
+            else:
+                eligible = [key for key in self.keys if key.quarantined_until <= now and self._has_quota(key, now)]
+                if not eligible:
+                    eligible = [min(self.keys, key=lambda key: key.quarantined_until)]
+                total = 0.0
+                key = eligible[0]
+                for candidate in eligible:
+                    candidate.current += candidate.weight
+                    total += candidate.weight
+                    if candidate.current > key.current:
+                        key = candidate
+                key.current -= total
+            key.requests += 1
+            key.recent_requests.append(now)
+            self._prune(key, now)
+            return key
+
+    def client(self, key: ApiKey) -> Any:
+        """SDK client for a key, built on first use."""
+        if key.client is None:
+            with self._client_lock:
+                if key.client is None:
+                    key.client = self.client_factory(key.key)
+        return key.client
+
+    def async_client(self, key: ApiKey) -> Any:
+        """Asyncio SDK client for a key, built on first use by async_client_factory."""
+        if key.async_client is None:
+            with self._client_lock:
+                if key.async_client is None:
+                    key.async_client = self.async_client_factory(key.key)
+        return key.async_client
+
+    def record_success(self, key: ApiKey, tokens: int = 0):
+        """
+        Record a successful request and the tokens it used.
+
+        Args:
+            key: Key the request was made with
+            tokens: Prompt and response tokens reported by the provider
+        """
+        with self._lock:
+            key.strikes = 0
+            if tokens:
+                key.recent_tokens.append((time.monotonic(), tokens))
+                key.window_tokens += tokens
+
+    def record_failure(self, key: ApiKey, error: BaseException) -> bool:
+        """
+        Record a failed request, quarantining the key if the failure was specific to it.
+
+        Args:
+            key: Key the request was made with
+            error: The SDK exception
+
+        Returns:
+            True if another key may succeed (rate limited or rejected key)
+        """
+        status = error_status(error)
+        if status not in _KEY_STATUSES:
+            with self._lock:
+                key.failures += 1
+            return False
+
+        with self._lock:
+            if status == 429:
+                key.rate_limited += 1
+                key.strikes += 1
+                wait = retry_after(error) or self.quarantine_seconds * 2 ** (key.strikes - 1)
+            else:
+                # A rejected (revoked or invalid) key is only retried occasionally
+                key.failures += 1
+                wait = _MAX_QUARANTINE
+            key.quarantined_until = time.monotonic() + min(wait, _MAX_QUARANTINE)
+        return len(self.keys) > 1
+
+    def available(self) -> int:
+        """Keys not in quarantine."""
+        now = time.monotonic()
+        return sum(1 for key in self.keys if key.quarantined_until <= now)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Per-key usage for status output (keys themselves are never included)."""
+        now = time.monotonic()
+        with self._lock:
+            for key in self.keys:
+                self._prune(key, now)
+            return [
+                {
+                    "key": key.label,
+                    "weight": key.weight,
+                    "requests": key.requests,
+                    "rate_limited": key.rate_limited,
+                    "failures": key.failures,
+                    "requests_last_minute": len(key.recent_requests),
+                    "tokens_last_minute": key.window_tokens,
+                    "quarantined_s": round(max(0.0, key.quarantined_until - now), 1),
+                }
+                for key in self.keys
+            ]
+
+    def _has_quota(self, key: ApiKey, now: float) -> bool:
+        """Whether a key is below its per-minute request and token quotas."""
+        if not self.rpm and not self.tpm:
+            return True
+        self._prune(key, now)
+        if self.rpm and len(key.recent_requests) >= self.rpm:
+            return False
+        return not self.tpm or key.window_tokens < self.tpm
+
+    @staticmethod
+    def _prune(key: ApiKey, now: float):
+        """Drop usage older than a minute."""
+        cutoff = now - 60
+        requests = key.recent_requests
+        while requests and requests[0] <= cutoff:
+            requests.popleft()
+        tokens = key.recent_tokens
+        while tokens and tokens[0][0] <= cutoff:
+            key.window_tokens -= tokens.popleft()[1]
@@ -0,0 +1,190 @@
+"""
+Adaptive load shedding.
+Overload is detected from the provider queue depth, event-loop lag and recent
+provider latency. Each signal is divided by its threshold, and the largest
+ratio (the pressure) selects a graduated shed level:
+
+    1  no_typing       skip typing indicators
+    2  cache_first     answer repeated first-turn prompts from a response cache
+    3  fastest_model   route everything else to the fastest healthy model
+    4  busy            reply "busy, try again" at once
+
+Each level includes the ones below it. Levels rise once pressure has held above
+their threshold for two consecutive checks (so a single stall, such as a lazy
+import, is ignored) and fall one at a time after a cooldown, so shedding does
+not flap. Admins are never shed.
+"""
+
+import asyncio
+import logging
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import Config
+from loop_monitor import LoopLagMonitor
+from model_router import ModelStats, model_stats
+
+LEVELS = ("normal", "no_typing", "cache_first", "fastest_model", "busy")
+NO_TYPING, CACHE_FIRST, FASTEST_MODEL, BUSY = 1, 2, 3, 4
+
+BUSY_REPLY = "⏳ I'm overloaded right now. Please try again in a minute."
+
+_WHITESPACE = re.compile(r"\s+")
+
+# Provider services return failures as reply text; those are never cached
+_FAILED_REPLY_PREFIXES = ("❌", "I'm sorry, I couldn't generate")
+
+
+class ResponseCache:
+    """Recent answers to context-free prompts, keyed by normalized text (LRU with a TTL)."""
+
+    def __init__(self, size: int = None, ttl: float = None, max_chars: int = None):
+        """
+        Initialize the cache.
+
+        Args:
+            size: Entries kept (default Config.SHED_CACHE_SIZE, 0 disables)
+            ttl: Seconds an answer stays usable (default Config.SHED_CACHE_TTL)
+            max_chars: Longest prompt cached (default Config.SHED_CACHE_MAX_CHARS)
+        """
+        self.size = size if size is not None else Config.SHED_CACHE_SIZE
+        self.ttl = ttl if ttl is not None else Config.SHED_CACHE_TTL
+        self.max_chars = max_chars if max_chars is not None else Config.SHED_CACHE_MAX_CHARS
+        # normalized prompt -> (stored at, response), least recently used first
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self.hits = 0
+
+    def _key(self, prompt: str) -> Optional[str]:
+        if self.size <= 0 or len(prompt) > self.max_chars:
+            return None
+        return _WHITESPACE.sub(" ", prompt).strip().casefold().rstrip("?!. ")
+
+    def get(self, prompt: str) -> Optional[str]:
+        """Cached answer to a prompt, if fresh."""
+        key = self._key(prompt)
+        entry = self._entries.get(key) if key else None
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, prompt: str, response: str):
+        """Remember the answer to a prompt asked without prior conversation."""
+        key = self._key(prompt)
+        if not key or response.startswith(_FAILED_REPLY_PREFIXES):
+            return
+        self._entries[key] = (time.monotonic(), response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class LoadShedder:
+    """Samples overload signals on the event loop and sets the current shed level."""
+
+    def __init__(self, scheduler, lag_monitor: LoopLagMonitor, stats: ModelStats = None):
+        """
+        Initialize the shedder.
+
+        Args:
+            scheduler: The bot's FairScheduler (queue depth)
+            lag_monitor: The bot's event-loop lag monitor
+            stats: Provider latency statistics (default the process-wide model_stats)
+        """
+        self.scheduler = scheduler
+        self.lag_monitor = lag_monitor
+        self.model_stats = stats or model_stats
+        self.logger = logging.getLogger(__name__)
+
+        self.interval = Config.SHED_INTERVAL
+        self.cooldown = Config.SHED_COOLDOWN_SECONDS
+        # Thresholds at which each signal alone reaches pressure 1.0 (0 ignores the signal)
+        self.thresholds = {
+            "queue_depth": Config.SHED_QUEUE_DEPTH,
+            "loop_lag_ms": Config.SHED_LOOP_LAG_MS,
+            "latency_p95_s": Config.SHED_LATENCY_P95,
+        }
+        # Pressure at which levels 1-4 start
+        self.level_pressures: List[float] = Config.SHED_LEVELS
+
+        self.level = 0
+        self.pressure = 0.0
+        self.signals: Dict[str, float] = {"queue_depth": 0, "loop_lag_ms": 0.0, "latency_p95_s": 0.0}
+        self.shed = [0] * len(LEVELS)
+        self._calm_since: Optional[float] = None
+        self._last_target = 0
+        self.cache = ResponseCache()
+
+    def level_for(self, user_id: int) -> int:
+        """Shed level applied to a user's request (admins are never shed)."""
+        if self.level and user_id in self.scheduler.priority_users:
+            return 0
+        return self.level
+
+    def record_shed(self, level: int):
+        """Count a request degraded at a level (for /status and metrics)."""
+        self.shed[level] += 1
+
+    async def run(self):
+        """Check the signals every `interval` seconds until cancelled."""
+        while True:
+            await asyncio.sleep(self.interval)
+            self.update(self.lag_monitor.take_max_lag_ms())
+
+    def update(self, loop_lag_ms: float):
+        """
+        Recompute pressure and the shed level from fresh signals.
+
+        Args:
+            loop_lag_ms: Worst event-loop lag since the last check
+        """
+        self.signals = {
+            "queue_depth": self.scheduler.queued,
+            "loop_lag_ms": round(loop_lag_ms, 1),
+            "latency_p95_s": round(self.model_stats.latency_percentile(95, Config.SHED_LATENCY_WINDOW), 2),
+        }
+        self.pressure = max(
+            (value / self.thresholds[name] for name, value in self.signals.items() if self.thresholds[name] > 0),
+            default=0.0
+        )
+        reached = sum(1 for pressure in self.level_pressures if self.pressure >= pressure)
+        # Only pressure seen on two checks in a row counts
+        target, self._last_target = min(reached, self._last_target), reached
+
+        now = time.monotonic()
+        if target >= self.level:
+            self._calm_since = None
+            if target > self.level:
+                self._set_level(target)
+        elif self._calm_since is None:
+            self._calm_since = now
+        elif now - self._calm_since >= self.cooldown:
+            # Step down one level per cooldown
+            self._calm_since = now
+            self._set_level(self.level - 1)
+
+    def _set_level(self, level: int):
+        log = self.logger.warning if level > self.level else self.logger.info
+        log("Load shedding %s -> %s (pressure %.2f, %s)", LEVELS[self.level], LEVELS[level], self.pressure, self.signals)
+        self.level = level
+
+    def stats(self) -> Dict[str, Any]:
+        """Current level, signals and counters for status output and metrics."""
+        return {
+            "level": self.level,
+            "state": LEVELS[self.level],
+            "pressure": round(self.pressure, 2),
+            "signals": dict(self.signals),
+            "shed": dict(zip(LEVELS[1:], self.shed[1:])),
+            "cache_entries": len(self.cache),
+            "cache_hits": self.cache.hits,
+        }
@@ -0,0 +1,384 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test for the Telegram bot.
+Drives TelegramGeminiBot (polling) or TelegramWebhookBot (webhook) with synthetic
+updates from simulated users, against local fake Telegram and AI provider servers,
+and reports throughput, latency percentiles and memory usage.
+
+Example:
+    python load_test.py --mode polling --users 2000 --messages 3
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import threading
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+from fake_servers import FakeTelegramAPI, ServerThread
+from provider_simulator import PROFILES, ProviderSimulator
+
+FAKE_TOKEN = "123456:LOADTEST"
+
+SAMPLE_MESSAGES = [
+    "Hi there!",
+    "What's the capital of France?",
+    "Can you explain how async/await works in Python?",
+    "Write a short poem about the sea.",
+    "How do I reverse a list in Python?",
+    "Summarize the plot of Hamlet in two sentences.",
+    "What is the difference between TCP and UDP?",
+    "Thanks, that was helpful!",
+]
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Return the given percentile (0-100) of a list of values using nearest-rank."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def memory_usage() -> Dict[str, float]:
+    """Return current and peak resident set size of this process in MB."""
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    try:
+        with open("/proc/self/statm") as f:
+            rss_pages = int(f.read().split()[1])
+        rss_mb = rss_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        rss_mb = peak_mb
+    return {"rss_mb": round(rss_mb, 1), "peak_rss_mb": round(peak_mb, 1)}
+
+
+def make_update(update_id: int, user_id: int, text: str) -> dict:
+    """Build a Telegram update payload for a private text message."""
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": f"User{user_id}"},
+            "from": {
+                "id": user_id, "is_bot": False,
+                "first_name": f"User{user_id}", "username": f"user{user_id}"
+            },
+            "text": text,
+        },
+    }
+
+
+class LoadTest:
+    """Runs one load-test scenario against the bot and collects measurements."""
+
+    def __init__(self, mode: str = "polling", users: int = 1000, messages_per_user: int = 3,
+                 think_time: float = 0.5, ramp_up: float = 5.0, together_share: float = 0.0,
+                 profile="fast", reply_timeout: float = 120.0,
+                 seed: int = 42, trace_memory: bool = False):
+        """
+        Initialize the scenario.
+
+        Args:
+            mode: "polling" for TelegramGeminiBot, "webhook" for TelegramWebhookBot
+            users: Number of simulated users
+            messages_per_user: Messages each user sends, one at a time
+            think_time: Seconds a user waits after a reply before sending again
+            ramp_up: Seconds over which users start
+            together_share: Fraction of users who switch to Together AI
+            profile: Provider simulator profile name, JSON path or dict
+            reply_timeout: Seconds to wait for a reply before counting a timeout
+            seed: Random seed for users, messages and simulated provider behaviour
+            trace_memory: Track Python allocations with tracemalloc (slower)
+        """
+        self.logger = logging.getLogger(__name__)
+        self.mode = mode
+        self.users = users
+        self.messages_per_user = messages_per_user
+        self.think_time = think_time
+        self.ramp_up = ramp_up
+        self.together_share = together_share
+        self.reply_timeout = reply_timeout
+        self.random = random.Random(seed)
+        self.trace_memory = trace_memory
+
+        self.telegram = FakeTelegramAPI()
+        self.providers = ProviderSimulator(profile, seed=seed)
+        self.server_thread = ServerThread()
+
+        self.latencies: List[float] = []
+        self.outcomes: Dict[str, int] = {"ok": 0, "rate_limited": 0, "busy": 0, "error": 0, "timeout": 0}
+        self._update_ids = iter(range(1, 2 ** 31))
+
+        self.bot = None
+        self._submit = None
+        self._cleanup = []
+
+    def _configure(self):
+        """Point the bot's configuration at the fake servers."""
+        os.environ.setdefault("GEMINI_API_KEY", "fake-gemini-key")
+        os.environ.setdefault("TOGETHER_API_KEY", "fake-together-key")
+
+        from config import Config
+        Config.TELEGRAM_API_BASE_URL = self.telegram.base_url
+        Config.GEMINI_BASE_URL = self.providers.gemini_base_url
+        Config.TOGETHER_BASE_URL = self.providers.together_base_url
+        # Every simulated message should reach the provider unless the scenario says otherwise
+        Config.RATE_LIMIT_REQUESTS = max(Config.RATE_LIMIT_REQUESTS, self.messages_per_user)
+
+    async def _start_polling_bot(self):
+        """Start TelegramGeminiBot and feed updates through its update queue."""
+        from telegram import Update
+        from bot import TelegramGeminiBot
+
+        self.bot = TelegramGeminiBot(FAKE_TOKEN)
+        application = self.bot.application
+        await application.initialize()
+        await application.start()
+        # run_polling() would call these hooks (background tasks such as load shedding)
+        await self.bot._post_init(application)
+
+        async def submit(payload: dict):
+            await application.update_queue.put(Update.de_json(payload, application.bot))
+
+        async def cleanup():
+            await application.stop()
+            await self.bot._post_stop(application)
+            await application.shutdown()
+
+        self._submit = submit
+        self._cleanup.append(cleanup)
+
+    async def _start_webhook_bot(self):
+        """Start TelegramWebhookBot behind its Flask app and POST updates to /webhook."""
+        import httpx
+        from werkzeug.serving import make_server
+        from config import Config
+        from webhook_ingest import SECRET_TOKEN_HEADER
+        from webhook_server import TelegramWebhookBot
+
+        server = make_server("127.0.0.1", 0, None, threaded=True)
+        webhook_url = f"http://127.0.0.1:{server.server_port}"
+        self.bot = TelegramWebhookBot(FAKE_TOKEN, webhook_url)
+        server.app = self.bot.flask_app
+
+        await asyncio.get_running_loop().run_in_executor(None, self.bot.start_event_loop)
+        server_thread = threading.Thread(target=server.serve_forever, name="webhook-http", daemon=True)
+        server_thread.start()
+
+        client = httpx.AsyncClient(
+            base_url=webhook_url,
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=64),
+            timeout=self.reply_timeout
+        )
+
+        # Sent like Telegram does when a secret token is configured
+        headers = {SECRET_TOKEN_HEADER: Config.WEBHOOK_SECRET_TOKEN} if Config.WEBHOOK_SECRET_TOKEN else {}
+
+        async def submit(payload: dict):
+            response = await client.post("/webhook", json=payload, headers=headers)
+            if response.status_code != 200:
+                raise RuntimeError(f"Webhook returned HTTP {response.status_code}")
+
+        async def cleanup():
+            await client.aclose()
+            server.shutdown()
+            for task in (self.bot._loop_monitor_task, self.bot._shedder_task):
+                self.bot.loop.call_soon_threadsafe(task.cancel)
+            future = asyncio.run_coroutine_threadsafe(self.bot.application.shutdown(), self.bot.loop)
+            await asyncio.wrap_future(future)
+            self.bot.loop.call_soon_threadsafe(self.bot.loop.stop)
+
+        self._submit = submit
+        self._cleanup.append(cleanup)
+
+    def _classify(self, reply: str) -> str:
+        """Map a bot reply to an outcome bucket."""
+        if reply.startswith("⚠️"):
+            return "rate_limited"
+        if reply.startswith("❌"):
+            return "error"
+        if reply.startswith("⏳"):
+            return "busy"
+        return "ok"
+
+    async def _simulate_user(self, user_id: int):
+        """Send messages as one user, waiting for each reply before the next."""
+        await asyncio.sleep(self.random.uniform(0, self.ramp_up))
+
+        if self.random.random() < self.together_share:
+            self.bot.user_ai_preference[user_id] = "together"
+
+        for _ in range(self.messages_per_user):
+            text = self.random.choice(SAMPLE_MESSAGES)
+            reply = self.telegram.wait_for_reply(user_id)
+            started = time.perf_counter()
+            try:
+                await self._submit(make_update(next(self._update_ids), user_id, text))
+                reply_text = await asyncio.wait_for(reply, self.reply_timeout)
+            except asyncio.TimeoutError:
+                self.outcomes["timeout"] += 1
+                return
+            except Exception as e:
+                self.logger.debug(f"User {user_id} request failed: {str(e)}")
+                self.outcomes["error"] += 1
+                return
+
+            self.latencies.append(time.perf_counter() - started)
+            self.outcomes[self._classify(reply_text)] += 1
+            await asyncio.sleep(self.think_time)
+
+    async def run(self) -> dict:
+        """Run the scenario and return the report."""
+        self.server_thread.start(self.telegram, self.providers)
+        self._configure()
+
+        if self.trace_memory:
+            tracemalloc.start()
+        memory_before = memory_usage()
+
+        try:
+            if self.mode == "webhook":
+                await self._start_webhook_bot()
+            else:
+                await self._start_polling_bot()
+
+            started = time.perf_counter()
+            user_ids = range(1_000_000, 1_000_000 + self.users)
+            await asyncio.gather(*(self._simulate_user(user_id) for user_id in user_ids))
+            elapsed = time.perf_counter() - started
+
+            report = self._report(elapsed, memory_before)
+        finally:
+            for cleanup in reversed(self._cleanup):
+                await cleanup()
+            self.server_thread.stop(self.telegram, self.providers)
+            if self.trace_memory:
+                tracemalloc.stop()
+
+        return report
+
+    def _report(self, elapsed: float, memory_before: Dict[str, float]) -> dict:
+        """Summarize the collected measurements."""
+        completed = len(self.latencies)
+        report = {
+            "mode": self.mode,
+            "users": self.users,
+            "messages_per_user": self.messages_per_user,
+            "elapsed_s": round(elapsed, 2),
+            "replies": completed,
+            "throughput_rps": round(completed / elapsed, 2) if elapsed else 0.0,
+            "latency_ms": {
+                "p50": round(percentile(self.latencies, 50) * 1000, 1),
+                "p95": round(percentile(self.latencies, 95) * 1000, 1),
+                "p99": round(percentile(self.latencies, 99) * 1000, 1),
+                "max": round(max(self.latencies, default=0.0) * 1000, 1),
+            },
+            "outcomes": dict(self.outcomes),
+            "provider_requests": self.providers.stats(),
+            "telegram_calls": dict(self.telegram.method_counts),
+            "memory": {"before": memory_before, "after": memory_usage()},
+            "active_conversations": len(self.bot.conversations),
+            "conversation_memory": self.bot.conversations.stats(),
+            "load_shedding": self.bot.shedder.stats(),
+            "loop_lag": self.bot.loop_monitor.stats(),
+            "faq": self.bot.faq.stats(),
+        }
+        if self.trace_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            report["memory"]["python_heap_mb"] = round(current / (1024 * 1024), 1)
+            report["memory"]["python_heap_peak_mb"] = round(peak / (1024 * 1024), 1)
+        return report
+
+
+def print_report(report: dict):
+    """Print a human-readable summary of a load-test report."""
+    latency = report["latency_ms"]
+    memory = report["memory"]
+    print(f"\n📊 Load test results ({report['mode']} mode)")
+    print("=" * 50)
+    print(f"Users: {report['users']} x {report['messages_per_user']} messages")
+    print(f"Elapsed: {report['elapsed_s']}s, replies: {report['replies']}")
+    print(f"Throughput: {report['throughput_rps']} replies/s")
+    print(f"Latency (ms): p50={latency['p50']} p95={latency['p95']} p99={latency['p99']} max={latency['max']}")
+    print(f"Outcomes: {report['outcomes']}")
+    print(f"Provider requests: {report['provider_requests']}")
+    print(f"Telegram calls: {report['telegram_calls']}")
+    print(f"RSS (MB): {memory['before']['rss_mb']} -> {memory['after']['rss_mb']} "
+          f"(peak {memory['after']['peak_rss_mb']})")
+    if "python_heap_mb" in memory:
+        print(f"Python heap (MB): {memory['python_heap_mb']} (peak {memory['python_heap_peak_mb']})")
+    print(f"Active conversations: {report['active_conversations']}")
+    conversations = report["conversation_memory"]
+    print(f"Conversation memory: {conversations['total_bytes'] / (1024 * 1024):.1f} MB "
+          f"({conversations['bytes_per_conversation']} B/user, {conversations['compressed']} compressed, "
+          f"{conversations['evictions']} evicted)")
+    shedding = report["load_shedding"]
+    print(f"Load shedding: {shedding['state']} (pressure {shedding['pressure']}), shed {shedding['shed']}, "
+          f"{shedding['cache_hits']} cache hits")
+    loop_lag = report["loop_lag"]
+    print(f"Event loop lag (ms): p50<={loop_lag['p50_ms']} p99<={loop_lag['p99_ms']} max={loop_lag['max_ms']}, "
+          f"{loop_lag['stalls']} stalls")
+    faq = report["faq"]
+    print(f"FAQ: {faq['hits']}/{faq['lookups']} answered locally, {faq['avg_lookup_us']} us avg lookup "
+          f"(max {faq['max_lookup_us']} us)")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="End-to-end load test against fake Telegram and AI providers")
+    parser.add_argument("--mode", choices=["polling", "webhook"], default="polling")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--messages", type=int, default=3, help="Messages per user")
+    parser.add_argument("--think-time", type=float, default=0.5, help="Seconds between a reply and the next message")
+    parser.add_argument("--ramp-up", type=float, default=5.0, help="Seconds over which users start")
+    parser.add_argument("--together-share", type=float, default=0.0, help="Fraction of users on Together AI")
+    parser.add_argument("--profile", default="fast",
+                        help=f"Provider simulator profile ({', '.join(PROFILES)}) or JSON path")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Reply timeout in seconds")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--tracemalloc", action="store_true", help="Report Python heap usage")
+    parser.add_argument("--json", help="Write the report as JSON to this file")
+    parser.add_argument("--log-level", default="WARNING")
+    return parser.parse_args(argv)
+
+
+def main():
+    """Run a load test from the command line."""
+    args = parse_args()
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=args.log_level.upper()
+    )
+    # Werkzeug logs every webhook request at INFO
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    load_test = LoadTest(
+        mode=args.mode,
+        users=args.users,
+        messages_per_user=args.messages,
+        think_time=args.think_time,
+        ramp_up=args.ramp_up,
+        together_share=args.together_share,
+        profile=args.profile,
+        reply_timeout=args.timeout,
+        seed=args.seed,
+        trace_memory=args.tracemalloc
+    )
+    report = asyncio.run(load_test.run())
+    print_report(report)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Non-blocking logging setup for the bot.
+Log records are queued in the calling thread and formatted and written by a
+background listener, so disk and console I/O never run on the event loop.
+"""
+
+import atexit
+import json
+import logging
+import queue
+import zlib
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import List, Optional
+
+from config import Config
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Attributes every LogRecord has; anything else was passed via `extra` and is emitted as a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class MessageText:
+    """
+    User message body passed as a log argument.
+
+    Whether the text is shown is decided only when the record is formatted, in the
+    listener thread: users are sampled deterministically by ID at
+    LOG_MESSAGE_SAMPLE_RATE and everyone else's text is redacted.
+    """
+
+    __slots__ = ("user_id", "text")
+
+    def __init__(self, user_id: int, text: str):
+        self.user_id = user_id
+        self.text = text
+
+    def __str__(self) -> str:
+        rate = Config.LOG_MESSAGE_SAMPLE_RATE
+        if rate > 0 and zlib.crc32(str(self.user_id).encode()) % 10000 < rate * 10000:
+            return self.text[:Config.LOG_MESSAGE_MAX_CHARS] + ("..." if len(self.text) > Config.LOG_MESSAGE_MAX_CHARS else "")
+        return f"[redacted {len(self.text)} chars]"
+
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler that defers all formatting to the listener and drops records when full."""
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Pass the record through unformatted; the listener lives in this process."""
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        """Queue the record without blocking."""
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as single-line JSON objects."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value if isinstance(value, (int, float, bool, type(None))) else str(value)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _BlockingStopListener(QueueListener):
+    """QueueListener whose stop waits for room in a full queue instead of raising."""
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)
+
+
+_listener: Optional[QueueListener] = None
+
+
+def setup_logging(log_file: Optional[str] = None, console: bool = True) -> DeferredQueueHandler:
+    """
+    Route all logging through a queue to a background listener.
+
+    Args:
+        log_file: Size-rotated log file to write, or None for console only
+        console: Whether to also log to stderr
+
+    Returns:
+        The queue handler installed on the root logger
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+    else:
+        atexit.register(_stop_listener)
+
+    formatter = JsonFormatter() if Config.LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT)
+    handlers: List[logging.Handler] = []
+    if log_file:
+        handlers.append(RotatingFileHandler(
+            log_file, maxBytes=Config.LOG_MAX_BYTES, backupCount=Config.LOG_BACKUP_COUNT, encoding="utf-8"
+        ))
+    if console:
+        handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue: queue.Queue = queue.Queue(maxsize=Config.LOG_QUEUE_SIZE)
+    queue_handler = DeferredQueueHandler(log_queue)
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(Config.LOG_LEVEL.upper())
+
+    # httpx logs every request at INFO, which would double the volume per message
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    _listener = _BlockingStopListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    return queue_handler
+
+
+def _stop_listener():
+    """Flush queued records at exit."""
+    if _listener is not None:
+        _listener.stop()
@@ -0,0 +1,200 @@
+"""
+Event-loop lag monitoring with stack capture of blocking calls.
+A coroutine sleeps for a short interval and measures how late it wakes up: the
+overshoot is the scheduling delay every other callback sees, recorded in a
+fixed-bucket histogram. A watchdog thread checks that the sampler keeps waking;
+when the loop has been stuck longer than LOOP_STALL_THRESHOLD_MS it captures
+the loop thread's stack and the running task, which point straight at the
+blocking call. Normal operation costs one short sleep per interval and one
+thread wake-up per half threshold.
+"""
+
+import asyncio
+import bisect
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from config import Config
+
+# Histogram bucket upper bounds in milliseconds (the last bucket is unbounded)
+LAG_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+
+class LoopLagMonitor:
+    """Measures event-loop scheduling delay and reports stalls with their stack."""
+
+    def __init__(self, interval: float = None, stall_threshold_ms: float = None):
+        """
+        Initialize the monitor.
+
+        Args:
+            interval: Seconds between lag samples (default Config.LOOP_LAG_INTERVAL, 0 disables)
+            stall_threshold_ms: Lag at which the loop's stack is captured
+                (default Config.LOOP_STALL_THRESHOLD_MS, 0 disables capture)
+        """
+        self.interval = interval if interval is not None else Config.LOOP_LAG_INTERVAL
+        self.stall_threshold_ms = (
+            stall_threshold_ms if stall_threshold_ms is not None else Config.LOOP_STALL_THRESHOLD_MS
+        )
+        self.logger = logging.getLogger(__name__)
+
+        self.counts = [0] * (len(LAG_BUCKETS_MS) + 1)
+        self.samples = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+        self.last_ms = 0.0
+        # Worst lag since take_max_lag_ms() was last called
+        self._window_max_ms = 0.0
+
+        self.stalls = 0
+        self.recent_stalls: Deque[Dict[str, Any]] = deque(maxlen=10)
+
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread_id: Optional[int] = None
+        # Monotonic time the sampler last woke, and how often it has (read by the watchdog)
+        self._heartbeat = 0.0
+        self._beats = 0
+        self._stopped = threading.Event()
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    async def run(self):
+        """Sample lag every `interval` seconds until cancelled, with the stall watchdog alongside."""
+        if not self.enabled:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        if self.stall_threshold_ms > 0:
+            threading.Thread(target=self._watch, name="loop-stall-watchdog", daemon=True).start()
+
+        try:
+            while True:
+                started = time.monotonic()
+                await asyncio.sleep(self.interval)
+                now = time.monotonic()
+                self._heartbeat = now
+                self._beats += 1
+                self.record((now - started - self.interval) * 1000)
+        finally:
+            self._stopped.set()
+
+    def record(self, lag_ms: float):
+        """
+        Add a lag sample to the histogram.
+
+        Args:
+            lag_ms: How late the loop ran a callback, in milliseconds
+        """
+        lag_ms = max(0.0, lag_ms)
+        self.counts[bisect.bisect_left(LAG_BUCKETS_MS, lag_ms)] += 1
+        self.samples += 1
+        self.sum_ms += lag_ms
+        self.last_ms = lag_ms
+        self.max_ms = max(self.max_ms, lag_ms)
+        self._window_max_ms = max(self._window_max_ms, lag_ms)
+
+        if self.stall_threshold_ms > 0 and lag_ms >= self.stall_threshold_ms:
+            self.logger.warning("Event loop was blocked for %.0f ms", lag_ms)
+            if self.recent_stalls and self.recent_stalls[-1]["duration_ms"] is None:
+                self.recent_stalls[-1]["duration_ms"] = round(lag_ms, 1)
+
+    def take_max_lag_ms(self) -> float:
+        """Worst lag since the previous call (used by the load shedder)."""
+        worst, self._window_max_ms = self._window_max_ms, 0.0
+        return worst
+
+    def percentile(self, pct: float) -> float:
+        """
+        Lag percentile from the histogram.
+
+        Args:
+            pct: Percentile, e.g. 99
+
+        Returns:
+            Upper bound of the bucket holding the percentile in milliseconds
+            (at most the maximum seen), 0.0 before any samples
+        """
+        if not self.samples:
+            return 0.0
+        rank = pct / 100 * self.samples
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return min(float(LAG_BUCKETS_MS[index]), self.max_ms) if index < len(LAG_BUCKETS_MS) else self.max_ms
+        return self.max_ms
+
+    def _watch(self):
+        """Watchdog thread: capture the loop thread's stack once per stall."""
+        threshold = self.stall_threshold_ms / 1000
+        reported_beat = -1
+        while not self._stopped.wait(threshold / 2):
+            blocked = time.monotonic() - self._heartbeat - self.interval
+            if blocked < threshold or self._beats == reported_beat:
+                continue
+            reported_beat = self._beats
+            self._capture(blocked)
+
+    def _capture(self, blocked: float):
+        """Record the stack and task the loop thread is stuck in."""
+        frame = sys._current_frames().get(self._loop_thread_id)
+        if frame is None:
+            return
+        stack = "".join(traceback.format_stack(frame))
+        task = asyncio.current_task(self._loop)
+        task_name = f"{task.get_name()} ({task.get_coro().__qualname__})" if task else "none (callback)"
+
+        self.stalls += 1
+        self.recent_stalls.append({
+            "time": time.time(),
+            "blocked_ms_at_capture": round(blocked * 1000, 1),
+            # Filled in once the loop runs again
+            "duration_ms": None,
+            "task": task_name,
+            "stack": stack,
+        })
+        self.logger.warning("Event loop blocked for %.0f ms so far in task %s:\n%s", blocked * 1000, task_name, stack)
+
+    def stats(self, include_stacks: bool = False) -> Dict[str, Any]:
+        """
+        Lag histogram and stall summary for status output and metrics.
+
+        Args:
+            include_stacks: Include the stacks of recent stalls
+
+        Returns:
+            Cumulative histogram counts keyed by bucket bound ("le", as in Prometheus)
+            with sample count, sum, percentiles and stalls
+        """
+        buckets: Dict[str, int] = {}
+        cumulative = 0
+        for bound, count in zip(list(LAG_BUCKETS_MS) + ["+Inf"], self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+
+        stalls: List[Dict[str, Any]] = [
+            stall if include_stacks else {key: value for key, value in stall.items() if key != "stack"}
+            for stall in list(self.recent_stalls)
+        ]
+        return {
+            "interval_ms": self.interval * 1000,
+            "samples": self.samples,
+            "sum_ms": round(self.sum_ms, 1),
+            "last_ms": round(self.last_ms, 1),
+            "max_ms": round(self.max_ms, 1),
+            "p50_ms": self.percentile(50),
+            "p99_ms": self.percentile(99),
+            "buckets_ms": buckets,
+            "stall_threshold_ms": self.stall_threshold_ms,
+            "stalls": self.stalls,
+            "recent_stalls": stalls,
+        }
@@ -7,17 +7,12 @@ This script initializes and starts the bot.
 import logging
 import os
 from bot import TelegramGeminiBot
+from config import Config
+from logging_setup import setup_logging as configure_logging
 
 def setup_logging():
     """Configure logging for the application."""
-    logging.basicConfig(
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        level=logging.INFO,
-        handlers=[
-            logging.FileHandler('bot.log'),
-            logging.StreamHandler()
-        ]
-    )
+    configure_logging(log_file=Config.LOG_FILE)
 
 def main():
     """Main function to start the Telegram bot."""
@@ -26,14 +21,14 @@ def main():
     
     # Check for required environment variables
     telegram_token = os.getenv("TELEGRAM_BOT_TOKEN")
-    gemini_api_key = os.getenv("GEMINI_API_KEY")
+    gemini_api_key = os.getenv("GEMINI_API_KEYS") or os.getenv("GEMINI_API_KEY")
     
     if not telegram_token:
         logger.error("TELEGRAM_BOT_TOKEN environment variable is required")
         return
     
     if not gemini_api_key:
-        logger.error("GEMINI_API_KEY environment variable is required")
+        logger.error("GEMINI_API_KEY (or GEMINI_API_KEYS) environment variable is required")
         return
     
     logger.info("Starting Telegram Gemini AI Bot...")
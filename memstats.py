@@ -0,0 +1,300 @@
+"""
+Memory introspection for the /memstats command and admin route.
+Reports the deep size of the bot's long-lived structures (conversations,
+preferences, rate-limit windows, caches and queues), process and container
+memory, and, while tracemalloc is tracing, the top allocation sites and how
+they changed since the previous report. Two reports a few minutes apart are
+usually enough to see what is growing.
+"""
+
+import array
+import asyncio
+import logging
+import os
+import resource
+import sys
+import threading
+import tracemalloc
+import types
+from collections import deque
+from logging.handlers import QueueHandler
+from typing import Any, Dict, List, Optional, Tuple
+
+from config import Config
+from conversation_store import format_bytes
+from model_router import model_stats
+from tracing import tracer
+from traffic_recorder import recorder
+
+# Never followed when measuring: shared by everything or not owned by the structure
+_OPAQUE_TYPES = (
+    type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+    logging.Logger, asyncio.AbstractEventLoop, threading.Thread,
+)
+_LEAF_TYPES = (str, bytes, bytearray, int, float, bool, array.array, memoryview)
+
+# Containers with more entries are measured from an evenly spaced sample of this many
+_SAMPLE_ABOVE = 10000
+_SAMPLE_SIZE = 1000
+
+# Allocation sites of the introspection itself and of imports, left out of reports
+# (dropped from the grouped statistics: Snapshot.filter_traces() takes seconds per million traces)
+_IGNORED_FILES = frozenset({
+    tracemalloc.__file__, __file__,
+    "<frozen importlib._bootstrap>", "<frozen importlib._bootstrap_external>", "<unknown>",
+})
+
+
+def deep_size(obj: Any) -> int:
+    """
+    Approximate bytes held by an object and everything it references.
+
+    Containers, instance dicts and slots are followed; classes, functions, bound
+    methods, loggers, threads and event loops are not. Objects reachable twice
+    are counted once. Containers with more than 10000 entries are extrapolated
+    from a sample of their entries, so the cost stays bounded for 100k users.
+
+    Args:
+        obj: Object to measure
+
+    Returns:
+        Size in bytes
+    """
+    return _walk(obj, set())
+
+
+def _walk(obj: Any, seen: set) -> int:
+    """deep_size() of an object, skipping objects already in `seen`."""
+    size = 0
+    stack = [obj]
+    while stack:
+        current = stack.pop()
+        if id(current) in seen or isinstance(current, _OPAQUE_TYPES):
+            continue
+        seen.add(id(current))
+        size += sys.getsizeof(current)
+
+        if isinstance(current, _LEAF_TYPES):
+            continue
+        if isinstance(current, (dict, list, tuple, set, frozenset, deque)):
+            entries = current.items() if isinstance(current, dict) else current
+            if len(current) > _SAMPLE_ABOVE:
+                sample = list(entries)[::len(current) // _SAMPLE_SIZE]
+                # The (key, value) tuples made for the sample are not part of the structure
+                sampled = sum(_walk(entry, seen) - (sys.getsizeof(entry) if isinstance(current, dict) else 0)
+                              for entry in sample)
+                size += sampled * len(current) // len(sample)
+            elif isinstance(current, dict):
+                stack.extend(current.keys())
+                stack.extend(current.values())
+            else:
+                stack.extend(current)
+        else:
+            attributes = getattr(current, "__dict__", None)
+            if attributes is not None:
+                stack.append(attributes)
+            for cls in type(current).__mro__:
+                slots = cls.__dict__.get("__slots__", ())
+                for slot in (slots,) if isinstance(slots, str) else slots:
+                    if slot not in ("__dict__", "__weakref__") and hasattr(current, slot):
+                        stack.append(getattr(current, slot))
+    return size
+
+
+def process_memory() -> Dict[str, Optional[int]]:
+    """Resident set size, its peak and the container's cgroup usage and limit, in bytes (None if unknown)."""
+    usage = {
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "rss_bytes": None,
+        "cgroup_bytes": None,
+        "cgroup_limit_bytes": None,
+    }
+    try:
+        with open("/proc/self/statm") as f:
+            usage["rss_bytes"] = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        pass
+
+    # cgroup v2, then v1
+    for current_file, limit_file in (("/sys/fs/cgroup/memory.current", "/sys/fs/cgroup/memory.max"),
+                                     ("/sys/fs/cgroup/memory/memory.usage_in_bytes",
+                                      "/sys/fs/cgroup/memory/memory.limit_in_bytes")):
+        try:
+            with open(current_file) as f:
+                usage["cgroup_bytes"] = int(f.read())
+            with open(limit_file) as f:
+                limit = f.read().strip()
+            # "max" (v2) or a huge number (v1) means unlimited
+            if limit.isdigit() and int(limit) < 1 << 60:
+                usage["cgroup_limit_bytes"] = int(limit)
+            break
+        except (OSError, ValueError):
+            continue
+    return usage
+
+
+def shared_structures() -> Dict[str, Any]:
+    """Process-wide structures worth measuring besides a bot's own."""
+    structures: Dict[str, Any] = {"model_stats": model_stats, "recorder_queue": recorder.queue}
+    if tracer.exporter is not None:
+        structures["trace_queue"] = tracer.exporter.queue
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, QueueHandler):
+            structures["log_queue"] = handler.queue
+    return structures
+
+
+class MemoryInspector:
+    """Builds memory reports and keeps the previous tracemalloc snapshot to diff against."""
+
+    def __init__(self, top: int = None, frames: int = None):
+        """
+        Initialize the inspector, starting tracemalloc if MEMSTATS_TRACEMALLOC is set.
+
+        Args:
+            top: Allocation sites listed per report (default Config.MEMSTATS_TOP)
+            frames: Stack frames kept per allocation when tracing (default Config.MEMSTATS_TRACEMALLOC_FRAMES)
+        """
+        self.top = top or Config.MEMSTATS_TOP
+        self.frames = frames or Config.MEMSTATS_TRACEMALLOC_FRAMES
+        self.logger = logging.getLogger(__name__)
+        # site -> (bytes, blocks) at the previous allocations() call
+        self._previous: Optional[Dict[str, Tuple[int, int]]] = None
+        if Config.MEMSTATS_TRACEMALLOC:
+            self.start_tracing()
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start_tracing(self):
+        """Start tracing allocations (slows allocation down and adds memory per traced block)."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self._previous = None
+            self.logger.info("Started tracemalloc with %d frame(s)", self.frames)
+
+    def stop_tracing(self):
+        """Stop tracing allocations and forget the previous snapshot."""
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+            self._previous = None
+            self.logger.info("Stopped tracemalloc")
+
+    def report(self, structures: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Measure structures and process memory.
+
+        Call from the thread that owns the structures (the bot's event loop), so
+        none changes while it is walked.
+
+        Args:
+            structures: Name -> object to measure with deep_size()
+
+        Returns:
+            JSON-serializable report, with "tracemalloc" left for allocations()
+        """
+        sizes = []
+        for name, obj in {**structures, **shared_structures()}.items():
+            entry = {"name": name, "bytes": deep_size(obj)}
+            if hasattr(obj, "qsize"):
+                entry["items"] = obj.qsize()
+            elif hasattr(obj, "__len__"):
+                entry["items"] = len(obj)
+            sizes.append(entry)
+        sizes.sort(key=lambda entry: -entry["bytes"])
+
+        return {"process": process_memory(), "structures": sizes, "tracemalloc": None}
+
+    def allocations(self) -> Optional[Dict[str, Any]]:
+        """
+        Top allocation sites and their change since the previous call; safe to run on a worker thread.
+
+        Returns:
+            JSON-serializable allocation report ("diff" is None the first time), or None when not tracing
+        """
+        if not self.tracing:
+            return None
+        traced, traced_peak = tracemalloc.get_traced_memory()
+        # site -> (bytes, blocks); grouping once and diffing these by hand is several
+        # times faster than Snapshot.compare_to(), which groups both snapshots again
+        sites = {
+            self._site(stat.traceback): (stat.size, stat.count)
+            for stat in tracemalloc.take_snapshot().statistics("lineno")
+            if stat.traceback[0].filename not in _IGNORED_FILES
+        }
+        allocations = {
+            "traced_bytes": traced,
+            "traced_peak_bytes": traced_peak,
+            "top": [
+                {"site": site, "bytes": size, "blocks": count}
+                for site, (size, count) in list(sites.items())[:self.top]
+            ],
+            "diff": None if self._previous is None else self._diff(self._previous, sites),
+        }
+        self._previous = sites
+        return allocations
+
+    def _diff(self, previous: Dict[str, Tuple[int, int]], current: Dict[str, Tuple[int, int]]) -> List[Dict[str, Any]]:
+        """The `top` sites whose traced size changed most between two groupings."""
+        changes = []
+        for site in current.keys() | previous.keys():
+            size, count = current.get(site, (0, 0))
+            old_size, old_count = previous.get(site, (0, 0))
+            if size != old_size or count != old_count:
+                changes.append({"site": site, "bytes_diff": size - old_size,
+                                "blocks_diff": count - old_count, "bytes": size})
+        changes.sort(key=lambda change: -abs(change["bytes_diff"]))
+        return changes[:self.top]
+
+    @staticmethod
+    def _site(traceback: tracemalloc.Traceback) -> str:
+        frame = traceback[0]
+        return f"{frame.filename}:{frame.lineno}"
+
+
+def format_report(report: Dict[str, Any]) -> str:
+    """Plain-text rendering of a report for Telegram."""
+    process = report["process"]
+    lines = [f"Memory: RSS {format_bytes(process['rss_bytes'] or 0)}, peak {format_bytes(process['peak_rss_bytes'])}"]
+    if process["cgroup_bytes"] is not None:
+        limit = process["cgroup_limit_bytes"]
+        lines.append(f"Container: {format_bytes(process['cgroup_bytes'])} used, "
+                     f"{'limit ' + format_bytes(limit) if limit else 'no limit'}")
+
+    lines.append("")
+    lines.append("Structures (deep size):")
+    for entry in report["structures"]:
+        items = f", {entry['items']} items" if "items" in entry else ""
+        lines.append(f"• {entry['name']}: {format_bytes(entry['bytes'])}{items}")
+
+    traced = report["tracemalloc"]
+    lines.append("")
+    if traced is None:
+        lines.append("tracemalloc is off; /memstats start begins tracing allocations.")
+        return "\n".join(lines)
+
+    lines.append(f"Traced: {format_bytes(traced['traced_bytes'])} (peak {format_bytes(traced['traced_peak_bytes'])})")
+    lines.append("Top allocation sites:")
+    for stat in traced["top"]:
+        lines.append(f"• {_short_site(stat['site'])}: {format_bytes(stat['bytes'])} in {stat['blocks']} blocks")
+    if traced["diff"] is None:
+        lines.append("No earlier snapshot; the next /memstats shows the growth since this one.")
+    else:
+        lines.append("Change since the previous report:")
+        for stat in traced["diff"]:
+            sign = "+" if stat["bytes_diff"] >= 0 else "-"
+            lines.append(f"• {_short_site(stat['site'])}: {sign}{format_bytes(abs(stat['bytes_diff']))} "
+                         f"({stat['blocks_diff']:+d} blocks)")
+    return "\n".join(lines)
+
+
+def _short_site(site: str) -> str:
+    """Allocation site with the path shortened to the last two components."""
+    path, _, line = site.rpartition(":")
+    return f"{'/'.join(path.split(os.sep)[-2:])}:{line}"
+
+
+# Process-wide inspector shared by the /memstats command and the admin HTTP route
+memory_inspector = MemoryInspector()
@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+"""
+Microbenchmarks for the bot's per-message hot paths.
+Compares results against stored baselines and fails when any benchmark
+slows down by more than the regression threshold.
+
+Examples:
+    python microbench.py                  # run and compare with microbench_baseline.json
+    python microbench.py --save           # record new baselines
+    python microbench.py -k rate_limiter  # run matching benchmarks only
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+from typing import Callable, Dict, List
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "microbench_baseline.json")
+FAKE_TOKEN = "123456:MICROBENCH"
+
+# Every benchmark returns a function that performs the operation n times
+Benchmark = Callable[[], Callable[[int], None]]
+BENCHMARKS: Dict[str, Benchmark] = {}
+
+
+def benchmark(name: str):
+    """Register a benchmark factory under a name."""
+    def register(factory: Benchmark) -> Benchmark:
+        BENCHMARKS[name] = factory
+        return factory
+    return register
+
+
+def _history(length: int) -> List[Dict[str, str]]:
+    """Build a conversation history of alternating user/assistant messages."""
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"Message number {i} " * 8}
+        for i in range(length)
+    ]
+
+
+class _StubMessage:
+    """Stands in for telegram.Message; replies are discarded."""
+
+    def __init__(self, text: str):
+        self.text = text
+
+    async def reply_text(self, text: str, **kwargs):
+        return None
+
+
+class _StubService:
+    """Stands in for an AI service with an instant canned reply."""
+
+    def __init__(self):
+        from health import ProviderHealth
+        from key_pool import KeyPool
+        self.health = ProviderHealth("stub", lambda: None)
+        self.keys = KeyPool("stub", [("stub-key", 1.0)], lambda key: None)
+
+    async def generate_response(self, message, conversation_history=None, model_name=None):
+        return "This is a canned benchmark response."
+
+
+class _AllowAll:
+    """Rate limiter that never limits, so handle_message always reaches the history code."""
+
+    def is_allowed(self, user_id: int) -> bool:
+        return True
+
+
+def _stub_update(user_id: int, text: str = "Hello there") -> SimpleNamespace:
+    """Build a minimal object with the Update attributes the handlers use."""
+    user = SimpleNamespace(id=user_id, username=f"user{user_id}", first_name=f"User{user_id}")
+    return SimpleNamespace(
+        update_id=user_id,
+        effective_user=user,
+        effective_chat=SimpleNamespace(id=user_id),
+        message=_StubMessage(text)
+    )
+
+
+async def _noop(*args, **kwargs):
+    return None
+
+
+def _stub_context() -> SimpleNamespace:
+    """Build a minimal handler context."""
+    return SimpleNamespace(bot=SimpleNamespace(send_chat_action=_noop), args=[])
+
+
+def _make_bot():
+    """Create a TelegramGeminiBot with stubbed AI services (no network access)."""
+    os.environ.setdefault("GEMINI_API_KEY", "fake-gemini-key")
+    os.environ.setdefault("TOGETHER_API_KEY", "fake-together-key")
+    from bot import TelegramGeminiBot
+
+    bot = TelegramGeminiBot(FAKE_TOKEN)
+    bot.gemini_service = _StubService()
+    bot.together_service = _StubService()
+    # The debounce window is a deliberate wait, not per-message work
+    bot.debouncer.window = 0
+    return bot
+
+
+def _run_async(coroutine_factory: Callable[[int], object]) -> Callable[[int], None]:
+    """Wrap an async batch so it can be timed synchronously on a dedicated loop."""
+    loop = asyncio.new_event_loop()
+    return lambda n: loop.run_until_complete(coroutine_factory(n))
+
+
+@benchmark("rate_limiter.is_allowed[1M users]")
+def bench_rate_limiter():
+    from rate_limiter import RateLimiter
+
+    users = 1_000_000
+    limiter = RateLimiter()
+    now = time.time()
+    for user_id in range(users):
+        limiter.user_requests[user_id].append(now)
+
+    rng = random.Random(0)
+    user_ids = [rng.randrange(users) for _ in range(65536)]
+
+    def run(n: int):
+        is_allowed = limiter.is_allowed
+        for i in range(n):
+            is_allowed(user_ids[i & 65535])
+    return run
+
+
+@benchmark("handle_message[history append+trim]")
+def bench_handle_message():
+    from config import Config
+
+    bot = _make_bot()
+    bot.rate_limiter = _AllowAll()
+    users = 1000
+    for user_id in range(users):
+        bot.conversations[user_id] = _history(Config.MAX_CONVERSATION_LENGTH)
+    updates = [_stub_update(user_id) for user_id in range(users)]
+    context = _stub_context()
+
+    async def batch(n: int):
+        for i in range(n):
+            await bot.handle_message(updates[i % users], context)
+    return _run_async(batch)
+
+
+@benchmark("conversations.append[100k users, capped]")
+def bench_conversation_append():
+    from conversation_store import ConversationStore
+
+    users = 100_000
+    history = _history(20)
+    # Cap below the working set so appends also exercise LRU eviction
+    store = ConversationStore(max_length=20, max_bytes=64 * 1024 * 1024, compress_after=0)
+    for user_id in range(users):
+        for message in history:
+            store.append(user_id, message["role"], message["content"])
+
+    rng = random.Random(0)
+    user_ids = [rng.randrange(users) for _ in range(65536)]
+    content = history[0]["content"]
+
+    def run(n: int):
+        append = store.append
+        for i in range(n):
+            append(user_ids[i & 65535], "user", content)
+    return run
+
+
+@benchmark("model_router.route[mixed prompts]")
+def bench_route():
+    from config import Config
+
+    bot = _make_bot()
+    history = _history(10)
+    prompts = [
+        "hi, how are you today?",
+        "Why does my python script raise KeyError when I read the config?",
+        "Привет! Расскажи, пожалуйста, короткую историю.",
+        "Summarize the main arguments for and against remote work. " * 30,
+    ]
+
+    def run(n: int):
+        # Routing is opt-in; time the routed path, not the default-model shortcut
+        routing, Config.MODEL_ROUTING = Config.MODEL_ROUTING, True
+        route = bot.model_router.route
+        try:
+            for i in range(n):
+                route(prompts[i & 3], history, "auto")
+        finally:
+            Config.MODEL_ROUTING = routing
+    return run
+
+
+@benchmark("gemini._build_contents[20 msgs]")
+def bench_gemini_prompt():
+    os.environ.setdefault("GEMINI_API_KEY", "fake-gemini-key")
+    from gemini_service import GeminiService
+
+    service = GeminiService()
+    history = _history(20)
+    message = history[-1]["content"]
+
+    def run(n: int):
+        for _ in range(n):
+            service._build_contents(message, history)
+    return run
+
+
+@benchmark("together._build_messages[20 msgs]")
+def bench_together_prompt():
+    os.environ.setdefault("TOGETHER_API_KEY", "fake-together-key")
+    from together_service import TogetherService
+
+    service = TogetherService()
+    history = _history(20)
+    message = history[-1]["content"]
+
+    def run(n: int):
+        for _ in range(n):
+            service._build_messages(message, history)
+    return run
+
+
+@benchmark("webhook.parse_update[json+de_json]")
+def bench_parse_update():
+    from telegram import Bot, Update
+    from webhook_ingest import is_handled, parse_update
+
+    bot = Bot(FAKE_TOKEN)
+    body = json.dumps({
+        "update_id": 123456789,
+        "message": {
+            "message_id": 42,
+            "date": 1700000000,
+            "chat": {"id": 987654321, "type": "private", "first_name": "Alice", "username": "alice"},
+            "from": {"id": 987654321, "is_bot": False, "first_name": "Alice",
+                     "username": "alice", "language_code": "en"},
+            "text": "Can you explain how async/await works in Python?",
+        },
+    }).encode("utf-8")
+
+    def run(n: int):
+        for _ in range(n):
+            update = parse_update(body)
+            if is_handled(update):
+                Update.de_json(update, bot)
+    return run
+
+
+@benchmark("webhook.parse_update[ignored update]")
+def bench_parse_ignored_update():
+    from webhook_ingest import is_handled, parse_update
+
+    body = json.dumps({
+        "update_id": 123456790,
+        "edited_message": {
+            "message_id": 42,
+            "date": 1700000000,
+            "edit_date": 1700000060,
+            "chat": {"id": 987654321, "type": "private", "first_name": "Alice", "username": "alice"},
+            "from": {"id": 987654321, "is_bot": False, "first_name": "Alice",
+                     "username": "alice", "language_code": "en"},
+            "text": "Can you explain how async/await works in Python 3?",
+        },
+    }).encode("utf-8")
+
+    def run(n: int):
+        for _ in range(n):
+            is_handled(parse_update(body))
+    return run
+
+
+@benchmark("status_command[render]")
+def bench_status():
+    bot = _make_bot()
+    for user_id in range(1000):
+        bot.conversations[user_id] = _history(4)
+    update = _stub_update(1)
+    context = _stub_context()
+
+    async def batch(n: int):
+        for _ in range(n):
+            await bot.status_command(update, context)
+    return _run_async(batch)
+
+
+@benchmark("handle_message[queued INFO logging]")
+def bench_handle_message_logging():
+    # Registered last: it installs the production logging pipeline on the root logger
+    import tempfile
+    from logging_setup import setup_logging
+
+    log_dir = tempfile.mkdtemp(prefix="microbench-")
+    setup_logging(log_file=os.path.join(log_dir, "bot.log"), console=False)
+    return bench_handle_message()
+
+
+def measure(run: Callable[[int], None], repeat: int, min_time: float) -> Dict[str, float]:
+    """
+    Time an operation, returning nanoseconds per call.
+
+    The iteration count is calibrated so each round takes at least min_time seconds.
+    """
+    n = 1
+    while True:
+        started = time.perf_counter()
+        run(n)
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_time:
+            break
+        n *= 2 if elapsed == 0 else max(2, min(10, int(min_time / elapsed) + 1))
+
+    rounds = [elapsed / n]
+    for _ in range(repeat - 1):
+        started = time.perf_counter()
+        run(n)
+        rounds.append((time.perf_counter() - started) / n)
+
+    return {
+        "ns_per_op": min(rounds) * 1e9,
+        "median_ns": statistics.median(rounds) * 1e9,
+        "iterations": n,
+    }
+
+
+def load_baseline(path: str) -> Dict[str, float]:
+    """Load stored per-benchmark baselines, or an empty dict."""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f).get("results", {})
+
+
+def save_baseline(path: str, results: Dict[str, Dict[str, float]]):
+    """Store results as the new baseline, keeping entries for benchmarks not run."""
+    baseline = load_baseline(path)
+    baseline.update({name: round(result["ns_per_op"], 1) for name, result in results.items()})
+    with open(path, "w") as f:
+        json.dump({
+            "meta": {
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "machine": platform.machine(),
+                "recorded_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            },
+            "results": dict(sorted(baseline.items())),
+        }, f, indent=2)
+        f.write("\n")
+
+
+def main() -> int:
+    """Run the benchmarks and compare with the baseline; returns the exit code."""
+    parser = argparse.ArgumentParser(description="Microbenchmarks for per-message hot paths")
+    parser.add_argument("-k", "--filter", default="", help="Only run benchmarks whose name contains this")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed rounds per benchmark")
+    parser.add_argument("--min-time", type=float, default=0.2, help="Minimum seconds per round")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="Baseline JSON file")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="Fail when time per op exceeds baseline by this factor")
+    parser.add_argument("--save", action="store_true", help="Store results as the new baseline")
+    parser.add_argument("--json", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    baseline = load_baseline(args.baseline)
+    results: Dict[str, Dict[str, float]] = {}
+    regressions = []
+
+    print(f"{'benchmark':<40} {'ns/op':>12} {'baseline':>12} {'ratio':>7}")
+    print("-" * 74)
+    for name, factory in BENCHMARKS.items():
+        if args.filter not in name:
+            continue
+        result = measure(factory(), args.repeat, args.min_time)
+        results[name] = result
+
+        base = baseline.get(name)
+        ratio = result["ns_per_op"] / base if base else None
+        flag = ""
+        if ratio is not None and ratio > args.threshold:
+            flag = "  ❌ REGRESSION"
+            regressions.append(name)
+        print(f"{name:<40} {result['ns_per_op']:>12.1f} "
+              f"{(f'{base:.1f}' if base else '-'):>12} {(f'{ratio:.2f}' if ratio else '-'):>7}{flag}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.save:
+        save_baseline(args.baseline, results)
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+
+    if regressions:
+        print(f"\n{len(regressions)} benchmark(s) slower than {args.threshold}x baseline: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,321 @@
+"""
+Latency-aware model routing.
+Picks a provider and model per request from cheap local features of the prompt
+and a live EWMA of each model's latency and error rate.
+"""
+
+import random
+import re
+import threading
+import time
+from collections import deque
+from typing import Deque, Dict, List, NamedTuple, Optional, Tuple
+
+from config import Config
+
+# Cheap signals that a message is about code: syntax, then keywords
+_CODE_SYNTAX = re.compile(r"```|`[^`\n]+`|\bdef \w+\(|\bclass \w+[(:]|=>|#include|[{};]\s*$", re.MULTILINE)
+_WORD = re.compile(r"[a-z][a-z+#]*")
+_CODE_KEYWORDS = frozenset({
+    "python", "javascript", "typescript", "java", "golang", "rust", "c++", "c#", "sql", "regex", "bash",
+    "compile", "compiler", "debug", "refactor", "traceback", "exception", "stacktrace", "function",
+    "async", "await", "import", "select", "json", "api", "bug", "code", "script", "syntax",
+})
+
+
+_SYNTAX_CHARS = frozenset("`(:;{}=#")
+_SCAN_CHARS = 600
+
+
+def _looks_like_code(message: str) -> bool:
+    """Whether a message contains code or is about programming."""
+    # Plain prose rarely contains these characters, so most messages skip the regex
+    if not _SYNTAX_CHARS.isdisjoint(message) and _CODE_SYNTAX.search(message):
+        return True
+    lowered = message.lower()
+    words = _WORD.findall(lowered)
+    if not _CODE_KEYWORDS.isdisjoint(words):
+        return True
+    # e.g. KeyError, TypeError
+    return "error" in lowered and any(word.endswith("error") and word != "error" for word in words)
+
+
+# What each model is good at; models not listed are treated as general chat models
+MODEL_TAGS: Dict[str, frozenset] = {
+    "codellama": frozenset({"code"}),
+    "qwen": frozenset({"code", "multilingual", "long"}),
+    "mistral": frozenset({"multilingual"}),
+    "llama": frozenset({"long"}),
+    "gemini-2.5-flash": frozenset({"code", "multilingual", "long"}),
+    "gemini-2.5-pro": frozenset({"code", "multilingual", "long"}),
+    "gemini-2.5-flash-lite": frozenset({"multilingual"}),
+}
+
+# Cost multiplier for models specialised in exactly the request's class
+SPECIALIST_DISCOUNT = 0.75
+
+
+class ModelStats:
+    """Exponentially weighted latency and error rate per model, fed by the AI services."""
+
+    def __init__(self, alpha: float = None):
+        """
+        Initialize the statistics.
+
+        Args:
+            alpha: EWMA weight of the newest sample (default Config.ROUTER_EWMA_ALPHA)
+        """
+        self.alpha = alpha if alpha is not None else Config.ROUTER_EWMA_ALPHA
+        # model ID -> [latency EWMA (s), error-rate EWMA, samples]
+        self._stats: Dict[str, List[float]] = {}
+        # (timestamp, latency) of recent requests to any model, for latency percentiles
+        self._recent: Deque[Tuple[float, float]] = deque(maxlen=1000)
+        self._lock = threading.Lock()
+
+    def record(self, model: str, latency: float, ok: bool):
+        """
+        Record the outcome of one request.
+
+        Args:
+            model: Provider model ID
+            latency: Seconds the request took
+            ok: Whether it succeeded
+        """
+        error = 0.0 if ok else 1.0
+        with self._lock:
+            self._recent.append((time.monotonic(), latency))
+            stats = self._stats.get(model)
+            if stats is None:
+                self._stats[model] = [latency, error, 1]
+                return
+            # Failures often return fast; keep them out of the latency estimate
+            if ok:
+                stats[0] += self.alpha * (latency - stats[0])
+            stats[1] += self.alpha * (error - stats[1])
+            stats[2] += 1
+
+    def get(self, model: str) -> Optional[Tuple[float, float, int]]:
+        """(latency EWMA, error-rate EWMA, samples) for a model, or None before its first request."""
+        stats = self._stats.get(model)
+        return tuple(stats) if stats else None
+
+    def slowest_latency(self) -> float:
+        """Highest latency EWMA of any measured model (0.0 before the first request)."""
+        with self._lock:
+            return max((stats[0] for stats in self._stats.values()), default=0.0)
+
+    def latency_percentile(self, pct: float, window: float) -> float:
+        """
+        Nearest-rank percentile of request latency across all models.
+
+        Args:
+            pct: Percentile, e.g. 95
+            window: Only requests finished in the last this many seconds count
+
+        Returns:
+            Latency in seconds, 0.0 if there were no requests
+        """
+        cutoff = time.monotonic() - window
+        with self._lock:
+            latencies = sorted(latency for finished, latency in self._recent if finished >= cutoff)
+        if not latencies:
+            return 0.0
+        return latencies[min(len(latencies) - 1, int(pct / 100 * len(latencies)))]
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """All model statistics for status output."""
+        with self._lock:
+            return {
+                model: {"latency_s": round(latency, 3), "error_rate": round(errors, 3), "samples": int(samples)}
+                for model, (latency, errors, samples) in self._stats.items()
+            }
+
+    def export(self) -> Dict[str, List[float]]:
+        """Raw statistics, for a state snapshot."""
+        with self._lock:
+            return {model: list(stats) for model, stats in self._stats.items()}
+
+    def load(self, stats: Dict[str, List[float]]):
+        """Restore statistics saved by export(); models already measured keep their own."""
+        with self._lock:
+            for model, values in stats.items():
+                self._stats.setdefault(model, [float(value) for value in values])
+
+
+# Process-wide statistics recorded by GeminiService and TogetherService
+model_stats = ModelStats()
+
+
+class RequestFeatures(NamedTuple):
+    """Cheap local features of a request."""
+    prompt_chars: int
+    has_code: bool
+    non_latin: bool
+    depth: int
+
+
+def extract_features(message: str, conversation_history: Optional[list] = None) -> RequestFeatures:
+    """
+    Compute routing features without any network access.
+
+    Args:
+        message: The user's message
+        conversation_history: Messages so far, including the current one
+
+    Returns:
+        Features of the request
+    """
+    # The start of a message is enough to classify it
+    sample = message[:_SCAN_CHARS]
+    non_latin = False
+    if not sample.isascii():
+        letters = [ch for ch in sample if ch.isalpha()]
+        non_latin = bool(letters) and sum(1 for ch in letters if ch > "\u024f") / len(letters) > 0.3
+
+    return RequestFeatures(
+        prompt_chars=len(message),
+        has_code=_looks_like_code(sample),
+        non_latin=non_latin,
+        depth=len(conversation_history) if conversation_history else 0,
+    )
+
+
+# Phrases asking for reasoning rather than a quick reply
+_REASONING_PATTERN = re.compile(
+    r"\b(?:why|how does|how do|explain|prove|derive|step by step|calculate|solve|compare|analy[sz]e"
+    r"|plan|design|optimi[sz]e|trade-?offs?|pros and cons)\b|\d\s*[-+*/^=]\s*\d",
+    re.IGNORECASE
+)
+
+
+def prompt_complexity(message: str, conversation_history: Optional[list] = None) -> str:
+    """
+    Rough complexity of a request from local features: "simple", "moderate" or "complex".
+
+    Args:
+        message: The user's message
+        conversation_history: Messages so far, including the current one
+    """
+    features = extract_features(message, conversation_history)
+    score = 0
+    if features.has_code:
+        score += 2
+    if _REASONING_PATTERN.search(message[:_SCAN_CHARS]):
+        score += 1
+    if features.prompt_chars >= Config.ROUTER_LONG_PROMPT_CHARS:
+        score += 2
+    elif features.prompt_chars >= 300:
+        score += 1
+    if features.depth >= Config.ROUTER_DEEP_CONVERSATION:
+        score += 1
+
+    if score == 0:
+        return "simple"
+    return "moderate" if score <= 2 else "complex"
+
+
+class Route(NamedTuple):
+    """Routing decision for one request."""
+    provider: str        # "gemini" or "together"
+    model: str           # Key in the provider's available models
+    reason: str          # Request class or override that decided the route
+
+
+class ModelRouter:
+    """Chooses provider and model per request, honouring per-user overrides."""
+
+    def __init__(self, services: Dict[str, object], stats: ModelStats = None, rng: random.Random = None):
+        """
+        Initialize the router.
+
+        Args:
+            services: Available AI services by provider name; each must provide get_available_models()
+            stats: Latency statistics (default the process-wide model_stats)
+            rng: Random source for exploration
+        """
+        self.stats = stats or model_stats
+        self.rng = rng or random.Random()
+        # (provider, model key, model ID) for every routable model
+        self.candidates: List[Tuple[str, str, str]] = [
+            (provider, key, model_id)
+            for provider, service in services.items() if service is not None
+            for key, model_id in service.get_available_models().items()
+        ]
+
+    def classify(self, features: RequestFeatures) -> str:
+        """Request class: code, multilingual, long or chat."""
+        if features.has_code:
+            return "code"
+        if features.non_latin:
+            return "multilingual"
+        if features.prompt_chars >= Config.ROUTER_LONG_PROMPT_CHARS or features.depth >= Config.ROUTER_DEEP_CONVERSATION:
+            return "long"
+        return "chat"
+
+    def expected_cost(self, model_id: str) -> float:
+        """Expected latency in seconds, inflated by the model's recent error rate."""
+        stats = self.stats.get(model_id)
+        if stats is None:
+            # Unmeasured models are assumed no faster than the slowest measured one, so traffic
+            # only moves to them once exploration has sampled them
+            return max(Config.ROUTER_PRIOR_LATENCY, self.stats.slowest_latency())
+        latency, error_rate, _ = stats
+        if error_rate > Config.ROUTER_MAX_ERROR_RATE:
+            return float("inf")
+        return latency * (1.0 + 4.0 * error_rate)
+
+    def route(self, message: str, conversation_history: Optional[list] = None,
+              provider: Optional[str] = None, model: Optional[str] = None, fastest: bool = False) -> Route:
+        """
+        Pick the provider and model for a request.
+
+        Args:
+            message: The user's message
+            conversation_history: Messages so far, including the current one
+            provider: Provider chosen by the user with /ai (None or "auto" to route freely)
+            model: Model pinned by the user with /models
+            fastest: Ignore preferences and request class and take the fastest healthy model (load shedding)
+
+        Returns:
+            The routing decision
+        """
+        if fastest:
+            chosen = min(self.candidates, key=lambda candidate: (self.expected_cost(candidate[2]),
+                                                                 self.stats.get(candidate[2]) is None))
+            return Route(chosen[0], chosen[1], "shed:fastest")
+
+        if model:
+            for candidate_provider, key, _ in self.candidates:
+                if key == model:
+                    return Route(candidate_provider, key, "pinned")
+
+        candidates = self.candidates
+        reason = ""
+        if provider and provider != "auto":
+            candidates = [c for c in candidates if c[0] == provider] or candidates
+            reason = f"{provider}:"
+
+        if not Config.MODEL_ROUTING:
+            # Routing disabled: the chosen (or first) provider's default model
+            return Route(candidates[0][0], candidates[0][1], f"{reason}default")
+
+        features = extract_features(message, conversation_history)
+        request_class = self.classify(features)
+        if request_class != "chat":
+            # Short chit-chat goes to whatever is fastest; other classes prefer suited models
+            suited = [c for c in candidates if request_class in MODEL_TAGS.get(c[1], ())]
+            candidates = suited or candidates
+
+        if len(candidates) > 1 and self.rng.random() < Config.ROUTER_EXPLORE_RATE:
+            chosen = self.rng.choice(candidates)
+            return Route(chosen[0], chosen[1], f"{reason}{request_class}:explore")
+
+        def cost(candidate: Tuple[str, str, str]) -> Tuple[float, bool]:
+            # Measured specialists (e.g. codellama for code) win unless clearly slower; on a tie
+            # a measured model beats an unmeasured one
+            unmeasured = self.stats.get(candidate[2]) is None
+            specialist = not unmeasured and MODEL_TAGS.get(candidate[1]) == {request_class}
+            return self.expected_cost(candidate[2]) * (SPECIALIST_DISCOUNT if specialist else 1.0), unmeasured
+
+        chosen = min(candidates, key=cost)
+        return Route(chosen[0], chosen[1], f"{reason}{request_class}")
@@ -0,0 +1,166 @@
+"""
+On-demand sampling profiler for the live process.
+A background thread reads the stack of every other thread at a fixed interval
+for the requested duration, so nothing is instrumented and the bot runs at full
+speed between samples. Stacks are aggregated in the collapsed format
+("frame;frame;frame count" per line) read by flamegraph.pl, speedscope and
+similar tools. A thread is only sampled when its CPU clock shows it ran for
+at least a tenth of the interval since the previous sample; threads waiting
+in select(), on locks, in sleep() or on sockets are counted as idle and left
+out, so the output shows where CPU time goes. Where per-thread CPU clocks are
+unavailable every sample counts, as in a wall-clock profiler.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from config import Config
+
+# Share of the sampling interval a thread must have spent on CPU to count as busy
+_BUSY_CPU_SHARE = 0.1
+
+
+class ProfileResult(NamedTuple):
+    """Aggregated samples of one profiling run."""
+    seconds: float
+    samples: int
+    idle_samples: int
+    stacks: Dict[str, int]
+    leaves: Dict[str, int]
+
+    def collapsed(self) -> str:
+        """Stacks in collapsed format, most sampled first."""
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items(), key=lambda item: -item[1]))
+
+    def top(self, limit: int = 10) -> List[Tuple[str, float]]:
+        """Functions with the most samples at the top of the stack, with their share of busy samples."""
+        busy = self.samples - self.idle_samples
+        return [(leaf, count / busy) for leaf, count in Counter(self.leaves).most_common(limit)] if busy else []
+
+    def summary(self, limit: int = 5) -> str:
+        """Short plain-text report of the run."""
+        lines = [f"{self.samples} thread samples in {self.seconds:.1f}s, {self.samples - self.idle_samples} busy"]
+        lines += [f"{share:.1%} {leaf}" for leaf, share in self.top(limit)]
+        return "\n".join(lines)
+
+
+class SamplingProfiler:
+    """Samples all thread stacks of the process; one run at a time."""
+
+    def __init__(self, interval: float = None, max_seconds: float = None):
+        """
+        Initialize the profiler.
+
+        Args:
+            interval: Seconds between samples (default Config.PROFILE_SAMPLE_INTERVAL)
+            max_seconds: Longest run allowed (default Config.PROFILE_MAX_SECONDS)
+        """
+        self.interval = interval or Config.PROFILE_SAMPLE_INTERVAL
+        self.max_seconds = max_seconds or Config.PROFILE_MAX_SECONDS
+        self._running = threading.Lock()
+
+    @property
+    def busy(self) -> bool:
+        """Whether a run is in progress."""
+        return self._running.locked()
+
+    def profile(self, seconds: float) -> ProfileResult:
+        """
+        Sample all other threads for a while; blocks the calling thread for the duration.
+
+        Args:
+            seconds: How long to sample
+
+        Returns:
+            The aggregated samples
+
+        Raises:
+            ValueError: If seconds is not within (0, max_seconds]
+            RuntimeError: If another run is in progress
+        """
+        if not 0 < seconds <= self.max_seconds:
+            raise ValueError(f"Profile duration must be between 0 and {self.max_seconds:g} seconds")
+        if not self._running.acquire(blocking=False):
+            raise RuntimeError("A profile is already running")
+        try:
+            return self._sample(seconds)
+        finally:
+            self._running.release()
+
+    def _sample(self, seconds: float) -> ProfileResult:
+        """Collect and aggregate samples until `seconds` have passed."""
+        own_thread = threading.get_ident()
+        min_cpu = self.interval * _BUSY_CPU_SHARE
+        # thread ID -> CPU clock ID (None where unsupported), and CPU time at the previous sample
+        cpu_clocks: Dict[int, Optional[int]] = {}
+        last_cpu: Dict[int, float] = {}
+        thread_names: Dict[int, str] = {}
+        # Formatting a code object's name once instead of on every sample
+        frame_names: Dict[object, str] = {}
+        stacks: Counter = Counter()
+        leaves: Counter = Counter()
+        samples = idle = 0
+
+        started = time.monotonic()
+        deadline = started + seconds
+        next_sample = started
+        while True:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+            if now < next_sample:
+                time.sleep(next_sample - now)
+            next_sample += self.interval
+
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_thread:
+                    continue
+                samples += 1
+                if not self._ran(thread_id, cpu_clocks, last_cpu, min_cpu):
+                    idle += 1
+                    continue
+
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    name = frame_names.get(code)
+                    if name is None:
+                        name = frame_names[code] = f"{code.co_qualname} ({os.path.basename(code.co_filename)})"
+                    names.append(name)
+                    frame = frame.f_back
+                if thread_id not in thread_names:
+                    thread_names.update((thread.ident, thread.name) for thread in threading.enumerate())
+                names.append(thread_names.get(thread_id, str(thread_id)))
+                names.reverse()
+                stacks[";".join(names)] += 1
+                leaves[names[-1]] += 1
+
+        return ProfileResult(time.monotonic() - started, samples, idle, dict(stacks), dict(leaves))
+
+    @staticmethod
+    def _ran(thread_id: int, cpu_clocks: Dict[int, Optional[int]], last_cpu: Dict[int, float], min_cpu: float) -> bool:
+        """Whether a thread used at least `min_cpu` seconds of CPU since its previous sample."""
+        if thread_id not in cpu_clocks:
+            try:
+                cpu_clocks[thread_id] = time.pthread_getcpuclockid(thread_id)
+            except (AttributeError, OSError):
+                cpu_clocks[thread_id] = None
+        clock = cpu_clocks[thread_id]
+        if clock is None:
+            return True
+        try:
+            cpu = time.clock_gettime(clock)
+        except OSError:
+            # The thread exited after its frame was read
+            return False
+        previous = last_cpu.get(thread_id)
+        last_cpu[thread_id] = cpu
+        return previous is not None and cpu - previous >= min_cpu
+
+
+# Process-wide profiler shared by the /profile command and the admin HTTP route
+profiler = SamplingProfiler()
@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+"""
+Deterministic simulator for the Gemini and Together AI APIs.
+Serves generateContent/streamGenerateContent and chat completions (plus the model
+metadata endpoints used for health probes) with configurable
+latency distributions, time to first token, token rate, error injection and
+rate-limit windows, so backpressure, retries and failover can be tested offline.
+
+Example:
+    python provider_simulator.py --profile heavy-tail --port 8090
+    GEMINI_BASE_URL=http://127.0.0.1:8090/gemini/ \\
+    TOGETHER_BASE_URL=http://127.0.0.1:8090/together/v1 python main.py
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import math
+import time
+from collections import deque
+from random import Random
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from fake_servers import HTTPRequest, HTTPResponse, MiniHTTPServer, StreamingHTTPResponse
+
+WORDS = (
+    "the quick answer is that it depends on context and details so here are a few "
+    "points to consider first second finally python async model token request user "
+    "data example simple clear result value system message response time"
+).split()
+
+
+class Distribution:
+    """A latency or size distribution, optionally with a heavy tail."""
+
+    def __init__(self, dist: str = "constant", tail_probability: float = 0.0,
+                 tail_multiplier: float = 1.0, **params):
+        """
+        Initialize the distribution.
+
+        Args:
+            dist: One of constant (value), uniform (low, high), normal (mean, stddev),
+                lognormal (median, sigma) or pareto (scale, alpha)
+            tail_probability: Chance a sample is multiplied by tail_multiplier
+            tail_multiplier: Factor applied to tail samples
+            **params: Parameters of the chosen distribution
+        """
+        if dist not in ("constant", "uniform", "normal", "lognormal", "pareto"):
+            raise ValueError(f"Unknown distribution: {dist}")
+        self.dist = dist
+        self.tail_probability = tail_probability
+        self.tail_multiplier = tail_multiplier
+        self.params = params
+
+    @classmethod
+    def from_spec(cls, spec) -> "Distribution":
+        """Build a distribution from a number (constant) or a dict."""
+        if isinstance(spec, (int, float)):
+            return cls("constant", value=float(spec))
+        return cls(**spec)
+
+    def to_dict(self) -> dict:
+        """Serialize the distribution."""
+        spec = {"dist": self.dist, **self.params}
+        if self.tail_probability:
+            spec.update(tail_probability=self.tail_probability, tail_multiplier=self.tail_multiplier)
+        return spec
+
+    def sample(self, rng: Random) -> float:
+        """Draw a non-negative sample."""
+        p = self.params
+        if self.dist == "constant":
+            value = p.get("value", 0.0)
+        elif self.dist == "uniform":
+            value = rng.uniform(p.get("low", 0.0), p.get("high", 1.0))
+        elif self.dist == "normal":
+            value = rng.gauss(p.get("mean", 0.0), p.get("stddev", 0.0))
+        elif self.dist == "lognormal":
+            value = rng.lognormvariate(math.log(p.get("median", 1.0)), p.get("sigma", 0.5))
+        else:
+            value = p.get("scale", 1.0) * rng.paretovariate(p.get("alpha", 2.0))
+
+        if self.tail_probability and rng.random() < self.tail_probability:
+            value *= self.tail_multiplier
+        return max(0.0, value)
+
+
+class SimulationProfile:
+    """Behaviour of one simulated provider."""
+
+    def __init__(self, latency=0.05, ttft=0.2, tokens_per_second: float = 80.0,
+                 response_tokens=60, error_rates: Optional[Dict[str, float]] = None,
+                 rate_limit_rpm: int = 0, outages: Optional[List[List[float]]] = None,
+                 thinking_share: float = 0.0):
+        """
+        Initialize the profile.
+
+        Args:
+            latency: Network/queueing overhead before generation starts (Distribution spec)
+            ttft: Time to first token (Distribution spec)
+            tokens_per_second: Token generation rate after the first token
+            response_tokens: Number of tokens per response (Distribution spec)
+            error_rates: Probability of injecting each HTTP status, e.g. {"429": 0.01, "503": 0.005}
+            rate_limit_rpm: Requests per rolling minute and API key before 429s are returned (0 disables)
+            outages: [start, end] windows, in seconds since simulator start, that return 503
+            thinking_share: Average share of a Gemini thinking budget spent on thought tokens (0 = no thinking time)
+        """
+        self.latency = Distribution.from_spec(latency)
+        self.ttft = Distribution.from_spec(ttft)
+        self.tokens_per_second = tokens_per_second
+        self.response_tokens = Distribution.from_spec(response_tokens)
+        self.error_rates = {int(status): rate for status, rate in (error_rates or {}).items()}
+        self.rate_limit_rpm = rate_limit_rpm
+        self.outages = [tuple(window) for window in (outages or [])]
+        self.thinking_share = thinking_share
+
+    @classmethod
+    def from_dict(cls, spec: dict) -> "SimulationProfile":
+        """Build a profile from its dict form."""
+        return cls(**spec)
+
+    def to_dict(self) -> dict:
+        """Serialize the profile."""
+        return {
+            "latency": self.latency.to_dict(),
+            "ttft": self.ttft.to_dict(),
+            "tokens_per_second": self.tokens_per_second,
+            "response_tokens": self.response_tokens.to_dict(),
+            "error_rates": {str(status): rate for status, rate in self.error_rates.items()},
+            "rate_limit_rpm": self.rate_limit_rpm,
+            "outages": [list(window) for window in self.outages],
+            "thinking_share": self.thinking_share,
+        }
+
+
+# Built-in scenarios; a JSON file with the same shape can be passed instead
+PROFILES: Dict[str, dict] = {
+    "instant": {"latency": 0.0, "ttft": 0.0, "tokens_per_second": 1e9, "response_tokens": 20},
+    "fast": {"latency": 0.02, "ttft": 0.15, "tokens_per_second": 200.0, "response_tokens": 60},
+    "realistic": {
+        "latency": {"dist": "lognormal", "median": 0.08, "sigma": 0.4},
+        "ttft": {"dist": "lognormal", "median": 0.6, "sigma": 0.5},
+        "tokens_per_second": 90.0,
+        "response_tokens": {"dist": "uniform", "low": 30, "high": 400},
+        "thinking_share": 0.1,
+    },
+    "heavy-tail": {
+        "latency": {"dist": "lognormal", "median": 0.1, "sigma": 0.6},
+        "ttft": {"dist": "pareto", "scale": 0.4, "alpha": 1.5, "tail_probability": 0.02, "tail_multiplier": 20},
+        "tokens_per_second": 70.0,
+        "response_tokens": {"dist": "uniform", "low": 30, "high": 600},
+        "thinking_share": 0.1,
+    },
+    "flaky": {
+        "latency": {"dist": "lognormal", "median": 0.08, "sigma": 0.4},
+        "ttft": {"dist": "lognormal", "median": 0.5, "sigma": 0.5},
+        "tokens_per_second": 90.0,
+        "response_tokens": 120,
+        "error_rates": {"429": 0.05, "500": 0.02, "503": 0.03},
+    },
+    "rate-limited": {
+        "latency": 0.05, "ttft": 0.3, "tokens_per_second": 100.0, "response_tokens": 80,
+        "rate_limit_rpm": 60,
+    },
+    "outage": {
+        "latency": 0.05, "ttft": 0.3, "tokens_per_second": 100.0, "response_tokens": 80,
+        "outages": [[30, 90]],
+    },
+}
+
+
+def load_profile(name_or_path: str) -> dict:
+    """
+    Load a scenario by built-in name or from a JSON file.
+
+    The file may hold a single profile applied to both providers, or
+    {"gemini": {...}, "together": {...}}.
+    """
+    if name_or_path in PROFILES:
+        return PROFILES[name_or_path]
+    with open(name_or_path) as f:
+        return json.load(f)
+
+
+class ProviderSimulator:
+    """Serves simulated Gemini and Together AI endpoints from one HTTP server."""
+
+    PROVIDERS = ("gemini", "together")
+
+    def __init__(self, profile="fast", seed: int = 0, host: str = "127.0.0.1", port: int = 0):
+        """
+        Initialize the simulator.
+
+        Args:
+            profile: Built-in profile name, JSON path, or dict (optionally keyed per provider)
+            seed: Seed making per-request latencies, errors and text repeatable
+            host: Interface to listen on
+            port: Port to listen on (0 picks a free port)
+        """
+        self.logger = logging.getLogger(__name__)
+        spec = load_profile(profile) if isinstance(profile, str) else profile
+        self.profiles: Dict[str, SimulationProfile] = {
+            provider: SimulationProfile.from_dict(spec.get(provider, spec) if set(spec) & set(self.PROVIDERS) else spec)
+            for provider in self.PROVIDERS
+        }
+        self.seed = seed
+        self.server = MiniHTTPServer(self.handle, host, port)
+        self.started_at = time.monotonic()
+
+        self.request_counts: Dict[str, int] = {provider: 0 for provider in self.PROVIDERS}
+        self.status_counts: Dict[str, Dict[int, int]] = {provider: {} for provider in self.PROVIDERS}
+        # (provider, API key) -> request times in the last minute; quotas are per key, as with the real APIs
+        self._recent_requests: Dict[Tuple[str, str], deque] = {}
+
+    @property
+    def gemini_base_url(self) -> str:
+        """Value for Config.GEMINI_BASE_URL."""
+        return f"{self.server.url}/gemini/"
+
+    @property
+    def together_base_url(self) -> str:
+        """Value for Config.TOGETHER_BASE_URL."""
+        return f"{self.server.url}/together/v1"
+
+    async def start(self):
+        """Start serving."""
+        self.started_at = time.monotonic()
+        await self.server.start()
+
+    async def stop(self):
+        """Stop serving."""
+        await self.server.stop()
+
+    def stats(self) -> dict:
+        """Request and status counts per provider."""
+        return {
+            provider: {"requests": self.request_counts[provider], "statuses": dict(self.status_counts[provider])}
+            for provider in self.PROVIDERS
+        }
+
+    async def handle(self, request: HTTPRequest) -> HTTPResponse:
+        """Route a request to the matching simulated API."""
+        path = request.path
+        if path == "/stats":
+            return HTTPResponse.json(self.stats())
+
+        if request.method == "GET" and path.startswith("/gemini/") and "/models/" in path:
+            model = path.rsplit("/", 1)[-1]
+            return HTTPResponse.json({"name": f"models/{model}", "displayName": model, "inputTokenLimit": 1048576})
+
+        if request.method == "GET" and path.startswith("/together/") and path.endswith("/models"):
+            return HTTPResponse.json([{"id": "meta-llama/Llama-2-70b-chat-hf", "object": "model", "type": "chat"}])
+
+        if path.startswith("/gemini/") and (":generateContent" in path or ":streamGenerateContent" in path):
+            model = path.rsplit("/", 1)[-1].split(":")[0]
+            thinking = (request.json().get("generationConfig") or {}).get("thinkingConfig") or {}
+            # google-genai sends the budget key in snake_case; the REST docs use camelCase
+            budget = thinking.get("thinkingBudget", thinking.get("thinking_budget", None if "lite" in model else -1))
+            api_key = request.headers.get("x-goog-api-key", "")
+            return await self._simulate("gemini", model, ":streamGenerateContent" in path, budget, api_key)
+
+        if path.startswith("/together/") and path.endswith("/chat/completions"):
+            body = request.json()
+            api_key = request.headers.get("authorization", "").rpartition(" ")[2]
+            return await self._simulate("together", body.get("model", ""), bool(body.get("stream")), api_key=api_key)
+
+        return HTTPResponse.json({"error": {"code": 404, "message": f"Unknown path {path}"}}, status=404)
+
+    def _injected_status(self, provider: str, rng: Random, api_key: str = "") -> Optional[int]:
+        """Decide whether this request fails, and with which status."""
+        profile = self.profiles[provider]
+        now = time.monotonic()
+        elapsed = now - self.started_at
+
+        if any(start <= elapsed < end for start, end in profile.outages):
+            return 503
+
+        if profile.rate_limit_rpm:
+            recent = self._recent_requests.setdefault((provider, api_key), deque())
+            while recent and recent[0] <= now - 60:
+                recent.popleft()
+            if len(recent) >= profile.rate_limit_rpm:
+                return 429
+            recent.append(now)
+
+        roll = rng.random()
+        for status, rate in sorted(profile.error_rates.items()):
+            if roll < rate:
+                return status
+            roll -= rate
+        return None
+
+    async def _simulate(self, provider: str, model: str, stream: bool,
+                        thinking_budget: Optional[int] = None, api_key: str = "") -> HTTPResponse:
+        """
+        Produce a simulated response according to the provider's profile.
+
+        With a thinking_share, Gemini thinking (budget > 0, or -1 for dynamic) adds
+        thought tokens that are generated at the profile's token rate before the
+        first visible token.
+        """
+        profile = self.profiles[provider]
+        sequence = self.request_counts[provider]
+        self.request_counts[provider] += 1
+        rng = Random(f"{self.seed}:{provider}:{sequence}")
+
+        await asyncio.sleep(profile.latency.sample(rng))
+
+        status = self._injected_status(provider, rng, api_key)
+        if status is not None:
+            self._count_status(provider, status)
+            return self._error_response(provider, status)
+
+        ttft = profile.ttft.sample(rng)
+        tokens = [rng.choice(WORDS) for _ in range(max(1, int(profile.response_tokens.sample(rng))))]
+        thoughts = 0
+        if profile.thinking_share > 0 and thinking_budget:
+            # Dynamic thinking behaves like a mid-sized budget
+            budget = 4096 if thinking_budget == -1 else thinking_budget
+            thoughts = min(budget, int(budget * profile.thinking_share * rng.uniform(0.5, 1.5)))
+        ttft += thoughts / profile.tokens_per_second
+        self._count_status(provider, 200)
+
+        if stream:
+            chunks = self._stream_events(provider, model, tokens, ttft, profile.tokens_per_second, thoughts)
+            return StreamingHTTPResponse(chunks)
+
+        await asyncio.sleep(ttft + (len(tokens) - 1) / profile.tokens_per_second)
+        text = " ".join(tokens)
+        if provider == "gemini":
+            return HTTPResponse.json(self._gemini_body(model, text, len(tokens), final=True, thoughts=thoughts))
+        return HTTPResponse.json(self._together_body(model, text, len(tokens)))
+
+    def _count_status(self, provider: str, status: int):
+        """Record the status returned for a request."""
+        counts = self.status_counts[provider]
+        counts[status] = counts.get(status, 0) + 1
+
+    def _error_response(self, provider: str, status: int) -> HTTPResponse:
+        """Build an error body in the provider's format."""
+        messages = {
+            429: "Resource has been exhausted (e.g. check quota).",
+            500: "An internal error has occurred.",
+            502: "Bad gateway.",
+            503: "The model is overloaded. Please try again later.",
+        }
+        message = messages.get(status, "Simulated error.")
+        headers = {"Retry-After": "1"} if status == 429 else None
+
+        if provider == "gemini":
+            grpc_status = {429: "RESOURCE_EXHAUSTED", 503: "UNAVAILABLE"}.get(status, "INTERNAL")
+            payload = {"error": {"code": status, "message": message, "status": grpc_status}}
+        else:
+            error_type = "rate_limit_exceeded" if status == 429 else "server_error"
+            payload = {"error": {"message": message, "type": error_type, "code": status}}
+        return HTTPResponse.json(payload, status=status, headers=headers)
+
+    async def _stream_events(self, provider: str, model: str, tokens: List[str],
+                             ttft: float, tokens_per_second: float, thoughts: int = 0) -> AsyncIterator[bytes]:
+        """Yield server-sent events: the first token after ttft, then the rest at the token rate."""
+        await asyncio.sleep(ttft)
+        chunk_size = 4
+        for start in range(0, len(tokens), chunk_size):
+            if start:
+                await asyncio.sleep(chunk_size / tokens_per_second)
+            piece = " ".join(tokens[start:start + chunk_size]) + " "
+            final = start + chunk_size >= len(tokens)
+            if provider == "gemini":
+                event = self._gemini_body(model, piece, len(tokens), final, thoughts)
+            else:
+                event = self._together_chunk(model, piece, final)
+            yield b"data: " + json.dumps(event).encode("utf-8") + b"\n\n"
+
+        if provider == "together":
+            yield b"data: [DONE]\n\n"
+
+    @staticmethod
+    def _gemini_body(model: str, text: str, token_count: int, final: bool, thoughts: int = 0) -> dict:
+        """Build a generateContent response (or stream chunk)."""
+        candidate = {"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}
+        body = {"candidates": [candidate], "modelVersion": model}
+        if final:
+            candidate["finishReason"] = "STOP"
+            body["usageMetadata"] = {
+                "promptTokenCount": 10, "candidatesTokenCount": token_count,
+                "totalTokenCount": 10 + token_count + thoughts
+            }
+            if thoughts:
+                body["usageMetadata"]["thoughtsTokenCount"] = thoughts
+        return body
+
+    @staticmethod
+    def _together_body(model: str, text: str, token_count: int) -> dict:
+        """Build a chat completions response."""
+        return {
+            "id": f"sim-{time.monotonic_ns()}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": text},
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": 10, "completion_tokens": token_count, "total_tokens": 10 + token_count},
+        }
+
+    @staticmethod
+    def _together_chunk(model: str, text: str, final: bool) -> dict:
+        """Build a chat completions stream chunk."""
+        return {
+            "id": f"sim-{time.monotonic_ns()}",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "delta": {"content": text},
+                "finish_reason": "stop" if final else None,
+            }],
+        }
+
+
+async def serve(simulator: ProviderSimulator):
+    """Run the simulator until interrupted."""
+    await simulator.start()
+    print(f"Provider simulator listening on {simulator.server.url}")
+    print(f"  GEMINI_BASE_URL={simulator.gemini_base_url}")
+    print(f"  TOGETHER_BASE_URL={simulator.together_base_url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await simulator.stop()
+
+
+def main():
+    """Run the simulator from the command line."""
+    parser = argparse.ArgumentParser(description="Simulated Gemini and Together AI endpoints")
+    parser.add_argument("--profile", default="realistic",
+                        help=f"Built-in profile ({', '.join(PROFILES)}) or path to a JSON profile")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--show-profile", action="store_true", help="Print the resolved profile and exit")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    simulator = ProviderSimulator(args.profile, seed=args.seed, host=args.host, port=args.port)
+
+    if args.show_profile:
+        print(json.dumps({p: simulator.profiles[p].to_dict() for p in simulator.PROVIDERS}, indent=2))
+        return
+
+    try:
+        asyncio.run(serve(simulator))
+    except KeyboardInterrupt:
+        print(f"\nFinal stats: {json.dumps(simulator.stats())}")
+
+
+if __name__ == "__main__":
+    main()
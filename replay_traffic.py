@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+Replay recorded update traffic against the bot with fake Telegram and AI providers.
+Feeds updates captured by traffic_recorder.py back into TelegramGeminiBot
+(polling) or TelegramWebhookBot (webhook) with their original timing, sped up,
+or as fast as possible, and reports throughput and reply latency so versions can
+be compared on the same real traffic.
+
+Examples:
+    python replay_traffic.py recordings/                      # original timing (1x)
+    python replay_traffic.py recordings/ --speed 10           # ten times faster
+    python replay_traffic.py recordings/ --speed max --mode webhook --json report.json
+"""
+
+import argparse
+import asyncio
+import heapq
+import json
+import logging
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from load_test import LoadTest, memory_usage, percentile, print_report
+from provider_simulator import PROFILES
+from traffic_recorder import find_segments, read_segment
+
+
+class TrafficReplay(LoadTest):
+    """Replays recorded updates through the bot and measures reply latency."""
+
+    def __init__(self, recordings: List[str], mode: str = "polling", speed: float = 1.0,
+                 max_in_flight: int = 1000, limit: int = 0, rate_limit: bool = True, **kwargs):
+        """
+        Initialize the replay.
+
+        Args:
+            recordings: Segment files or directories containing them
+            mode: "polling" for TelegramGeminiBot, "webhook" for TelegramWebhookBot
+            speed: Replay speed relative to the recording (0 = as fast as possible)
+            max_in_flight: Updates awaiting replies at once when replaying as fast as possible
+            limit: Stop after this many updates (0 = all)
+            rate_limit: Keep the bot's per-user rate limit (recorded bursts may exceed it when sped up)
+            **kwargs: Passed to LoadTest (profile, reply_timeout, seed, trace_memory)
+        """
+        super().__init__(mode=mode, users=0, messages_per_user=1, **kwargs)
+        self.segments = find_segments(recordings)
+        self.speed = speed
+        self.max_in_flight = max_in_flight
+        self.limit = limit
+        self.rate_limit = rate_limit
+
+        self.outcomes["unanswered"] = 0
+        self.replayed = 0
+        self.chats = set()
+        self.recorded_latencies: List[float] = []
+
+    def _configure(self):
+        """Point the bot at the fake servers and optionally lift the rate limit."""
+        super()._configure()
+        if not self.rate_limit:
+            from config import Config
+            Config.RATE_LIMIT_REQUESTS = 10 ** 9
+
+    def _records(self) -> Iterator[Tuple[float, Dict[str, Any]]]:
+        """Updates from all segments in timestamp order, collecting recorded provider latencies."""
+        def updates(path: str) -> Iterator[Tuple[float, Dict[str, Any]]]:
+            for record in read_segment(path):
+                if record["kind"] == "update":
+                    yield record["t"], record["update"]
+                elif record["kind"] == "response":
+                    self.recorded_latencies.append(record["latency_s"])
+
+        # Segments from several processes (sharded webhook workers) overlap in time
+        return heapq.merge(*(updates(path) for path in self.segments), key=lambda item: item[0])
+
+    async def _replay_update(self, update: Dict[str, Any]):
+        """Submit one update and, for plain text messages, wait for the bot's reply."""
+        message = update.get("message") or {}
+        text = message.get("text")
+        expects_reply = bool(text) and not text.startswith("/")
+        chat_id = (message.get("chat") or {}).get("id")
+        if chat_id is not None:
+            self.chats.add(chat_id)
+
+        reply = self.telegram.wait_for_reply(chat_id) if expects_reply else None
+        started = time.perf_counter()
+        try:
+            await self._submit(update)
+            if reply is None:
+                self.outcomes["unanswered"] += 1
+                return
+            reply_text = await asyncio.wait_for(reply, self.reply_timeout)
+        except asyncio.TimeoutError:
+            self.outcomes["timeout"] += 1
+            return
+        except Exception as e:
+            self.logger.debug("Replaying update %s failed: %s", update.get("update_id"), e)
+            self.outcomes["error"] += 1
+            return
+
+        self.latencies.append(time.perf_counter() - started)
+        self.outcomes[self._classify(reply_text)] += 1
+
+    async def run(self) -> dict:
+        """Replay the recording and return the report."""
+        if not self.segments:
+            raise FileNotFoundError("No recording segments found")
+
+        self.server_thread.start(self.telegram, self.providers)
+        self._configure()
+        memory_before = memory_usage()
+        try:
+            if self.mode == "webhook":
+                await self._start_webhook_bot()
+            else:
+                await self._start_polling_bot()
+
+            in_flight = asyncio.Semaphore(self.max_in_flight)
+            tasks = set()
+            first_timestamp = None
+            started = time.perf_counter()
+            for timestamp, update in self._records():
+                if first_timestamp is None:
+                    first_timestamp = timestamp
+                if self.speed > 0:
+                    delay = started + (timestamp - first_timestamp) / self.speed - time.perf_counter()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                else:
+                    await in_flight.acquire()
+
+                task = asyncio.create_task(self._replay_update(update))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                if self.speed <= 0:
+                    task.add_done_callback(lambda _: in_flight.release())
+
+                self.replayed += 1
+                if self.replayed == self.limit:
+                    break
+
+            if tasks:
+                await asyncio.gather(*tasks)
+            elapsed = time.perf_counter() - started
+
+            report = self._report(elapsed, memory_before)
+        finally:
+            for cleanup in reversed(self._cleanup):
+                await cleanup()
+            self.server_thread.stop(self.telegram, self.providers)
+
+        return report
+
+    def _report(self, elapsed: float, memory_before: Dict[str, float]) -> dict:
+        """Summarize the replay, including the latencies recorded in production."""
+        self.users = len(self.chats)
+        report = super()._report(elapsed, memory_before)
+        report["speed"] = self.speed or "max"
+        report["updates"] = self.replayed
+        report["segments"] = len(self.segments)
+        if self.recorded_latencies:
+            report["recorded_provider_latency_ms"] = {
+                "p50": round(percentile(self.recorded_latencies, 50) * 1000, 1),
+                "p95": round(percentile(self.recorded_latencies, 95) * 1000, 1),
+                "p99": round(percentile(self.recorded_latencies, 99) * 1000, 1),
+            }
+        return report
+
+
+def parse_speed(value: str) -> float:
+    """Parse --speed: a multiplier such as 1, 10 or 0.5, or "max"."""
+    if value.lower() in ("max", "0"):
+        return 0.0
+    speed = float(value.lower().rstrip("x"))
+    if speed <= 0:
+        raise argparse.ArgumentTypeError("speed must be positive or 'max'")
+    return speed
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description="Replay recorded update traffic against fake Telegram and AI providers")
+    parser.add_argument("recordings", nargs="+", help="Segment files or directories of updates-*.jsonl.gz")
+    parser.add_argument("--mode", choices=["polling", "webhook"], default="polling")
+    parser.add_argument("--speed", type=parse_speed, default=1.0,
+                        help="Replay speed: 1 (original timing), N (N times faster) or max")
+    parser.add_argument("--max-in-flight", type=int, default=1000,
+                        help="Updates awaiting replies at once with --speed max")
+    parser.add_argument("--limit", type=int, default=0, help="Replay at most this many updates")
+    parser.add_argument("--no-rate-limit", action="store_true", help="Disable the bot's per-user rate limit")
+    parser.add_argument("--profile", default="fast",
+                        help=f"Provider simulator profile ({', '.join(PROFILES)}) or JSON path")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Reply timeout in seconds")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="Write the report as JSON to this file")
+    parser.add_argument("--log-level", default="WARNING")
+    return parser.parse_args(argv)
+
+
+def main():
+    """Replay a recording from the command line."""
+    args = parse_args()
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=args.log_level.upper()
+    )
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+    replay = TrafficReplay(
+        args.recordings,
+        mode=args.mode,
+        speed=args.speed,
+        max_in_flight=args.max_in_flight,
+        limit=args.limit,
+        rate_limit=not args.no_rate_limit,
+        profile=args.profile,
+        reply_timeout=args.timeout,
+        seed=args.seed
+    )
+    report = asyncio.run(replay.run())
+    print_report(report)
+    print(f"Replayed {report['updates']} updates from {report['segments']} segments at speed {report['speed']}")
+    if "recorded_provider_latency_ms" in report:
+        recorded = report["recorded_provider_latency_ms"]
+        print(f"Recorded provider latency (ms): p50={recorded['p50']} p95={recorded['p95']} p99={recorded['p99']}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+"""
+Fair scheduling of provider calls across users.
+A fixed number of provider slots is shared with deficit round robin over
+per-user queues, so a user sending as fast as the rate limit allows cannot
+crowd out everyone else. Admins get a priority lane, and requests that have
+waited too long are aged to the front so nobody starves.
+"""
+
+import asyncio
+import heapq
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, Iterable, List, Optional
+
+from config import Config
+
+
+class _Waiter:
+    """A request waiting for a provider slot."""
+
+    __slots__ = ("user_id", "cost", "enqueued", "future", "priority")
+
+    def __init__(self, user_id: int, cost: float, priority: bool, future: asyncio.Future):
+        self.user_id = user_id
+        self.cost = cost
+        self.priority = priority
+        self.enqueued = time.monotonic()
+        self.future = future
+
+
+def _percentile(ordered: List[float], pct: float) -> float:
+    """Nearest-rank percentile of a sorted list."""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(pct / 100 * len(ordered)))]
+
+
+class FairScheduler:
+    """Shares provider concurrency across users with deficit round robin."""
+
+    def __init__(self, slots: int = None, quantum: float = None, aging_seconds: float = None,
+                 priority_users: Iterable[int] = None):
+        """
+        Initialize the scheduler.
+
+        Args:
+            slots: Provider calls allowed at once (default Config.PROVIDER_CONCURRENCY)
+            quantum: Cost credited to a user per round (default Config.SCHEDULER_QUANTUM)
+            aging_seconds: Wait after which a request is served ahead of all others
+                (default Config.SCHEDULER_AGING_SECONDS, 0 disables aging)
+            priority_users: User IDs served from the priority lane (default Config.ADMIN_USER_IDS)
+        """
+        self.slots = slots or Config.PROVIDER_CONCURRENCY
+        self.quantum = quantum or Config.SCHEDULER_QUANTUM
+        self.aging_seconds = aging_seconds if aging_seconds is not None else Config.SCHEDULER_AGING_SECONDS
+        self.priority_users = frozenset(priority_users if priority_users is not None else Config.ADMIN_USER_IDS)
+
+        self.in_use = 0
+        # Per-user FIFO queues and the round-robin order of users with queued requests
+        self._queues: Dict[int, Deque[_Waiter]] = {}
+        self._active: Deque[int] = deque()
+        self._deficits: Dict[int, float] = {}
+        self._priority: Deque[_Waiter] = deque()
+        # All normal-lane waiters in arrival order, for aging (only kept when aging is enabled)
+        self._arrivals: Deque[_Waiter] = deque()
+
+        self.granted = 0
+        self.aged = 0
+        self._recent_waits: Deque[float] = deque(maxlen=2000)
+        # user ID -> [requests, total wait, max wait], least recently updated first
+        self._user_waits: "OrderedDict[int, List[float]]" = OrderedDict()
+
+    @property
+    def queued(self) -> int:
+        """Requests waiting for a slot in either lane."""
+        return sum(len(queue) for queue in self._queues.values()) + len(self._priority)
+
+    @asynccontextmanager
+    async def slot(self, user_id: int, cost: float = 1.0):
+        """
+        Hold a provider slot for the duration of the block.
+
+        Args:
+            user_id: Telegram user ID the request is made for
+            cost: Relative cost of the request (e.g. larger for long prompts)
+        """
+        await self.acquire(user_id, cost)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, user_id: int, cost: float = 1.0) -> float:
+        """
+        Wait for a provider slot.
+
+        Args:
+            user_id: Telegram user ID the request is made for
+            cost: Relative cost of the request
+
+        Returns:
+            Seconds spent waiting
+        """
+        priority = user_id in self.priority_users
+        if self.in_use < self.slots and not self._priority and not self._queues:
+            self.in_use += 1
+            self._record_wait(user_id, 0.0)
+            return 0.0
+
+        waiter = _Waiter(user_id, cost, priority, asyncio.get_running_loop().create_future())
+        if priority:
+            self._priority.append(waiter)
+        else:
+            queue = self._queues.get(user_id)
+            if queue is None:
+                queue = self._queues[user_id] = deque()
+                self._active.append(user_id)
+                self._deficits[user_id] = 0.0
+            queue.append(waiter)
+            if self.aging_seconds > 0:
+                self._arrivals.append(waiter)
+        self._dispatch()
+
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                # Granted just as the caller was cancelled: hand the slot on
+                self.release()
+            else:
+                self._remove(waiter)
+            raise
+
+        waited = time.monotonic() - waiter.enqueued
+        self._record_wait(user_id, waited)
+        return waited
+
+    def release(self):
+        """Return a slot and start the next waiting request."""
+        self.in_use -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        """Grant free slots to waiting requests."""
+        while self.in_use < self.slots:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            self.in_use += 1
+            self.granted += 1
+            waiter.future.set_result(None)
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        """Pick the next request: aged first, then the priority lane, then deficit round robin."""
+        if self.aging_seconds > 0:
+            arrivals = self._arrivals
+            while arrivals and arrivals[0].future.done():
+                arrivals.popleft()
+            if arrivals and time.monotonic() - arrivals[0].enqueued >= self.aging_seconds:
+                waiter = arrivals.popleft()
+                self._take(waiter)
+                self.aged += 1
+                return waiter
+
+        while self._priority:
+            waiter = self._priority.popleft()
+            if not waiter.future.done():
+                return waiter
+
+        while self._active:
+            user_id = self._active[0]
+            queue = self._queues[user_id]
+            waiter = queue[0]
+            if waiter.future.done():
+                self._take(waiter)
+                continue
+            if self._deficits[user_id] >= waiter.cost:
+                self._deficits[user_id] -= waiter.cost
+                self._take(waiter)
+                return waiter
+            # Credit one quantum and move on to the next user
+            self._deficits[user_id] += self.quantum
+            self._active.rotate(-1)
+        return None
+
+    def _take(self, waiter: _Waiter):
+        """Remove a waiter from its user's queue, dropping the user from the rotation when empty."""
+        queue = self._queues.get(waiter.user_id)
+        if not queue:
+            return
+        try:
+            queue.remove(waiter)
+        except ValueError:
+            return
+        if not queue:
+            del self._queues[waiter.user_id]
+            del self._deficits[waiter.user_id]
+            self._active.remove(waiter.user_id)
+
+    def _remove(self, waiter: _Waiter):
+        """Forget a cancelled waiter."""
+        if waiter.priority:
+            try:
+                self._priority.remove(waiter)
+            except ValueError:
+                pass
+        else:
+            self._take(waiter)
+
+    def _record_wait(self, user_id: int, waited: float):
+        """Track queue wait overall and per user."""
+        self._recent_waits.append(waited)
+        stats = self._user_waits.get(user_id)
+        if stats is None:
+            stats = self._user_waits[user_id] = [0, 0.0, 0.0]
+            if len(self._user_waits) > 10_000:
+                self._user_waits.popitem(last=False)
+        else:
+            self._user_waits.move_to_end(user_id)
+        stats[0] += 1
+        stats[1] += waited
+        stats[2] = max(stats[2], waited)
+
+    def user_wait(self, user_id: int) -> Optional[Dict[str, float]]:
+        """Queue wait statistics of one user, or None if they have made no requests."""
+        stats = self._user_waits.get(user_id)
+        if stats is None:
+            return None
+        requests, total, longest = stats
+        return {"requests": int(requests), "avg_wait_ms": round(total / requests * 1000, 1),
+                "max_wait_ms": round(longest * 1000, 1)}
+
+    def stats(self, top_users: int = 10) -> Dict[str, Any]:
+        """Scheduler state, wait percentiles and the users who waited longest on average."""
+        waits = sorted(self._recent_waits)
+        slowest = heapq.nlargest(top_users, self._user_waits.items(), key=lambda item: item[1][1] / item[1][0]) \
+            if top_users else []
+        return {
+            "slots": self.slots,
+            "in_use": self.in_use,
+            "queued": self.queued,
+            "priority_queued": len(self._priority),
+            "queued_users": len(self._queues),
+            "granted": self.granted,
+            "aged": self.aged,
+            "wait_ms": {
+                "p50": round(_percentile(waits, 50) * 1000, 1),
+                "p95": round(_percentile(waits, 95) * 1000, 1),
+                "p99": round(_percentile(waits, 99) * 1000, 1),
+            },
+            "users": {str(user_id): self.user_wait(user_id) for user_id, _ in slowest},
+        }
@@ -0,0 +1,450 @@
+"""
+Multi-process webhook mode with user-sharded state.
+A front process receives Telegram webhooks and routes each raw update to one of
+N worker processes by consistent hashing of the user (or chat) ID, so per-user
+state lives in exactly one worker and needs no locks.
+"""
+
+import asyncio
+import bisect
+import concurrent.futures
+import hashlib
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from flask import Flask, request, Response
+
+from config import Config
+from dedup import UpdateDeduplicator
+from traffic_recorder import recorder
+import webhook_ingest
+
+# Update fields that carry the acting user, in the order they are tried
+_USER_FIELDS = ("message", "edited_message", "callback_query", "inline_query", "my_chat_member",
+                "chosen_inline_result", "pre_checkout_query", "shipping_query", "poll_answer")
+
+
+def shard_key(update: Dict[str, Any]) -> int:
+    """
+    Routing key of a raw update: the sender's user ID, else the chat ID, else the update ID.
+
+    Args:
+        update: Update as decoded from the webhook JSON
+
+    Returns:
+        Integer key to hash onto the ring
+    """
+    for field in _USER_FIELDS:
+        payload = update.get(field)
+        if not isinstance(payload, dict):
+            continue
+        sender = payload.get("from") or payload.get("user")
+        if sender and "id" in sender:
+            return sender["id"]
+        chat = payload.get("chat")
+        if chat and "id" in chat:
+            return chat["id"]
+    return update.get("update_id", 0)
+
+
+def _hash(value: str) -> int:
+    """Stable, well-mixed 64-bit hash (Python's hash() is randomized per process)."""
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class ConsistentHashRing:
+    """Hash ring with virtual nodes; adding a worker moves only about 1/N of the keys."""
+
+    def __init__(self, nodes: Optional[List[int]] = None, replicas: int = 128):
+        """
+        Initialize the ring.
+
+        Args:
+            nodes: Worker IDs to place on the ring
+            replicas: Virtual nodes per worker (more gives a more even spread)
+        """
+        self.replicas = replicas
+        self.nodes: List[int] = []
+        self._points: List[int] = []
+        self._owners: List[int] = []
+        for node in nodes or []:
+            self.add(node)
+
+    def add(self, node: int):
+        """Place a worker on the ring."""
+        if node in self.nodes:
+            return
+        self.nodes.append(node)
+        for replica in range(self.replicas):
+            point = _hash(f"worker-{node}#{replica}")
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove(self, node: int):
+        """Take a worker off the ring."""
+        if node not in self.nodes:
+            return
+        self.nodes.remove(node)
+        kept = [(p, o) for p, o in zip(self._points, self._owners) if o != node]
+        self._points = [p for p, _ in kept]
+        self._owners = [o for _, o in kept]
+
+    def node_for(self, key: int) -> int:
+        """Worker owning a key."""
+        if not self._points:
+            raise LookupError("Hash ring has no workers")
+        index = bisect.bisect(self._points, _hash(str(key))) % len(self._points)
+        return self._owners[index]
+
+
+def _worker_main(worker_id: int, token: str, webhook_url: str, inbox: multiprocessing.Queue,
+                 results: multiprocessing.Queue):
+    """
+    Entry point of a worker process.
+
+    Messages on the inbox:
+        ("update", body)            raw webhook JSON to process
+        ("export", (epoch, nodes))  copy the state of users that no longer hash to this worker
+        ("release", nodes)          drop that state once the front has switched to the new ring
+        ("import", state)           take over state exported by another worker
+        None                        stop
+    """
+    from logging_setup import setup_logging
+    setup_logging(log_file=None)
+    # Users move between workers, so one snapshot file cannot serve them all
+    Config.SNAPSHOT_FILE = ""
+    logger = logging.getLogger(f"{__name__}.worker{worker_id}")
+
+    from telegram import Update
+    from webhook_server import TelegramWebhookBot
+
+    bot = TelegramWebhookBot(token, webhook_url)
+    bot.start_event_loop(set_webhook=False)
+    results.put(("ready", worker_id, None))
+    logger.info("Worker %s ready", worker_id)
+
+    pending = set()
+    for message in iter(inbox.get, None):
+        kind, payload = message
+        try:
+            if kind == "update":
+                update = Update.de_json(webhook_ingest.loads(payload), bot.application.bot)
+                future = asyncio.run_coroutine_threadsafe(bot.application.process_update(update), bot.loop)
+                pending.add(future)
+                future.add_done_callback(pending.discard)
+            elif kind == "export":
+                epoch, nodes = payload
+                # Let in-flight updates finish so no user state changes after the hand-over, but
+                # leave the front time to collect every export before SHARD_REBALANCE_TIMEOUT
+                _, unfinished = concurrent.futures.wait(pending.copy(), timeout=Config.SHARD_REBALANCE_TIMEOUT / 2)
+                if unfinished:
+                    logger.warning("Worker %s exporting with %d updates still in flight", worker_id, len(unfinished))
+                ring = ConsistentHashRing(nodes, replicas=Config.SHARD_VIRTUAL_NODES)
+                # Only copied: the front may still abort the rebalance
+                state = asyncio.run_coroutine_threadsafe(
+                    bot.export_user_state(lambda user_id: ring.node_for(user_id) != worker_id, remove=False), bot.loop
+                ).result()
+                results.put(("exported", worker_id, (epoch, state)))
+            elif kind == "release":
+                ring = ConsistentHashRing(payload, replicas=Config.SHARD_VIRTUAL_NODES)
+                asyncio.run_coroutine_threadsafe(
+                    bot.export_user_state(lambda user_id: ring.node_for(user_id) != worker_id), bot.loop
+                ).result()
+            elif kind == "import":
+                asyncio.run_coroutine_threadsafe(bot.import_user_state(payload), bot.loop).result()
+        except Exception as e:
+            logger.error("Worker %s failed to handle %s: %s", worker_id, kind, e)
+            if kind == "export":
+                results.put(("exported", worker_id, (payload[0], {})))
+
+    concurrent.futures.wait(pending.copy(), timeout=30)
+    logger.info("Worker %s stopped", worker_id)
+
+
+class ShardedWebhookServer:
+    """Front listener that routes webhook updates to user-sharded worker processes."""
+
+    def __init__(self, token: str, webhook_url: str, workers: int = None):
+        """
+        Initialize the front listener.
+
+        Args:
+            token: Telegram bot token
+            webhook_url: Public base URL (the webhook is registered at /webhook)
+            workers: Worker processes to start; defaults to Config.WEBHOOK_WORKERS
+        """
+        self.token = token
+        self.webhook_url = webhook_url
+        self.initial_workers = workers or Config.WEBHOOK_WORKERS
+        self.logger = logging.getLogger(__name__)
+
+        # Spawned workers do not inherit the front's threads (log listener, Flask)
+        self._context = multiprocessing.get_context("spawn")
+        self.results = self._context.Queue()
+        self.processes: Dict[int, multiprocessing.Process] = {}
+        self.inboxes: Dict[int, multiprocessing.Queue] = {}
+        self.routed: Dict[int, int] = {}
+        self.ring = ConsistentHashRing(replicas=Config.SHARD_VIRTUAL_NODES)
+        # Redelivered updates are dropped here, before they are routed
+        self.deduplicator = UpdateDeduplicator()
+
+        # Held while routing, and for the whole of a rebalance so no update overtakes its user's state
+        self._routing_lock = threading.Lock()
+        # One scale_to() at a time, so concurrent calls never start the same worker IDs
+        self._scale_lock = threading.Lock()
+        # Numbers export rounds, so a late export of an aborted rebalance is never taken for a current one
+        self._epoch = 0
+
+        self.flask_app = Flask(__name__)
+        self._setup_routes()
+
+    def _setup_routes(self):
+        """Set up Flask routes for the front listener."""
+
+        @self.flask_app.route('/', methods=['GET'])
+        def health_check():
+            """Health check endpoint, including worker liveness."""
+            workers = {
+                str(worker_id): {"alive": process.is_alive(), "routed": self.routed.get(worker_id, 0)}
+                for worker_id, process in self.processes.items()
+            }
+            healthy = all(worker["alive"] for worker in workers.values())
+            return {"status": "ok" if healthy else "degraded", "bot": "running", "workers": workers}, 200
+
+        @self.flask_app.route('/webhook', methods=['POST'])
+        def webhook():
+            """Route an incoming update to the worker owning its user."""
+            if not webhook_ingest.secret_token_valid(request.headers):
+                return Response(status=403)
+            body = request.get_data()
+            recorder.record_raw(body)
+            update = webhook_ingest.parse_update(body)
+            if update is None:
+                return Response(status=400)
+
+            # Updates no handler would respond to, and redelivered ones, never reach a worker
+            if not webhook_ingest.is_handled(update):
+                return Response(status=200)
+            update_id = update.get("update_id")
+            if update_id is not None and not self.deduplicator.claim(update_id):
+                self.logger.info("Dropped duplicate update %s", update_id)
+                return Response(status=200)
+
+            try:
+                self.route(shard_key(update), body)
+            except Exception:
+                # Not routed, so Telegram's redelivery must not be dropped
+                if update_id is not None:
+                    self.deduplicator.release(update_id)
+                raise
+            return Response(status=200)
+
+        @self.flask_app.route('/workers', methods=['POST'])
+        def scale_workers():
+            """Change the number of workers; requires the admin API token."""
+            if not webhook_ingest.admin_token_valid(request.headers):
+                return Response(status=403)
+            try:
+                count = int((request.get_json(silent=True) or {})["workers"])
+            except (KeyError, TypeError, ValueError):
+                return {"status": "error", "message": "expected {\"workers\": <count>}"}, 400
+            try:
+                moved = self.scale_to(count)
+            except RuntimeError as e:
+                return {"status": "error", "message": str(e), "workers": len(self.processes)}, 503
+            return {"status": "ok", "workers": len(self.processes), "moved_users": moved}, 200
+
+    def route(self, key: int, body: bytes):
+        """
+        Send a raw update to the worker owning a key.
+
+        Args:
+            key: Shard key from shard_key()
+            body: Raw webhook JSON
+        """
+        with self._routing_lock:
+            worker_id = self.ring.node_for(key)
+            self.inboxes[worker_id].put(("update", body))
+            self.routed[worker_id] = self.routed.get(worker_id, 0) + 1
+
+    def _start_worker(self, worker_id: int):
+        """Spawn a worker process and wait until its bot is initialized."""
+        inbox = self._context.Queue()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(worker_id, self.token, self.webhook_url, inbox, self.results),
+            name=f"webhook-worker-{worker_id}",
+            daemon=True
+        )
+        process.start()
+        self.inboxes[worker_id] = inbox
+        self.processes[worker_id] = process
+
+    def _wait_for(self, kind: str, worker_ids: List[int], epoch: Optional[int] = None) -> List[Tuple[int, Any]]:
+        """
+        Collect one result of a kind from each of the given workers.
+
+        Args:
+            kind: Result kind ("ready" or "exported")
+            worker_ids: Workers expected to answer
+            epoch: Export round the results must belong to ("exported" payloads are (epoch, state))
+
+        Returns:
+            (worker ID, payload) pairs, without the epoch
+
+        Raises:
+            RuntimeError: If a worker exits or SHARD_REBALANCE_TIMEOUT passes before all have answered
+        """
+        collected = []
+        waiting = set(worker_ids)
+        deadline = time.monotonic() + Config.SHARD_REBALANCE_TIMEOUT
+        while waiting:
+            try:
+                # Short waits, so a worker that died is noticed before the deadline
+                result_kind, worker_id, payload = self.results.get(timeout=max(0.0, min(1.0, deadline - time.monotonic())))
+            except queue.Empty:
+                dead = sorted(worker_id for worker_id in waiting if not self.processes[worker_id].is_alive())
+                if dead:
+                    raise RuntimeError(f"Webhook worker(s) {dead} exited before reporting {kind}")
+                if time.monotonic() >= deadline:
+                    raise RuntimeError(f"Webhook worker(s) {sorted(waiting)} did not report {kind} "
+                                       f"within {Config.SHARD_REBALANCE_TIMEOUT:g}s")
+                continue
+            # Late results of an earlier, failed scale_to() are ignored
+            if result_kind == "exported":
+                result_epoch, payload = payload
+                if result_epoch != epoch:
+                    continue
+            if result_kind == kind and worker_id in waiting:
+                waiting.discard(worker_id)
+                collected.append((worker_id, payload))
+        return collected
+
+    def scale_to(self, count: int) -> int:
+        """
+        Grow or shrink the worker pool, moving per-user state to its new owners.
+
+        Routing is paused while old owners export the users they lose and the new
+        owners receive that state, so each user's next update sees its history.
+        Old owners only drop the exported state once the new ring is in place, so
+        an aborted rebalance loses nothing.
+
+        Args:
+            count: Target number of workers (at least 1)
+
+        Returns:
+            Number of users whose state moved
+
+        Raises:
+            RuntimeError: If new workers do not come up or old ones do not export in time;
+                the pool and routing are then left as they were
+        """
+        with self._scale_lock:
+            return self._scale_to(max(1, count))
+
+    def _scale_to(self, count: int) -> int:
+        """scale_to() with the scale lock held."""
+        current = sorted(self.processes)
+        if count == len(current):
+            return 0
+
+        added = [worker_id for worker_id in range(count) if worker_id not in self.processes]
+        removed = [worker_id for worker_id in current if worker_id >= count]
+        target_nodes = list(range(count))
+
+        for worker_id in added:
+            self._start_worker(worker_id)
+        try:
+            self._wait_for("ready", added)
+        except RuntimeError:
+            self._abort_scale(added)
+            raise
+
+        moved = 0
+        with self._routing_lock:
+            if current:
+                self._epoch += 1
+                for worker_id in current:
+                    self.inboxes[worker_id].put(("export", (self._epoch, target_nodes)))
+                try:
+                    exports = self._wait_for("exported", current, self._epoch)
+                except RuntimeError:
+                    # Exports are copies and the ring is unchanged, so every user stays with its old owner
+                    self._abort_scale(added)
+                    raise
+
+                target_ring = ConsistentHashRing(target_nodes, replicas=self.ring.replicas)
+                for _, state in exports:
+                    for owner, part in _split_state(state, target_ring).items():
+                        moved += len(set().union(*part.values()))
+                        self.inboxes[owner].put(("import", part))
+
+            for worker_id in added:
+                self.ring.add(worker_id)
+            for worker_id in removed:
+                self.ring.remove(worker_id)
+            for worker_id in current:
+                if worker_id not in removed:
+                    self.inboxes[worker_id].put(("release", target_nodes))
+
+        for worker_id in removed:
+            self._stop_worker(worker_id)
+
+        self.logger.info("Scaled to %d webhook workers (%d users moved)", count, moved)
+        return moved
+
+    def _abort_scale(self, added: List[int]):
+        """Stop workers started by a failed scale_to(), which never joined the ring."""
+        self.logger.error("Scaling failed; stopping new webhook workers %s", added)
+        for worker_id in added:
+            self._stop_worker(worker_id)
+
+    def _stop_worker(self, worker_id: int):
+        """Stop a worker after it drains its inbox."""
+        self.inboxes.pop(worker_id).put(None)
+        process = self.processes.pop(worker_id)
+        process.join(timeout=Config.SHARD_REBALANCE_TIMEOUT)
+        if process.is_alive():
+            process.terminate()
+        self.routed.pop(worker_id, None)
+
+    async def _set_webhook(self):
+        """Register the webhook once, from the front process."""
+        from telegram import Bot
+
+        kwargs = {"base_url": Config.TELEGRAM_API_BASE_URL} if Config.TELEGRAM_API_BASE_URL else {}
+        async with Bot(self.token, **kwargs) as bot:
+            await bot.set_webhook(f"{self.webhook_url}/webhook", **webhook_ingest.webhook_options())
+
+    def shutdown(self):
+        """Stop all workers."""
+        for worker_id in sorted(self.processes):
+            self._stop_worker(worker_id)
+        self.deduplicator.stop()
+
+    def run_webhook(self, host='0.0.0.0', port=5000):
+        """Start the workers, register the webhook and run the front listener."""
+        self.logger.info("Starting %d webhook workers", self.initial_workers)
+        self.scale_to(self.initial_workers)
+        asyncio.run(self._set_webhook())
+        self.logger.info("Starting sharded webhook server on %s:%s", host, port)
+        self.deduplicator.start()
+        try:
+            self.flask_app.run(host=host, port=port, debug=False, threaded=True)
+        finally:
+            self.shutdown()
+
+
+def _split_state(state: Dict[str, Dict[int, Any]], ring: ConsistentHashRing) -> Dict[int, Dict[str, Dict[int, Any]]]:
+    """Group an exported state by the worker each user now hashes to."""
+    parts: Dict[int, Dict[str, Dict[int, Any]]] = {}
+    for section, entries in state.items():
+        for user_id, value in entries.items():
+            part = parts.setdefault(ring.node_for(user_id), {})
+            part.setdefault(section, {})[user_id] = value
+    return parts
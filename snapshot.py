@@ -0,0 +1,256 @@
+"""
+Snapshots of in-memory bot state for warm restarts.
+Conversations, preferences, rate-limit windows and model latency statistics are
+written to a compact binary file on shutdown and at intervals. On startup the
+file is memory-mapped and only its small state section is decoded; each
+conversation stays in the mapping until its user is next seen, so the bot
+serves at once however many conversations the snapshot holds.
+
+File layout (little-endian):
+    header   magic, version, creation time, conversation count, section offsets
+    blobs    one zlib-compressed conversation per user (the store's idle format)
+    index    sorted user IDs (int64), blob offsets (uint64), blob lengths (uint32)
+    state    zlib-compressed JSON of the remaining sections
+"""
+
+import array
+import asyncio
+import bisect
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from config import Config
+from conversation_store import ConversationStore, compress_messages, format_bytes
+
+_MAGIC = b"TGBSNAP1"
+_VERSION = 1
+
+# magic, version, created (Unix time), conversations, index offset, state offset, state length
+_HEADER = struct.Struct("<8sIdQQQQ")
+
+
+class SnapshotReader:
+    """Memory-mapped snapshot whose conversations are each handed out once."""
+
+    def __init__(self, path: str):
+        """
+        Map a snapshot file and read its header.
+
+        Args:
+            path: Snapshot file
+
+        Raises:
+            OSError: If the file cannot be read
+            ValueError: If it is not a snapshot of this version
+        """
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+        if len(view) < _HEADER.size:
+            raise ValueError("truncated snapshot")
+        magic, version, self.created, count, index_offset, state_offset, state_length = _HEADER.unpack_from(view)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError(f"not a version {_VERSION} snapshot")
+        if state_offset + state_length > len(view):
+            raise ValueError("truncated snapshot")
+
+        # Views into the mapping; nothing is copied until a conversation is taken
+        offsets_start = index_offset + 8 * count
+        lengths_start = offsets_start + 8 * count
+        self._ids = view[index_offset:offsets_start].cast("q")
+        self._offsets = view[offsets_start:lengths_start].cast("Q")
+        self._lengths = view[lengths_start:lengths_start + 4 * count].cast("I")
+        self._view = view
+        self._state = view[state_offset:state_offset + state_length]
+        self._taken = bytearray(count)
+        self._remaining = count
+
+    def __len__(self) -> int:
+        """Conversations not yet taken."""
+        return self._remaining
+
+    def __contains__(self, user_id) -> bool:
+        return self._find(user_id) is not None
+
+    def take(self, user_id: int) -> Optional[bytes]:
+        """
+        Remove a user's conversation from the snapshot.
+
+        Returns:
+            The compressed conversation, or None if the snapshot holds none (or it was taken)
+        """
+        index = self._find(user_id)
+        if index is None:
+            return None
+        self._taken[index] = 1
+        self._remaining -= 1
+        offset = self._offsets[index]
+        return bytes(self._view[offset:offset + self._lengths[index]])
+
+    def pending_ids(self) -> Iterator[int]:
+        """User IDs whose conversations have not been taken."""
+        return (self._ids[index] for index in range(len(self._taken)) if not self._taken[index])
+
+    def pending(self) -> List[Tuple[int, memoryview]]:
+        """(user ID, compressed conversation) of every conversation not yet taken."""
+        view, offsets, lengths = self._view, self._offsets, self._lengths
+        return [(self._ids[index], view[offsets[index]:offsets[index] + lengths[index]])
+                for index in range(len(self._taken)) if not self._taken[index]]
+
+    def state(self) -> Dict[str, Any]:
+        """The snapshot's non-conversation sections."""
+        return json.loads(zlib.decompress(self._state))
+
+    def _find(self, user_id: int) -> Optional[int]:
+        """Index of an untaken user ID, by binary search over the mapped index."""
+        index = bisect.bisect_left(self._ids, user_id)
+        if index < len(self._taken) and self._ids[index] == user_id and not self._taken[index]:
+            return index
+        return None
+
+
+def write_snapshot(path: str, conversations: List[Tuple[int, Any]], state: Dict[str, Any]) -> int:
+    """
+    Write a snapshot file, atomically replacing any existing one.
+
+    Args:
+        path: Snapshot file
+        conversations: (user ID, compressed conversation or message list) pairs
+        state: JSON-serializable sections restored by the bot
+
+    Returns:
+        Size of the file in bytes
+    """
+    conversations = sorted(conversations, key=lambda item: item[0])
+    ids = array.array("q")
+    offsets = array.array("Q")
+    lengths = array.array("I")
+
+    temp_file = f"{path}.tmp"
+    with open(temp_file, "wb") as f:
+        f.write(bytes(_HEADER.size))
+        offset = _HEADER.size
+        for user_id, conversation in conversations:
+            blob = conversation if isinstance(conversation, (bytes, memoryview)) else compress_messages(conversation)
+            f.write(blob)
+            ids.append(user_id)
+            offsets.append(offset)
+            lengths.append(len(blob))
+            offset += len(blob)
+
+        # Keep the int64 index aligned
+        padding = -offset % 8
+        f.write(bytes(padding))
+        index_offset = offset + padding
+        for column in (ids, offsets, lengths):
+            f.write(column.tobytes())
+
+        state_blob = zlib.compress(json.dumps(state, separators=(",", ":")).encode("utf-8"))
+        state_offset = index_offset + 20 * len(ids)
+        f.write(state_blob)
+
+        f.seek(0)
+        f.write(_HEADER.pack(_MAGIC, _VERSION, time.time(), len(ids), index_offset, state_offset, len(state_blob)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_file, path)
+    return state_offset + len(state_blob)
+
+
+class StateSnapshots:
+    """Saves bot state to SNAPSHOT_FILE and restores it on startup."""
+
+    def __init__(self, path: str = None, interval: float = None):
+        """
+        Initialize snapshots.
+
+        Args:
+            path: Snapshot file, "" to disable (default Config.SNAPSHOT_FILE)
+            interval: Seconds between periodic snapshots, 0 for shutdown only (default Config.SNAPSHOT_INTERVAL)
+        """
+        self.path = path if path is not None else Config.SNAPSHOT_FILE
+        self.interval = interval if interval is not None else Config.SNAPSHOT_INTERVAL
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.path)
+
+    def restore(self, conversations: ConversationStore) -> Dict[str, Any]:
+        """
+        Attach a saved snapshot's conversations to the store, to be loaded lazily.
+
+        Args:
+            conversations: The bot's (empty) conversation store
+
+        Returns:
+            The snapshot's other sections, or {} if there is no usable snapshot
+        """
+        if not self.enabled:
+            return {}
+        try:
+            reader = SnapshotReader(self.path)
+            state = reader.state()
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            self.logger.warning("Ignoring unreadable snapshot %s: %s", self.path, e)
+            return {}
+
+        if len(reader):
+            conversations.attach_snapshot(reader)
+        self.logger.info("Restored snapshot %s from %.0f s ago (%d conversations)",
+                         self.path, time.time() - reader.created, len(reader))
+        return state
+
+    def save(self, conversations: ConversationStore, state: Dict[str, Any]):
+        """
+        Capture and write a snapshot; the caller must not run concurrently with handlers.
+
+        Args:
+            conversations: The bot's conversation store
+            state: JSON-serializable sections to restore
+        """
+        if self.enabled:
+            self.write(conversations.snapshot_items(), state)
+
+    async def run(self, conversations: ConversationStore, export_state: Callable[[], Dict[str, Any]]):
+        """
+        Save a snapshot every `interval` seconds until cancelled.
+
+        State is captured on the event loop and compressed and written on a worker
+        thread, so handlers only pause for the capture.
+
+        Args:
+            conversations: The bot's conversation store
+            export_state: Returns the JSON-serializable sections to restore
+        """
+        if not self.enabled or self.interval <= 0:
+            return
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.interval)
+            items, state = conversations.snapshot_items(), export_state()
+            try:
+                await loop.run_in_executor(None, self.write, items, state)
+            except Exception as e:
+                self.logger.error("Failed to save snapshot %s: %s", self.path, e)
+
+    def write(self, items: List[Tuple[int, Any]], state: Dict[str, Any]):
+        """
+        Write captured state; safe to call from any thread.
+
+        Args:
+            items: Conversations from ConversationStore.snapshot_items()
+            state: JSON-serializable sections to restore
+        """
+        started = time.monotonic()
+        size = write_snapshot(self.path, items, state)
+        self.logger.info("Saved snapshot %s: %d conversations, %s in %.0f ms",
+                         self.path, len(items), format_bytes(size), (time.monotonic() - started) * 1000)
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Startup-time benchmark for cold starts.
+Measures fresh-interpreter import time of the bot entry modules with
+`python -X importtime`, prints the slowest imports, and compares totals with the
+baselines stored alongside the microbenchmarks.
+
+Examples:
+    python startup_bench.py               # compare with microbench_baseline.json
+    python startup_bench.py --save        # record new baselines
+    python startup_bench.py --top 25      # show a longer import breakdown
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+from microbench import BASELINE_FILE, load_baseline, save_baseline
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Modules whose import cost is paid before the bot can serve its first update
+MODULES = ["bot", "webhook_server", "gemini_service", "together_service"]
+
+# Paid on the first request (or by the background pre-warm)
+PREWARM_SERVICES = {"gemini_service": "GeminiService", "together_service": "TogetherService"}
+
+
+def _run_python(args: List[str]) -> subprocess.CompletedProcess:
+    """Run a fresh interpreter in the repository with fake API keys."""
+    env = dict(os.environ, GEMINI_API_KEY="fake-gemini-key", TOGETHER_API_KEY="fake-together-key")
+    return subprocess.run([sys.executable, *args], cwd=REPO_DIR, env=env,
+                          capture_output=True, text=True, check=True)
+
+
+def import_times(code: str) -> List[Tuple[str, int, int, int]]:
+    """
+    Run code under -X importtime.
+
+    Returns:
+        (module, self_us, cumulative_us, depth) for each imported module
+    """
+    result = _run_python(["-X", "importtime", "-c", code])
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line.split(":", 1)[1].split("|")
+        # Nesting is shown by two spaces per level after the separator's single space
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        entries.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return entries
+
+
+def module_import_us(module: str, repeat: int) -> float:
+    """Minimum cumulative import time (us) of a module over several fresh interpreters."""
+    totals = []
+    for _ in range(repeat):
+        entries = import_times(f"import {module}")
+        totals.append(next(cumulative for name, _, cumulative, depth in entries if name == module and depth == 0))
+    return min(totals)
+
+
+def prewarm_ns(module: str, class_name: str, repeat: int) -> float:
+    """Minimum wall time (ns) to import a service's SDK and build its client in a fresh process."""
+    code = (
+        f"import time; from {module} import {class_name}; service = {class_name}(); "
+        "started = time.perf_counter_ns(); service.prewarm(); print(time.perf_counter_ns() - started)"
+    )
+    return min(float(_run_python(["-c", code]).stdout.strip()) for _ in range(repeat))
+
+
+def print_breakdown(module: str, top: int):
+    """Print the slowest imports pulled in by a module."""
+    entries = import_times(f"import {module}")
+    print(f"\nSlowest imports for `import {module}` (cumulative ms, self ms):")
+    for name, self_us, cumulative_us, depth in sorted(entries, key=lambda e: e[2], reverse=True)[:top]:
+        print(f"  {cumulative_us / 1000:>8.1f} {self_us / 1000:>8.1f}  {'  ' * depth}{name}")
+
+
+def main() -> int:
+    """Run the startup benchmark and compare with the baseline; returns the exit code."""
+    parser = argparse.ArgumentParser(description="Cold-start import time benchmark")
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh interpreters per measurement")
+    parser.add_argument("--top", type=int, default=12, help="Imports to show in the breakdown")
+    parser.add_argument("--module", action="append", help="Show the breakdown for this module (repeatable)")
+    parser.add_argument("--baseline", default=BASELINE_FILE, help="Baseline JSON file")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="Fail when a total exceeds baseline by this factor")
+    parser.add_argument("--save", action="store_true", help="Store results as the new baseline")
+    args = parser.parse_args()
+
+    baseline = load_baseline(args.baseline)
+    results: Dict[str, Dict[str, float]] = {}
+    regressions = []
+
+    measurements = {
+        f"startup.import[{module}]": lambda module=module: module_import_us(module, args.repeat) * 1000
+        for module in MODULES
+    }
+    measurements.update({
+        f"startup.{module}.prewarm": lambda module=module, cls=cls: prewarm_ns(module, cls, args.repeat)
+        for module, cls in PREWARM_SERVICES.items()
+    })
+
+    print(f"{'benchmark':<40} {'ms':>10} {'baseline':>10} {'ratio':>7}")
+    print("-" * 70)
+    for name, run in measurements.items():
+        ns = run()
+        results[name] = {"ns_per_op": ns, "median_ns": ns, "iterations": args.repeat}
+
+        base = baseline.get(name)
+        ratio = ns / base if base else None
+        flag = ""
+        if ratio is not None and ratio > args.threshold:
+            flag = "  ❌ REGRESSION"
+            regressions.append(name)
+        print(f"{name:<40} {ns / 1e6:>10.1f} {(f'{base / 1e6:.1f}' if base else '-'):>10} "
+              f"{(f'{ratio:.2f}' if ratio else '-'):>7}{flag}")
+
+    for module in args.module or MODULES[:2]:
+        print_breakdown(module, args.top)
+
+    if args.save:
+        save_baseline(args.baseline, results)
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+
+    if regressions:
+        print(f"\n{len(regressions)} startup measurement(s) slower than {args.threshold}x baseline")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,10 +3,18 @@ Together AI service for generating intelligent responses using various AI models
 Handles communication with Together AI API.
 """
 
+import asyncio
+import concurrent.futures
 import logging
 import os
+import time
 from typing import List, Dict, Optional
-from together import Together
+
+from config import Config
+from health import ProviderHealth
+from key_pool import ApiKey, KeyPool, parse_keys
+from model_router import model_stats
+from tracing import tracer
 
 class TogetherService:
     """Service class for interacting with Together AI API."""
@@ -15,12 +23,17 @@ class TogetherService:
         """Initialize the Together AI service with API client."""
         self.logger = logging.getLogger(__name__)
         
-        # Initialize Together client
-        api_key = os.getenv("TOGETHER_API_KEY")
-        if not api_key:
+        # API keys: a pool from TOGETHER_API_KEYS ("key1,key2:weight") or the single TOGETHER_API_KEY;
+        # each key's client is created on first use
+        keys = parse_keys(os.getenv("TOGETHER_API_KEYS") or os.getenv("TOGETHER_API_KEY") or "")
+        if not keys:
             raise ValueError("TOGETHER_API_KEY environment variable is required")
+        self.keys = KeyPool("together", keys, self._create_client, rpm=Config.TOGETHER_KEY_RPM, tpm=Config.TOGETHER_KEY_TPM,
+                            async_client_factory=self._create_async_client)
         
-        self.client = Together(api_key=api_key)
+        # Threads for importing the SDK and building clients (the API call itself is awaited on
+        # the loop, so cancelling aborts it)
+        self._executor = concurrent.futures.ThreadPoolExecutor(Config.PROVIDER_CONCURRENCY, thread_name_prefix="together-call")
         
         # Available models - you can change these based on your needs
         self.available_models = {
@@ -41,6 +54,43 @@ class TogetherService:
             "If you're unsure about something, acknowledge it honestly. "
             "Avoid generating harmful, inappropriate, or misleading content."
         )
+        
+        # Health from real traffic, with cheap model listings as a fallback probe
+        self.health = ProviderHealth("together", self._probe)
+    
+    @staticmethod
+    def _create_client(api_key: str):
+        """Construct a client for one API key."""
+        # The together SDK is slow to import, so it is only loaded when needed
+        from together import Together
+        return Together(api_key=api_key, base_url=Config.TOGETHER_BASE_URL or None)
+    
+    @staticmethod
+    def _create_async_client(api_key: str):
+        """Construct the asyncio client used for generation for one API key."""
+        from together import AsyncTogether
+        return AsyncTogether(api_key=api_key, base_url=Config.TOGETHER_BASE_URL or None)
+    
+    @property
+    def client(self):
+        """Together API client of the first key (for probes), constructed on first access."""
+        return self.keys.client(self.keys.keys[0])
+    
+    def prewarm(self):
+        """
+        Import the SDK and construct every key's clients ahead of the first request.
+        
+        With PROVIDER_PREWARM_CONNECT each client also lists the models, which opens
+        its connection so the first generation skips the TLS handshake.
+        """
+        for key in self.keys.keys:
+            client = self.keys.client(key)
+            self.keys.async_client(key)
+            if Config.PROVIDER_PREWARM_CONNECT:
+                try:
+                    client.models.list()
+                except Exception as e:
+                    self.logger.warning("Failed to open a connection for %s: %s", key.label, e)
     
     def _format_conversation_for_together(self, conversation_history: List[Dict[str, str]]) -> List[Dict[str, str]]:
         """
@@ -61,6 +111,36 @@ class TogetherService:
         
         return messages
     
+    def _build_messages(self, message: str, conversation_history: List[Dict[str, str]] = None) -> List[Dict[str, str]]:
+        """
+        Build the chat completions message list for a request.
+        
+        Args:
+            message: The user's message
+            conversation_history: List of previous messages
+        
+        Returns:
+            System instruction, history and current message for Together AI
+        """
+        messages = self._format_conversation_for_together(conversation_history or [])
+        
+        # Add current message
+        messages.append({"role": "user", "content": message})
+        return messages
+    
+    async def _create_completion(self, key: ApiKey, **kwargs):
+        """
+        Call chat.completions.create through a key's asyncio client.
+        
+        Cancelling the awaiting task aborts the HTTP request, so a superseded request
+        stops spending tokens and its provider slot is free once this returns.
+        """
+        # Building the client imports the SDK on first use, so a new key's client is built on a worker thread
+        client = key.async_client or await asyncio.get_running_loop().run_in_executor(
+            self._executor, self.keys.async_client, key
+        )
+        return await client.chat.completions.create(**kwargs)
+    
     async def generate_response(self, message: str, conversation_history: List[Dict[str, str]] = None, model_name: str = None) -> str:
         """
         Generate a response using Together AI.
@@ -73,29 +153,58 @@ class TogetherService:
         Returns:
             Generated response text
         """
+        # Select model
+        if model_name and model_name in self.available_models:
+            model = self.available_models[model_name]
+        else:
+            model = self.default_model
+        
+        with tracer.span("together.generate_response", model=model) as span:
+            response_text = await self._generate_response(message, conversation_history, model)
+            if span:
+                span.set_attribute("response_length", len(response_text))
+            return response_text
+    
+    async def _generate_response(self, message: str, conversation_history: List[Dict[str, str]], model: str) -> str:
+        """Build the prompt and call the Together AI API inside the current trace."""
         try:
-            # Select model
-            if model_name and model_name in self.available_models:
-                model = self.available_models[model_name]
-            else:
-                model = self.default_model
-            
             # Prepare conversation history
-            messages = self._format_conversation_for_together(conversation_history or [])
-            
-            # Add current message
-            messages.append({"role": "user", "content": message})
+            with tracer.span("together.build_prompt") as span:
+                messages = self._build_messages(message, conversation_history)
+                if span:
+                    span.set_attribute("messages", len(messages))
             
-            self.logger.info(f"Generating response with {model} for message: {message[:50]}...")
+            self.logger.info("Generating response with %s for message of %d chars", model, len(message))
             
-            # Generate response using Together AI
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=messages,
-                max_tokens=1000,
-                temperature=0.7,
-                top_p=0.8,
-            )
+            # Generate response using Together AI, moving to another API key if this one is rate limited or rejected
+            started = time.monotonic()
+            with tracer.span("together.chat_completions") as span:
+                for attempt in range(self.keys.max_attempts):
+                    key = self.keys.acquire()
+                    try:
+                        response = await self._create_completion(
+                            key,
+                            model=model,
+                            messages=messages,
+                            max_tokens=1000,
+                            temperature=0.7,
+                            top_p=0.8,
+                        )
+                        break
+                    except Exception as e:
+                        if self.keys.record_failure(key, e) and attempt + 1 < self.keys.max_attempts:
+                            self.logger.warning("Together key %s failed, trying another: %s", key.label, e)
+                            continue
+                        self.health.record_failure(e)
+                        model_stats.record(model, time.monotonic() - started, ok=False)
+                        raise
+                usage = getattr(response, "usage", None)
+                self.keys.record_success(key, (usage and usage.total_tokens) or 0)
+                if span:
+                    span.set_attribute("api_key", key.label)
+            latency = time.monotonic() - started
+            self.health.record_success(latency)
+            model_stats.record(model, latency, ok=True)
             
             if response and response.choices and len(response.choices) > 0:
                 response_text = response.choices[0].message.content.strip()
@@ -106,7 +215,7 @@ class TogetherService:
                 return "I'm sorry, I couldn't generate a response right now. Please try again."
                 
         except Exception as e:
-            self.logger.error(f"Error generating response with Together AI: {str(e)}")
+            self.logger.error("Error generating response with Together AI: %s", e)
             
             # Provide specific error messages based on the type of error
             error_message = "I'm experiencing technical difficulties with Together AI. Please try again in a moment."
@@ -124,26 +233,17 @@ class TogetherService:
         """Get list of available models."""
         return self.available_models.copy()
     
+    def _probe(self):
+        """List models; free of generation quota and raises on failure."""
+        self.client.models.list()
+    
     def is_healthy(self) -> bool:
         """
-        Check if the Together AI service is healthy by making a simple test request.
+        Check if the Together AI service is healthy using cached health data.
+        
+        Never makes a request; the background prober and real traffic keep it current.
         
         Returns:
-            True if service is healthy, False otherwise
+            True if service is known to be healthy, False otherwise
         """
-        try:
-            messages = [
-                {"role": "system", "content": self.system_instruction},
-                {"role": "user", "content": "Hello"}
-            ]
-            
-            response = self.client.chat.completions.create(
-                model=self.default_model,
-                messages=messages,
-                max_tokens=50
-            )
-            
-            return bool(response and response.choices)
-        except Exception as e:
-            self.logger.error(f"Together AI health check failed: {str(e)}")
-            return False
\ No newline at end of file
+        return self.health.is_healthy()
@@ -0,0 +1,272 @@
+"""
+Lightweight per-update tracing with an OpenTelemetry-compatible exporter.
+Spans are recorded in-process and exported as OTLP/JSON in background batches.
+"""
+
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+from config import Config
+
+# Span currently active in this task (None when the trace is not sampled)
+_current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class Span:
+    """A single timed operation within a trace."""
+
+    __slots__ = (
+        "name", "trace_id", "span_id", "parent_id",
+        "start_ns", "end_ns", "attributes", "status_error", "status_message"
+    )
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None,
+                 attributes: Optional[Dict[str, Any]] = None):
+        """Start a new span."""
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = "%016x" % random.getrandbits(64)
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes: Dict[str, Any] = dict(attributes) if attributes else {}
+        self.status_error = False
+        self.status_message = ""
+
+    def set_attribute(self, key: str, value: Any):
+        """Attach an attribute to the span."""
+        self.attributes[key] = value
+
+    def record_error(self, error: BaseException):
+        """Mark the span as failed."""
+        self.status_error = True
+        self.status_message = f"{type(error).__name__}: {error}"
+
+    def to_otlp(self) -> Dict[str, Any]:
+        """Convert the span to its OTLP/JSON representation."""
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_otlp_attribute(k, v) for k, v in self.attributes.items()],
+            "status": {"code": 2, "message": self.status_message} if self.status_error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    """Encode a single attribute as an OTLP AnyValue."""
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+class BatchSpanExporter:
+    """Buffers finished spans and exports them from a background thread."""
+
+    def __init__(self, file_path: Optional[str] = None, endpoint: Optional[str] = None,
+                 batch_size: int = 256, flush_interval: float = 5.0, max_queue_size: int = 8192):
+        """
+        Initialize the exporter.
+
+        Args:
+            file_path: File to append OTLP/JSON export requests to (one per line)
+            endpoint: OTLP/HTTP JSON endpoint, e.g. http://localhost:4318/v1/traces
+            batch_size: Maximum spans per export request
+            flush_interval: Seconds between exports when the batch is not full
+            max_queue_size: Spans buffered before new ones are dropped
+        """
+        self.logger = logging.getLogger(__name__)
+        self.file_path = file_path
+        self.endpoint = endpoint
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue: "queue.Queue[Optional[Span]]" = queue.Queue(maxsize=max_queue_size)
+        self.dropped_spans = 0
+        self.exported_spans = 0
+
+        self._thread = threading.Thread(target=self._worker, name="span-exporter", daemon=True)
+        self._thread.start()
+
+    def export(self, span: Span):
+        """Queue a finished span without ever blocking the caller."""
+        try:
+            self.queue.put_nowait(span)
+        except queue.Full:
+            self.dropped_spans += 1
+
+    def shutdown(self, timeout: float = 5.0):
+        """Flush remaining spans and stop the worker thread."""
+        if not self._thread.is_alive():
+            return
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def _worker(self):
+        """Collect spans into batches and write them out."""
+        batch: List[Span] = []
+        deadline = time.monotonic() + self.flush_interval
+
+        while True:
+            timeout = max(0.0, deadline - time.monotonic())
+            try:
+                span = self.queue.get(timeout=timeout)
+                if span is None:
+                    self._write(batch)
+                    return
+                batch.append(span)
+            except queue.Empty:
+                pass
+
+            if len(batch) >= self.batch_size or time.monotonic() >= deadline:
+                self._write(batch)
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+
+    def _write(self, batch: List[Span]):
+        """Serialize a batch as an OTLP ExportTraceServiceRequest and send it."""
+        if not batch:
+            return
+
+        payload = json.dumps({
+            "resourceSpans": [{
+                "resource": {"attributes": [
+                    _otlp_attribute("service.name", Config.BOT_USERNAME),
+                    _otlp_attribute("process.pid", os.getpid()),
+                ]},
+                "scopeSpans": [{
+                    "scope": {"name": "astrogemini.tracing"},
+                    "spans": [span.to_otlp() for span in batch],
+                }],
+            }]
+        }, separators=(",", ":"))
+
+        try:
+            if self.endpoint:
+                req = urllib.request.Request(
+                    self.endpoint,
+                    data=payload.encode("utf-8"),
+                    headers={"Content-Type": "application/json"},
+                    method="POST"
+                )
+                urllib.request.urlopen(req, timeout=10).close()
+            if self.file_path:
+                with open(self.file_path, "a", encoding="utf-8") as f:
+                    f.write(payload + "\n")
+            self.exported_spans += len(batch)
+        except Exception as e:
+            self.dropped_spans += len(batch)
+            self.logger.warning("Failed to export %d spans: %s", len(batch), e)
+
+
+class Tracer:
+    """Creates spans for sampled traces and hands them to the exporter."""
+
+    def __init__(self, sample_rate: float = 0.0, exporter: Optional[BatchSpanExporter] = None):
+        """
+        Initialize the tracer.
+
+        Args:
+            sample_rate: Fraction of root traces to record (0.0 - 1.0)
+            exporter: Exporter receiving finished spans
+        """
+        self.sample_rate = sample_rate
+        self.exporter = exporter
+
+    @property
+    def enabled(self) -> bool:
+        """Whether any traces will be recorded."""
+        return self.exporter is not None and self.sample_rate > 0
+
+    @contextmanager
+    def start_trace(self, name: str, **attributes):
+        """
+        Start a new root span, subject to sampling.
+
+        Unsampled traces yield None and cost a single random() call.
+        """
+        if not self.enabled or random.random() >= self.sample_rate:
+            token = _current_span.set(None)
+            try:
+                yield None
+            finally:
+                _current_span.reset(token)
+            return
+
+        span = Span(name, "%032x" % random.getrandbits(128), attributes=attributes)
+        with self._activate(span):
+            yield span
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        """Start a child span of the current span, if the trace is sampled."""
+        parent = _current_span.get()
+        if parent is None:
+            yield None
+            return
+
+        span = Span(name, parent.trace_id, parent.span_id, attributes)
+        with self._activate(span):
+            yield span
+
+    @contextmanager
+    def _activate(self, span: Span):
+        """Make a span current for the duration of the block and export it afterwards."""
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_error(e)
+            raise
+        finally:
+            _current_span.reset(token)
+            span.end_ns = time.time_ns()
+            self.exporter.export(span)
+
+    def shutdown(self):
+        """Flush pending spans."""
+        if self.exporter:
+            self.exporter.shutdown()
+
+
+def _create_tracer() -> Tracer:
+    """Build the process-wide tracer from configuration."""
+    if Config.TRACE_SAMPLE_RATE <= 0 or not (Config.TRACE_EXPORT_FILE or Config.TRACE_EXPORT_URL):
+        return Tracer()
+
+    exporter = BatchSpanExporter(
+        file_path=Config.TRACE_EXPORT_FILE or None,
+        endpoint=Config.TRACE_EXPORT_URL or None,
+        batch_size=Config.TRACE_BATCH_SIZE,
+        flush_interval=Config.TRACE_FLUSH_INTERVAL,
+        max_queue_size=Config.TRACE_MAX_QUEUE_SIZE
+    )
+    tracer = Tracer(min(Config.TRACE_SAMPLE_RATE, 1.0), exporter)
+    atexit.register(tracer.shutdown)
+    return tracer
+
+
+# Process-wide tracer used by the bot and services
+tracer = _create_tracer()
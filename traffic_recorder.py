@@ -0,0 +1,285 @@
+"""
+Recording of incoming update traffic for offline replay.
+Updates (and optionally provider responses) are queued without blocking the
+handlers and written by a background thread to gzip-compressed, rotated JSONL
+segments, with user and chat IDs replaced by keyed hashes and names removed.
+"""
+
+import atexit
+import glob
+import gzip
+import hashlib
+import json
+import logging
+import os
+import queue
+import secrets
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from config import Config
+
+SEGMENT_PATTERN = "updates-*.jsonl.gz"
+
+# Fields of User/Chat objects that identify a person; they are dropped from recordings
+_PERSONAL_FIELDS = ("username", "first_name", "last_name", "title", "phone_number", "bio", "active_usernames")
+# Keys whose values are bare user IDs (e.g. in Contact objects)
+_USER_ID_KEYS = ("user_id",)
+
+
+class Anonymizer:
+    """Replaces user and chat IDs with stable keyed hashes, keeping their sign."""
+
+    def __init__(self, key: str = ""):
+        """
+        Initialize the anonymizer.
+
+        Args:
+            key: Secret hash key; IDs map consistently across recordings made with the same key.
+                A random key is used when empty.
+        """
+        self._key = (key or secrets.token_hex(16)).encode("utf-8")[:64]
+        self._cache: Dict[int, int] = {}
+
+    def id(self, value: int) -> int:
+        """Anonymised ID: positive for users and private chats, negative for groups."""
+        mapped = self._cache.get(value)
+        if mapped is None:
+            digest = hashlib.blake2b(str(abs(value)).encode("ascii"), key=self._key, digest_size=5).digest()
+            mapped = int.from_bytes(digest, "big") + 1
+            mapped = -mapped if value < 0 else mapped
+            if len(self._cache) < 100_000:
+                self._cache[value] = mapped
+        return mapped
+
+    def update(self, payload: Any) -> Any:
+        """Anonymise a decoded update in place and return it."""
+        if isinstance(payload, dict):
+            # User and Chat objects are the dicts carrying an "id" next to identity fields
+            if "id" in payload and isinstance(payload["id"], int) and (
+                    "is_bot" in payload or "type" in payload or "first_name" in payload):
+                payload["id"] = self.id(payload["id"])
+                for field in _PERSONAL_FIELDS:
+                    payload.pop(field, None)
+                if "is_bot" in payload or payload.get("type") == "private":
+                    payload["first_name"] = "User"
+            for key, value in payload.items():
+                if key in _USER_ID_KEYS and isinstance(value, int):
+                    payload[key] = self.id(value)
+                elif isinstance(value, (dict, list)):
+                    self.update(value)
+        elif isinstance(payload, list):
+            for item in payload:
+                self.update(item)
+        return payload
+
+
+class TrafficRecorder:
+    """Queues traffic records and writes them to rotated gzip JSONL segments in a background thread."""
+
+    def __init__(self, directory: Optional[str] = None, segment_max_bytes: int = 64 * 1024 * 1024,
+                 segment_seconds: float = 3600.0, max_segments: int = 48, record_responses: bool = False,
+                 anonymize_key: str = "", max_queue_size: int = 10000, flush_interval: float = 5.0):
+        """
+        Initialize the recorder; a recorder without a directory records nothing.
+
+        Args:
+            directory: Directory for segment files
+            segment_max_bytes: Uncompressed bytes after which a new segment is started (0 = no limit)
+            segment_seconds: Age after which a new segment is started (0 = no limit)
+            max_segments: Segments kept in the directory; the oldest are deleted (0 keeps all)
+            record_responses: Also record provider, model, latency and text of each reply
+            anonymize_key: Secret for ID hashing (random per process when empty)
+            max_queue_size: Records buffered before new ones are dropped
+            flush_interval: Seconds between flushes of the open segment
+        """
+        self.logger = logging.getLogger(__name__)
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.segment_seconds = segment_seconds
+        self.max_segments = max_segments
+        self.record_responses = record_responses and directory is not None
+        self.flush_interval = flush_interval
+        self.anonymizer = Anonymizer(anonymize_key)
+
+        self.recorded = 0
+        self.dropped = 0
+        self.queue: "queue.Queue[Optional[Tuple[str, float, Any]]]" = queue.Queue(maxsize=max_queue_size)
+
+        self._segment = None
+        self._segment_path = ""
+        self._segment_bytes = 0
+        self._segment_started = 0.0
+        self._segment_sequence = 0
+        self._thread: Optional[threading.Thread] = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._thread = threading.Thread(target=self._worker, name="traffic-recorder", daemon=True)
+            self._thread.start()
+
+    @property
+    def enabled(self) -> bool:
+        """Whether updates are being recorded."""
+        return self._thread is not None
+
+    def _enqueue(self, kind: str, payload: Any):
+        """Queue a record without ever blocking the caller."""
+        try:
+            self.queue.put_nowait((kind, time.time(), payload))
+        except queue.Full:
+            self.dropped += 1
+
+    def record_raw(self, body: bytes):
+        """Record an update as received by the webhook (decoded on the writer thread)."""
+        if self._thread is not None:
+            self._enqueue("raw", body)
+
+    def record_update(self, update: Dict[str, Any]):
+        """Record an update already decoded to a dict (polling mode)."""
+        if self._thread is not None:
+            self._enqueue("update", update)
+
+    def record_response(self, update_id: int, user_id: int, provider: str, model: str,
+                        latency: float, response: str):
+        """
+        Record the reply generated for an update, if response recording is enabled.
+
+        Args:
+            update_id: Update that was answered
+            user_id: Telegram user ID (anonymised before writing)
+            provider: "gemini" or "together"
+            model: Model key used
+            latency: Seconds the provider took
+            response: Reply text
+        """
+        if self.record_responses:
+            self._enqueue("response", {
+                "update_id": update_id, "user_id": user_id, "provider": provider, "model": model,
+                "latency_s": round(latency, 4), "response": response,
+            })
+
+    def shutdown(self, timeout: float = 5.0):
+        """Write pending records, close the segment and stop the writer thread."""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        try:
+            self.queue.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def _worker(self):
+        """Anonymise, serialize and write queued records."""
+        next_flush = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self.queue.get(timeout=max(0.0, next_flush - time.monotonic()))
+            except queue.Empty:
+                item = ()
+            if item is None:
+                self._close_segment()
+                return
+
+            if item:
+                try:
+                    self._write(*item)
+                except Exception as e:
+                    self.dropped += 1
+                    self.logger.warning("Failed to record %s: %s", item[0], e)
+
+            if time.monotonic() >= next_flush:
+                next_flush = time.monotonic() + self.flush_interval
+                if self._segment is not None:
+                    self._segment.flush()
+
+    def _write(self, kind: str, timestamp: float, payload: Any):
+        """Append one record to the current segment."""
+        if kind == "response":
+            payload["user_id"] = self.anonymizer.id(payload["user_id"])
+            record = {"t": round(timestamp, 4), "kind": "response", **payload}
+        else:
+            update = json.loads(payload) if kind == "raw" else payload
+            record = {"t": round(timestamp, 4), "kind": "update", "update": self.anonymizer.update(update)}
+
+        line = json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+        if self._segment is None or 0 < self.segment_max_bytes <= self._segment_bytes or \
+                0 < self.segment_seconds <= time.monotonic() - self._segment_started:
+            self._rotate()
+        self._segment.write(line)
+        self._segment_bytes += len(line)
+        self.recorded += 1
+
+    def _rotate(self):
+        """Close the current segment, start a new one and apply retention."""
+        self._close_segment()
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        self._segment_sequence += 1
+        self._segment_path = os.path.join(
+            self.directory, f"updates-{stamp}-{os.getpid()}-{self._segment_sequence:04d}.jsonl.gz"
+        )
+        # Level 5 compresses text nearly as well as 9 at a fraction of the CPU
+        self._segment = gzip.open(self._segment_path, "wb", compresslevel=5)
+        self._segment_bytes = 0
+        self._segment_started = time.monotonic()
+
+        if self.max_segments > 0:
+            segments = sorted(glob.glob(os.path.join(self.directory, SEGMENT_PATTERN)), key=os.path.getmtime)
+            for path in segments[:-self.max_segments]:
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    self.logger.warning("Failed to delete old recording %s: %s", path, e)
+
+    def _close_segment(self):
+        """Finish the current segment so it is a complete gzip file."""
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+
+
+def read_segment(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    Yield the records of one segment.
+
+    A segment cut short by a crash is read up to its last complete record.
+    """
+    try:
+        with gzip.open(path, "rb") as f:
+            for line in f:
+                if line.endswith(b"\n"):
+                    yield json.loads(line)
+    except (EOFError, gzip.BadGzipFile) as e:
+        logging.getLogger(__name__).warning("Recording %s is truncated: %s", path, e)
+
+
+def find_segments(paths: List[str]) -> List[str]:
+    """Expand files and directories into segment paths, oldest first."""
+    segments = []
+    for path in paths:
+        if os.path.isdir(path):
+            segments.extend(glob.glob(os.path.join(path, SEGMENT_PATTERN)))
+        else:
+            segments.append(path)
+    return sorted(segments)
+
+
+def _create_recorder() -> TrafficRecorder:
+    """Build the process-wide recorder from configuration."""
+    if not Config.RECORD_TRAFFIC:
+        return TrafficRecorder()
+
+    recorder = TrafficRecorder(
+        directory=Config.RECORD_DIR,
+        segment_max_bytes=Config.RECORD_SEGMENT_MAX_MB * 1024 * 1024,
+        segment_seconds=Config.RECORD_SEGMENT_SECONDS,
+        max_segments=Config.RECORD_MAX_SEGMENTS,
+        record_responses=Config.RECORD_RESPONSES,
+        anonymize_key=Config.RECORD_ANONYMIZE_KEY
+    )
+    atexit.register(recorder.shutdown)
+    return recorder
+
+
+# Process-wide recorder used by the polling bot, the webhook server and the sharded front
+recorder = _create_recorder()
@@ -0,0 +1,94 @@
+"""
+Fast path for incoming webhook updates.
+Telegram's secret token is checked before the body is read, bodies are decoded
+with orjson when it is installed, and updates the bot has no handler for are
+dropped before a telegram.Update is built. The same update types are registered
+as allowed_updates, so Telegram stops sending the others at all.
+"""
+
+import hmac
+import json
+from typing import Any, Dict, List, Mapping, Optional
+
+from config import Config
+
+try:
+    import orjson
+except ImportError:  # optional: the standard library decoder is used instead
+    orjson = None
+
+# Header carrying the secret_token passed to setWebhook
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+# Header carrying ADMIN_API_TOKEN on admin HTTP routes
+ADMIN_TOKEN_HEADER = "X-Admin-Token"
+
+# Update types with handlers (commands and text messages); everything else is ignored
+ALLOWED_UPDATES: List[str] = ["message"]
+
+# orjson.JSONDecodeError is a ValueError, like json's
+loads = orjson.loads if orjson is not None else json.loads
+
+
+def secret_token_valid(headers: Mapping[str, str]) -> bool:
+    """
+    Whether a webhook request carries the configured secret token.
+
+    Args:
+        headers: Request headers
+
+    Returns:
+        True if it matches, or if no WEBHOOK_SECRET_TOKEN is configured
+    """
+    if not Config.WEBHOOK_SECRET_TOKEN:
+        return True
+    received = headers.get(SECRET_TOKEN_HEADER, "")
+    return hmac.compare_digest(received.encode("utf-8"), Config.WEBHOOK_SECRET_TOKEN.encode("utf-8"))
+
+
+def admin_token_valid(headers: Mapping[str, str]) -> bool:
+    """
+    Whether a request to an admin route carries the configured admin token.
+
+    Args:
+        headers: Request headers
+
+    Returns:
+        True if it matches; always False when no ADMIN_API_TOKEN is configured
+    """
+    if not Config.ADMIN_API_TOKEN:
+        return False
+    received = headers.get(ADMIN_TOKEN_HEADER, "")
+    return hmac.compare_digest(received.encode("utf-8"), Config.ADMIN_API_TOKEN.encode("utf-8"))
+
+
+def parse_update(body: bytes) -> Optional[Dict[str, Any]]:
+    """
+    Decode a webhook body.
+
+    Args:
+        body: Raw request body
+
+    Returns:
+        The update as a dict, or None if it is not a JSON object
+    """
+    try:
+        update = loads(body)
+    except ValueError:
+        return None
+    return update if isinstance(update, dict) else None
+
+
+def is_handled(update: Dict[str, Any]) -> bool:
+    """Whether any handler would respond to a decoded update (a message with text)."""
+    message = update.get("message")
+    return isinstance(message, dict) and "text" in message
+
+
+def webhook_options() -> Dict[str, Any]:
+    """Keyword arguments for Bot.set_webhook() besides the URL."""
+    return {
+        "allowed_updates": ALLOWED_UPDATES,
+        "max_connections": Config.WEBHOOK_MAX_CONNECTIONS,
+        "secret_token": Config.WEBHOOK_SECRET_TOKEN or None,
+    }
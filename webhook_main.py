@@ -7,16 +7,14 @@ Designed for Render.com and other cloud platforms.
 import logging
 import os
 from webhook_server import TelegramWebhookBot
+from sharding import ShardedWebhookServer
+from config import Config
+from logging_setup import setup_logging as configure_logging
 
 def setup_logging():
     """Configure logging for the application."""
-    logging.basicConfig(
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        level=logging.INFO,
-        handlers=[
-            logging.StreamHandler()  # Only console logging for cloud deployment
-        ]
-    )
+    # Only console logging for cloud deployment
+    configure_logging(log_file=None)
 
 def main():
     """Main function to start the webhook bot."""
@@ -25,7 +23,7 @@ def main():
     
     # Check for required environment variables
     telegram_token = os.getenv("TELEGRAM_BOT_TOKEN")
-    gemini_api_key = os.getenv("GEMINI_API_KEY")
+    gemini_api_key = os.getenv("GEMINI_API_KEYS") or os.getenv("GEMINI_API_KEY")
     webhook_url = os.getenv("WEBHOOK_URL")  # Your Render.com app URL
     
     if not telegram_token:
@@ -33,7 +31,7 @@ def main():
         return
     
     if not gemini_api_key:
-        logger.error("GEMINI_API_KEY environment variable is required")
+        logger.error("GEMINI_API_KEY (or GEMINI_API_KEYS) environment variable is required")
         return
     
     if not webhook_url:
@@ -45,11 +43,15 @@ def main():
     port = int(os.getenv("PORT", 5000))
     
     logger.info("Starting Telegram Gemini AI Bot in webhook mode...")
-    logger.info(f"Webhook URL: {webhook_url}")
-    logger.info(f"Port: {port}")
+    logger.info("Webhook URL: %s", webhook_url)
+    logger.info("Port: %s", port)
     
     # Initialize and start the webhook bot
-    bot = TelegramWebhookBot(telegram_token, webhook_url)
+    if Config.WEBHOOK_WORKERS > 1:
+        # Front listener routing updates to user-sharded worker processes
+        bot = ShardedWebhookServer(telegram_token, webhook_url, Config.WEBHOOK_WORKERS)
+    else:
+        bot = TelegramWebhookBot(telegram_token, webhook_url)
     bot.run_webhook(host='0.0.0.0', port=port)
 
 if __name__ == "__main__":
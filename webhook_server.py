@@ -6,7 +6,7 @@ Handles incoming webhook requests from Telegram
 
 import logging
 import os
-from typing import Dict, List
+from typing import Any, Callable, Dict
 from telegram import Update
 from telegram.ext import (
     Application, 
@@ -17,12 +17,31 @@ from telegram.ext import (
 )
 from flask import Flask, request, Response
 import asyncio
+import signal
 import threading
+import time
 
 from gemini_service import GeminiService
 from together_service import TogetherService
 from rate_limiter import RateLimiter
+from health import HealthProber, describe
+from conversation_store import ConversationStore, format_bytes
+from model_router import ModelRouter, model_stats
+from scheduler import FairScheduler
+from inflight import InFlightGenerations
+from debounce import MessageDebouncer
+from dedup import UpdateDeduplicator
+from snapshot import StateSnapshots
+from loop_monitor import LoopLagMonitor
+from profiler import profiler
+from memstats import format_report, memory_inspector
+from faq import FaqIndex, format_entries, looks_like_follow_up
+from load_shedding import BUSY, BUSY_REPLY, CACHE_FIRST, FASTEST_MODEL, LEVELS, NO_TYPING, LoadShedder
 from config import Config
+from tracing import tracer
+from traffic_recorder import recorder
+from logging_setup import MessageText
+import webhook_ingest
 
 class TelegramWebhookBot:
     """Telegram bot with webhook support for Render.com deployment."""
@@ -39,20 +58,63 @@ class TelegramWebhookBot:
             self.together_service = TogetherService()
             self.together_available = True
         except ValueError as e:
-            self.logger.warning(f"Together AI not available: {e}")
+            self.logger.warning("Together AI not available: %s", e)
             self.together_service = None
             self.together_available = False
         
+        # Keep provider health current without paid test generations
+        self.health_prober = HealthProber()
+        self.health_prober.register(self.gemini_service.health)
+        if self.together_available:
+            self.health_prober.register(self.together_service.health)
+        
         self.rate_limiter = RateLimiter()
         
-        # Simple in-memory conversation storage
-        self.conversations: Dict[int, List[Dict[str, str]]] = {}
+        # Compact in-memory conversation storage with a global memory cap
+        self.conversations = ConversationStore()
         self.user_ai_preference: Dict[int, str] = {}
+        self.user_model_preference: Dict[int, str] = {}
+        
+        # Per-request provider/model selection from prompt features and live latency
+        self.model_router = ModelRouter({"gemini": self.gemini_service, "together": self.together_service})
+        self.default_ai = "auto" if Config.MODEL_ROUTING else "gemini"
+        
+        # Provider calls are shared fairly across users, with a priority lane for admins
+        self.scheduler = FairScheduler()
+        # Scheduling delay of the event loop, with the stack of any call that blocks it
+        self.loop_monitor = LoopLagMonitor()
+        self._loop_monitor_task = None
+        # Degrades service step by step when queues, the event loop or providers are overloaded
+        self.shedder = LoadShedder(self.scheduler, self.loop_monitor)
+        self._shedder_task = None
+        
+        # Generations still running per user, superseded by newer messages
+        self.generations = InFlightGenerations()
+        # Bursts of quick messages waiting to be merged into one turn
+        self.debouncer = MessageDebouncer()
+        # Common questions answered from a local index without a provider call (managed with /faq)
+        self.faq = FaqIndex()
+        
+        # Recently processed update IDs, so redelivered updates are not answered twice
+        self.deduplicator = UpdateDeduplicator()
+        
+        # Warm restarts: state comes back from the last snapshot, conversations as their users return
+        self.snapshots = StateSnapshots()
+        self._import_state(self.snapshots.restore(self.conversations))
+        self._snapshot_task = None
+        # Set once provider clients are built and connected; until then the health check reports 503
+        self.providers_ready = threading.Event()
         
         # Initialize the application
-        self.application = Application.builder().token(token).build()
+        builder = Application.builder().token(token)
+        if Config.TELEGRAM_API_BASE_URL:
+            builder = builder.base_url(Config.TELEGRAM_API_BASE_URL)
+        self.application = builder.build()
         self._setup_handlers()
         
+        # Event loop that processes updates, run in a background thread
+        self.loop = None
+        
         # Flask app for webhook
         self.flask_app = Flask(__name__)
         self._setup_webhook_routes()
@@ -65,6 +127,10 @@ class TelegramWebhookBot:
         self.application.add_handler(CommandHandler("status", self.status_command))
         self.application.add_handler(CommandHandler("ai", self.ai_command))
         self.application.add_handler(CommandHandler("models", self.models_command))
+        self.application.add_handler(CommandHandler("thinking", self.thinking_command))
+        self.application.add_handler(CommandHandler("profile", self.profile_command))
+        self.application.add_handler(CommandHandler("memstats", self.memstats_command))
+        self.application.add_handler(CommandHandler("faq", self.faq_command))
         self.application.add_handler(
             MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message)
         )
@@ -74,27 +140,57 @@ class TelegramWebhookBot:
         
         @self.flask_app.route('/', methods=['GET'])
         def health_check():
-            """Health check endpoint for Render.com."""
-            return {"status": "ok", "bot": "running"}, 200
+            """Health check endpoint for Render.com, including cached provider health."""
+            # Traffic only flips over to this instance once its provider connections are open
+            if not self.providers_ready.is_set():
+                return {"status": "warming", "bot": "running"}, 503
+            providers = {"gemini": self.gemini_service.health.snapshot()}
+            if self.together_available:
+                providers["together"] = self.together_service.health.snapshot()
+            return {
+                "status": "ok", "bot": "running", "providers": providers,
+                "load": self.shedder.stats(), "faq": self.faq.stats()
+            }, 200
         
         @self.flask_app.route('/webhook', methods=['POST'])
         def webhook():
             """Handle incoming webhook from Telegram."""
+            # Rejected before the body is even read
+            if not webhook_ingest.secret_token_valid(request.headers):
+                return Response(status=403)
             try:
-                # Get the update from Telegram
-                json_data = request.get_json()
-                if not json_data:
+                # Get the update from Telegram (recorded raw; decoding happens off the request thread)
+                body = request.get_data()
+                recorder.record_raw(body)
+                json_data = webhook_ingest.parse_update(body)
+                if json_data is None:
                     return Response(status=400)
                 
-                # Create Update object
-                update = Update.de_json(json_data, self.application.bot)
+                # Acknowledge updates no handler would respond to without building an Update
+                if not webhook_ingest.is_handled(json_data):
+                    return Response(status=200)
                 
-                # Process the update asynchronously
-                asyncio.create_task(self.application.process_update(update))
+                # Telegram redelivers updates it thinks were lost; answer each one only once
+                update_id = json_data.get("update_id")
+                if update_id is not None and not self.deduplicator.claim(update_id):
+                    self.logger.info("Dropped duplicate update %s", update_id)
+                    return Response(status=200)
+                
+                try:
+                    # Create Update object
+                    update = Update.de_json(json_data, self.application.bot)
+                    
+                    # Process the update asynchronously
+                    asyncio.run_coroutine_threadsafe(self.application.process_update(update), self.loop)
+                except Exception:
+                    # Not handed off, so Telegram's redelivery must not be dropped
+                    if update_id is not None:
+                        self.deduplicator.release(update_id)
+                    raise
                 
                 return Response(status=200)
             except Exception as e:
-                self.logger.error(f"Error processing webhook: {str(e)}")
+                self.logger.error("Error processing webhook: %s", e)
                 return Response(status=500)
         
         @self.flask_app.route('/set_webhook', methods=['POST'])
@@ -102,11 +198,121 @@ class TelegramWebhookBot:
             """Set the webhook URL (for manual setup)."""
             try:
                 webhook_url = f"{self.webhook_url}/webhook"
-                asyncio.create_task(self.application.bot.set_webhook(webhook_url))
+                asyncio.run_coroutine_threadsafe(
+                    self.application.bot.set_webhook(webhook_url, **webhook_ingest.webhook_options()), self.loop
+                )
                 return {"status": "webhook_set", "url": webhook_url}, 200
             except Exception as e:
-                self.logger.error(f"Error setting webhook: {str(e)}")
+                self.logger.error("Error setting webhook: %s", e)
                 return {"status": "error", "message": str(e)}, 500
+        
+        @self.flask_app.route('/scheduler', methods=['GET'])
+        def scheduler_stats():
+            """Provider queue state and per-user waits; requires the admin API token."""
+            if not webhook_ingest.admin_token_valid(request.headers):
+                return Response(status=403)
+            top_users = request.args.get("top", 10, type=int)
+            
+            async def collect():
+                # The scheduler is only touched from the bot's event loop
+                return {**self.scheduler.stats(top_users=top_users), "load_shedding": self.shedder.stats()}
+            
+            return asyncio.run_coroutine_threadsafe(collect(), self.loop).result(timeout=5), 200
+        
+        @self.flask_app.route('/loop', methods=['GET'])
+        def loop_lag():
+            """Event-loop lag histogram and recent stalls with their stacks; requires the admin API token."""
+            if not webhook_ingest.admin_token_valid(request.headers):
+                return Response(status=403)
+            # Read off the loop on purpose: it still answers while the loop is blocked
+            return self.loop_monitor.stats(include_stacks=True), 200
+        
+        @self.flask_app.route('/memstats', methods=['GET'])
+        def memstats():
+            """Memory report as JSON (?trace=start|stop toggles tracemalloc); requires the admin API token."""
+            if not webhook_ingest.admin_token_valid(request.headers):
+                return Response(status=403)
+            trace = request.args.get("trace", "")
+            if trace == "start":
+                memory_inspector.start_tracing()
+            elif trace == "stop":
+                memory_inspector.stop_tracing()
+            
+            async def collect():
+                # Structures are only walked on the bot's event loop, where nothing changes meanwhile
+                return memory_inspector.report(self._memory_structures())
+            
+            report = asyncio.run_coroutine_threadsafe(collect(), self.loop).result(timeout=60)
+            report["tracemalloc"] = memory_inspector.allocations()
+            return report, 200
+        
+        @self.flask_app.route('/faq', methods=['GET', 'POST', 'DELETE'])
+        def faq():
+            """
+            FAQ entries with hit statistics; POST {"questions": [...], "answer": "..."} adds an entry
+            and DELETE ?id=N removes one. Requires the admin API token.
+            """
+            if not webhook_ingest.admin_token_valid(request.headers):
+                return Response(status=403)
+            
+            # The index is only touched from the bot's event loop
+            if request.method == "POST":
+                data = request.get_json(silent=True) or {}
+                questions, answer = data.get("questions", []), data.get("answer", "")
+                if isinstance(questions, str):
+                    questions = [questions]
+                if not isinstance(questions, list) or not isinstance(answer, str):
+                    return {"status": "error", "message": "Expected a list of questions and an answer"}, 400
+                
+                async def add():
+                    return self.faq.add([str(question) for question in questions], answer)
+                
+                try:
+                    entry = asyncio.run_coroutine_threadsafe(add(), self.loop).result(timeout=5)
+                except ValueError as e:
+                    return {"status": "error", "message": str(e)}, 400
+                return {"status": "added", "entry": entry._asdict()}, 201
+            
+            if request.method == "DELETE":
+                entry_id = request.args.get("id", type=int)
+                
+                async def remove():
+                    return entry_id is not None and self.faq.remove(entry_id)
+                
+                if not asyncio.run_coroutine_threadsafe(remove(), self.loop).result(timeout=5):
+                    return {"status": "error", "message": "No such FAQ entry"}, 404
+                return {"status": "removed", "id": entry_id}, 200
+            
+            async def collect():
+                return {
+                    "entries": [
+                        {**entry._asdict(), "hits": self.faq.entry_hits.get(entry.id, 0)}
+                        for entry in self.faq.entries
+                    ],
+                    "stats": self.faq.stats(),
+                }
+            
+            return asyncio.run_coroutine_threadsafe(collect(), self.loop).result(timeout=5), 200
+        
+        @self.flask_app.route('/profile', methods=['GET'])
+        def profile():
+            """Sample the process for ?seconds=N and return collapsed stacks; requires the admin API token."""
+            if not webhook_ingest.admin_token_valid(request.headers):
+                return Response(status=403)
+            seconds = request.args.get("seconds", Config.PROFILE_DEFAULT_SECONDS, type=float)
+            try:
+                # Blocks only this request's thread
+                result = profiler.profile(seconds)
+            except ValueError as e:
+                return {"status": "error", "message": str(e)}, 400
+            except RuntimeError as e:
+                return {"status": "error", "message": str(e)}, 409
+            filename = f"profile-{time.strftime('%Y%m%d-%H%M%S')}.folded"
+            return Response(
+                result.collapsed(),
+                mimetype="text/plain",
+                headers={"Content-Disposition": f"attachment; filename={filename}"}
+            )
     
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle the /start command."""
@@ -127,7 +333,7 @@ class TelegramWebhookBot:
             "Use /help to see available commands."
         )
         await update.message.reply_text(welcome_message)
-        self.logger.info(f"User {user.id} ({user.username}) started the bot")
+        self.logger.info("User %s (%s) started the bot", user.id, user.username)
     
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle the /help command."""
@@ -139,10 +345,10 @@ class TelegramWebhookBot:
             f"🤖 *AI Assistant Commands*\n\n"
             "/start - Start the bot and see welcome message\n"
             "/help - Show this help message\n"
-            "/clear - Clear conversation history\n"
+            "/clear - Clear conversation history and cancel pending replies\n"
             "/status - Check bot status\n"
-            "/ai - Switch between AI services (gemini/together)\n"
-            "/models - Show available AI models\n\n"
+            "/ai - Switch between AI services (auto/gemini/together)\n"
+            "/models - Show available AI models or pin one\n\n"
             "*How to use:*\n"
             f"Just send me any text message and I'll respond using {ai_info}!\n\n"
             "*Features:*\n"
@@ -157,30 +363,54 @@ class TelegramWebhookBot:
     async def clear_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle the /clear command to reset conversation history."""
         user_id = update.effective_user.id
+        # Replies still being generated (or waiting for follow-ups) would answer the old conversation
+        self.debouncer.discard((update.effective_chat.id, user_id))
+        cancelled = self.generations.abort(user_id)
         if user_id in self.conversations:
             del self.conversations[user_id]
         
-        await update.message.reply_text(
-            "🗑️ Conversation history cleared! Starting fresh."
-        )
-        self.logger.info(f"User {user_id} cleared conversation history")
+        reply = "🗑️ Conversation history cleared! Starting fresh."
+        if cancelled:
+            reply += f"\n⏹️ Cancelled {cancelled} pending {'reply' if cancelled == 1 else 'replies'}."
+        await update.message.reply_text(reply)
+        self.logger.info("User %s cleared conversation history (%d generations cancelled)", user_id, cancelled)
     
     async def status_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle the /status command to show bot status."""
         user_id = update.effective_user.id
-        conversation_length = len(self.conversations.get(user_id, []))
-        current_ai = self.user_ai_preference.get(user_id, "gemini")
+        conversation_length = self.conversations.message_count(user_id)
+        memory = self.conversations.stats()
+        current_ai = self.user_ai_preference.get(user_id, self.default_ai)
+        queue = self.scheduler.stats(top_users=0)
+        own_wait = self.scheduler.user_wait(user_id)
+        own_wait_text = f", yours {own_wait['avg_wait_ms']:.0f} ms" if own_wait else ""
+        pools = [("Gemini", self.gemini_service.keys)]
+        if self.together_available:
+            pools.append(("Together", self.together_service.keys))
+        # Only worth a line when a key pool is configured
+        keys_text = ""
+        if any(len(pool) > 1 for _, pool in pools):
+            keys_text = "🔑 API keys available: " + ", ".join(f"{name} {pool.available()}/{len(pool)}" for name, pool in pools) + "\n"
         
-        gemini_status = "⚡ Connected" if self.gemini_service else "❌ Not Available"
-        together_status = "⚡ Connected" if self.together_available else "❌ Not Available"
+        gemini_status = describe(self.gemini_service.health.snapshot())
+        together_status = (
+            describe(self.together_service.health.snapshot()) if self.together_available else "❌ Not Available"
+        )
         
         status_text = (
             "🟢 *Bot Status: Active (Webhook Mode)*\n\n"
             f"📊 Your conversation messages: {conversation_length}\n"
             f"🔄 Total active conversations: {len(self.conversations)}\n"
+            f"💾 Conversation memory: {format_bytes(self.conversations.memory_usage(user_id))} yours, "
+            f"{format_bytes(memory['bytes_per_conversation'])} per user, {format_bytes(memory['total_bytes'])} total\n"
+            f"⏳ Provider queue: {queue['in_use']}/{queue['slots']} busy, {queue['queued']} waiting, "
+            f"p95 wait {queue['wait_ms']['p95']:.0f} ms{own_wait_text}\n"
+            f"🚦 Load: {LEVELS[self.shedder.level]}, event loop lag p99 {self.loop_monitor.percentile(99):.0f} ms\n"
+            f"📚 FAQ answers: {self.faq.hits} of {self.faq.lookups} messages\n"
             f"🤖 Current AI: {current_ai.title()}\n"
             f"🧠 Gemini AI: {gemini_status}\n"
             f"🚀 Together AI: {together_status}\n"
+            f"{keys_text}"
             f"📡 Telegram API: Connected (Webhook)\n"
             f"🌐 Webhook URL: {self.webhook_url}/webhook\n\n"
             "Everything is working perfectly!"
@@ -193,8 +423,8 @@ class TelegramWebhookBot:
         args = context.args
         
         if not args:
-            current_ai = self.user_ai_preference.get(user_id, "gemini")
-            available_ais = ["gemini"]
+            current_ai = self.user_ai_preference.get(user_id, self.default_ai)
+            available_ais = ["auto", "gemini"]
             if self.together_available:
                 available_ais.append("together")
             
@@ -202,6 +432,7 @@ class TelegramWebhookBot:
                 f"🤖 *Current AI: {current_ai.title()}*\n\n"
                 f"Available AI services: {', '.join(available_ais)}\n\n"
                 "To switch AI service, use:\n"
+                "/ai auto - Pick the best model for each message\n"
                 "/ai gemini - Use Gemini AI\n"
             )
             if self.together_available:
@@ -212,7 +443,14 @@ class TelegramWebhookBot:
         
         ai_choice = args[0].lower()
         
-        if ai_choice == "gemini":
+        # Choosing a service replaces any model pinned with /models
+        if ai_choice in ("auto", "gemini") or (ai_choice == "together" and self.together_available):
+            self.user_model_preference.pop(user_id, None)
+        
+        if ai_choice == "auto":
+            self.user_ai_preference[user_id] = "auto"
+            await update.message.reply_text("🔀 Automatic model selection enabled!")
+        elif ai_choice == "gemini":
             self.user_ai_preference[user_id] = "gemini"
             await update.message.reply_text("🧠 Switched to Gemini AI!")
         elif ai_choice == "together" and self.together_available:
@@ -221,114 +459,555 @@ class TelegramWebhookBot:
         elif ai_choice == "together" and not self.together_available:
             await update.message.reply_text("❌ Together AI is not available. Please check the TOGETHER_API_KEY.")
         else:
-            await update.message.reply_text("❌ Invalid AI service. Use 'gemini' or 'together'.")
+            await update.message.reply_text("❌ Invalid AI service. Use 'auto', 'gemini' or 'together'.")
     
     async def models_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handle the /models command to show available models."""
+        """Handle the /models command to show available models or pin one."""
+        user_id = update.effective_user.id
+        
+        if context.args:
+            model_choice = context.args[0]
+            if model_choice.lower() == "auto":
+                self.user_model_preference.pop(user_id, None)
+                await update.message.reply_text("🔀 Model pin removed; models are chosen automatically.")
+            elif any(key == model_choice for _, key, _ in self.model_router.candidates):
+                self.user_model_preference[user_id] = model_choice
+                await update.message.reply_text(f"📌 All your messages will now use {model_choice}.")
+            else:
+                await update.message.reply_text("❌ Unknown model. Use /models to see available models.")
+            return
+        
         models_text = "🤖 *Available AI Models*\n\n"
         
-        models_text += "*Gemini AI:*\n• gemini-2.5-flash (default)\n\n"
+        models_text += "*Gemini AI:*\n"
+        for name in self.gemini_service.get_available_models():
+            default = " (default)" if name == self.gemini_service.model_name else ""
+            models_text += f"• {name}{default}{self._describe_model_latency(name)}\n"
+        models_text += "\n"
         
         if self.together_available:
             models_text += "*Together AI Models:*\n"
             together_models = self.together_service.get_available_models()
             for name, model_id in together_models.items():
-                models_text += f"• {name}: {model_id.split('/')[-1]}\n"
+                models_text += f"• {name}: {model_id.split('/')[-1]}{self._describe_model_latency(model_id)}\n"
             models_text += "\nUse /ai together to switch to Together AI models."
         else:
             models_text += "*Together AI:* Not available (missing API key)"
         
+        pinned = self.user_model_preference.get(user_id)
+        models_text += f"\n\n📌 Pinned model: {pinned}" if pinned else "\n\nUse /models <name> to pin a model, /models auto to unpin."
+        
         await update.message.reply_text(models_text, parse_mode='Markdown')
     
+    def _describe_model_latency(self, model_id: str) -> str:
+        """Recent latency of a model for /models, if it has served requests."""
+        stats = model_stats.get(model_id)
+        if stats is None:
+            return ""
+        latency, error_rate, _ = stats
+        return f" (~{latency:.1f}s, {error_rate:.0%} errors)"
+    
+    async def thinking_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle the /thinking admin command to tune Gemini's thinking budget."""
+        user_id = update.effective_user.id
+        if not Config.is_admin(user_id):
+            await update.message.reply_text("❌ This command is only available to administrators.")
+            return
+        
+        if context.args:
+            try:
+                self.gemini_service.set_thinking_budget(context.args[0])
+            except ValueError:
+                await update.message.reply_text("❌ Use /thinking auto, /thinking dynamic, /thinking off or /thinking <tokens>.")
+                return
+            self.logger.info("Admin %s set Gemini thinking budget to %s", user_id, self.gemini_service.thinking_budget)
+        
+        budgets = self.gemini_service.tier_budgets
+        thinking_text = (
+            f"🧠 *Gemini thinking budget: {self.gemini_service.thinking_budget}*\n"
+            f"Auto tiers: simple={budgets['simple']}, moderate={budgets['moderate']}, complex={budgets['complex']}\n\n"
+        )
+        report = self.gemini_service.thinking_report()
+        if report:
+            thinking_text += "*Recent requests by tier:*\n"
+            for tier, stats in report.items():
+                thinking_text += (
+                    f"• {tier}: {stats['requests']} requests, "
+                    f"{stats['avg_thinking_tokens']:.0f} thinking tokens, {stats['avg_latency_s']:.2f}s avg\n"
+                )
+        else:
+            thinking_text += "No Gemini requests yet."
+        
+        await update.message.reply_text(thinking_text, parse_mode='Markdown')
+    
+    async def profile_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle the /profile admin command to sample where the process spends CPU time."""
+        user_id = update.effective_user.id
+        if not Config.is_admin(user_id):
+            await update.message.reply_text("❌ This command is only available to administrators.")
+            return
+        
+        try:
+            seconds = float(context.args[0]) if context.args else Config.PROFILE_DEFAULT_SECONDS
+        except ValueError:
+            seconds = 0.0
+        if not 0 < seconds <= profiler.max_seconds:
+            await update.message.reply_text(f"❌ Use /profile <seconds> with up to {profiler.max_seconds:g} seconds.")
+            return
+        
+        await update.message.reply_text(f"⏱️ Profiling for {seconds:g}s...")
+        self.logger.info("Admin %s started a %gs profile", user_id, seconds)
+        try:
+            # Sampled from a worker thread, so the event loop is profiled while it keeps serving
+            result = await asyncio.to_thread(profiler.profile, seconds)
+        except RuntimeError as e:
+            await update.message.reply_text(f"❌ {e}.")
+            return
+        
+        await update.message.reply_document(
+            document=result.collapsed().encode("utf-8"),
+            filename=f"profile-{time.strftime('%Y%m%d-%H%M%S')}.folded",
+            caption=result.summary()[:1024]
+        )
+    
+    async def memstats_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle the /memstats admin command to report what is using memory."""
+        user_id = update.effective_user.id
+        if not Config.is_admin(user_id):
+            await update.message.reply_text("❌ This command is only available to administrators.")
+            return
+        
+        action = context.args[0].lower() if context.args else ""
+        if action == "start":
+            memory_inspector.start_tracing()
+        elif action == "stop":
+            memory_inspector.stop_tracing()
+        elif action:
+            await update.message.reply_text("❌ Use /memstats, /memstats start or /memstats stop.")
+            return
+        
+        report = memory_inspector.report(self._memory_structures())
+        # Snapshotting and diffing allocations can take seconds; the loop keeps serving meanwhile
+        report["tracemalloc"] = await asyncio.to_thread(memory_inspector.allocations)
+        # Plain text: file paths in allocation sites would break Markdown
+        await update.message.reply_text(format_report(report)[:4096])
+    
+    async def faq_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Handle the /faq admin command to manage the questions answered without a model."""
+        user_id = update.effective_user.id
+        if not Config.is_admin(user_id):
+            await update.message.reply_text("❌ This command is only available to administrators.")
+            return
+        
+        # Parsed from the raw text so answers keep their line breaks
+        parts = update.message.text.split(maxsplit=2)
+        action = parts[1].lower() if len(parts) > 1 else ""
+        argument = parts[2].strip() if len(parts) > 2 else ""
+        
+        if not action:
+            reply = format_entries(self.faq)
+        elif action == "add" and "|" in argument:
+            *questions, answer = argument.split("|")
+            try:
+                entry = self.faq.add(questions, answer)
+            except ValueError as e:
+                await update.message.reply_text(f"❌ {e}.")
+                return
+            reply = f"✅ Added FAQ entry {entry.id} with {len(entry.questions)} phrasing(s)."
+            self.logger.info("Admin %s added FAQ entry %d", user_id, entry.id)
+        elif action == "remove" and argument.isdigit():
+            if not self.faq.remove(int(argument)):
+                await update.message.reply_text(f"❌ There is no FAQ entry {argument}.")
+                return
+            reply = f"🗑️ Removed FAQ entry {argument}."
+            self.logger.info("Admin %s removed FAQ entry %s", user_id, argument)
+        elif action == "test" and argument:
+            match = self.faq.best_match(argument)
+            if match is None:
+                reply = "🔎 No FAQ question shares a word with that message."
+            else:
+                verdict = "answered" if match.confidence >= self.faq.min_confidence else "sent to a model"
+                reply = (f"🔎 Entry {match.entry.id} via \"{match.question}\", "
+                         f"confidence {match.confidence:.2f}: {verdict}.")
+        else:
+            await update.message.reply_text(
+                "❌ Use /faq, /faq add <question> | [<other phrasing> |] <answer>, /faq remove <id> or /faq test <message>."
+            )
+            return
+        # Plain text: questions and answers are free-form
+        await update.message.reply_text(reply[:4096])
+    
     async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle regular text messages from users."""
         user = update.effective_user
         user_id = user.id
         message_text = update.message.text
         
-        self.logger.info(f"Received message from {user.username} ({user_id}): {message_text[:50]}...")
+        with tracer.start_trace(
+            "handle_message",
+            update_id=update.update_id,
+            user_id=user_id,
+            chat_id=update.effective_chat.id,
+            message_length=len(message_text)
+        ):
+            await self._handle_message(update, context, user, message_text)
+    
+    async def _handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE, user, message_text: str):
+        """Process a text message inside the update's trace."""
+        user_id = user.id
+        
+        self.logger.info("Received message from %s (%s): %s", user.username, user_id, MessageText(user_id, message_text))
+        
+        # FAQ answers skip the debounce wait, rate limit and provider call. Shortly after a turn, a
+        # message that refers back ("how does that work?") needs the conversation's context, and
+        # messages still waiting to be merged or answered come first, so only standalone questions are looked up
+        conversation_key = (update.effective_chat.id, user_id)
+        idle = self.conversations.idle_seconds(user_id)
+        standalone = (idle is None or idle >= Config.FAQ_FOLLOW_UP_WINDOW
+                      or not looks_like_follow_up(message_text))
+        if (standalone and conversation_key not in self.debouncer
+                and not self.generations.pending(user_id)
+                and await self._answer_from_faq(update, user_id, message_text)):
+            return
+        
+        # Quick follow-up messages are merged into one turn, answered (and rate limited) once
+        with tracer.span("debounce.wait") as span:
+            message_text = await self.debouncer.collect(conversation_key, message_text)
+            if span:
+                span.set_attribute("merged_into_later", message_text is None)
+        if message_text is None:
+            return
+        
+        # Under overload, non-admins get degraded service (see load_shedding.py)
+        shed_level = self.shedder.level_for(user_id)
+        if shed_level >= BUSY:
+            self.shedder.record_shed(BUSY)
+            with tracer.span("telegram.send_message", shed=True):
+                await update.message.reply_text(BUSY_REPLY)
+            return
         
         # Check rate limiting
-        if not self.rate_limiter.is_allowed(user_id):
-            await update.message.reply_text(
-                "⚠️ You're sending messages too quickly. Please wait a moment before trying again."
-            )
+        with tracer.span("rate_limiter.is_allowed") as span:
+            allowed = self.rate_limiter.is_allowed(user_id)
+            if span:
+                span.set_attribute("allowed", allowed)
+        
+        if not allowed:
+            with tracer.span("telegram.send_message"):
+                await update.message.reply_text(
+                    "⚠️ You're sending messages too quickly. Please wait a moment before trying again."
+                )
             return
         
-        # Show typing indicator
-        await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
+        # Show typing indicator (skipped when shedding load: one Bot API call less per message)
+        if shed_level >= NO_TYPING:
+            self.shedder.record_shed(NO_TYPING)
+        else:
+            with tracer.span("telegram.send_chat_action"):
+                await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
         
         try:
-            # Get conversation history
-            conversation_history = self.conversations.get(user_id, [])
+            # A newer message from this user supersedes this generation (see SUPERSEDE_POLICY)
+            generation = self.generations.begin(user_id, message_text)
+            try:
+                await self.generations.wait_turn(generation)
+                response = await self._generate_reply(update, user_id, generation.text, shed_level)
+            except asyncio.CancelledError:
+                if not self.generations.dropped(generation):
+                    raise
+                self.logger.info("Dropped superseded reply for %s", user_id)
+                return
+            finally:
+                self.generations.finish(generation)
             
-            # Add user message to conversation history
-            conversation_history.append({"role": "user", "content": message_text})
+            # Send response to user
+            with tracer.span("telegram.send_message", response_length=len(response)):
+                await update.message.reply_text(response)
             
-            # Determine which AI service to use
-            user_ai = self.user_ai_preference.get(user_id, "gemini")
+            self.logger.info("Sent response to %s (%s)", user.username, user_id)
             
-            # Generate response using selected AI service
-            if user_ai == "together" and self.together_available:
-                response = await self.together_service.generate_response(
-                    message_text, 
-                    conversation_history
+        except Exception as e:
+            self.logger.error("Error processing message from %s: %s", user_id, e)
+            with tracer.span("telegram.send_message", error=True):
+                await update.message.reply_text(
+                    "❌ I'm having trouble processing your message right now. "
+                    "Please try again in a moment. If the problem persists, "
+                    "contact the administrator."
                 )
-            else:
-                # Default to Gemini AI
-                response = await self.gemini_service.generate_response(
-                    message_text, 
-                    conversation_history
+    
+    async def _answer_from_faq(self, update: Update, user_id: int, message_text: str) -> bool:
+        """
+        Reply from the FAQ if the message confidently matches an entry.
+        
+        Args:
+            update: The update being answered
+            user_id: Telegram user ID
+            message_text: The message
+        
+        Returns:
+            Whether the message was answered
+        """
+        with tracer.span("faq.lookup") as span:
+            match = self.faq.lookup(message_text)
+            if span:
+                span.set_attribute("hit", match is not None)
+                if match:
+                    span.set_attribute("entry", match.entry.id)
+                    span.set_attribute("confidence", round(match.confidence, 3))
+        if match is None:
+            return False
+        
+        # Kept in the history so follow-up questions have the context
+        self.conversations.append(user_id, "user", message_text)
+        self.conversations.append(user_id, "assistant", match.entry.answer)
+        with tracer.span("telegram.send_message", faq=True):
+            await update.message.reply_text(match.entry.answer)
+        self.logger.info("Answered %s from FAQ entry %d (confidence %.2f)", user_id, match.entry.id, match.confidence)
+        return True
+    
+    async def _generate_reply(self, update: Update, user_id: int, prompt: str, shed_level: int = 0) -> str:
+        """
+        Route and generate the reply to a prompt, keeping the history consistent if cancelled.
+        
+        Args:
+            update: The update being answered
+            user_id: Telegram user ID
+            prompt: Text to answer (several messages when superseded ones were merged)
+            shed_level: Current load shedding level for this user
+        
+        Returns:
+            The reply text
+        """
+        # Add user message to conversation history (oldest messages beyond the limit are dropped)
+        conversation_history = self.conversations.append(user_id, "user", prompt)
+        user_message = conversation_history[-1]
+        # Only answers to prompts without earlier context can be reused for other users
+        first_turn = len(conversation_history) == 1
+        if first_turn and shed_level >= CACHE_FIRST:
+            response = self.shedder.cache.get(prompt)
+            if response is not None:
+                self.shedder.record_shed(CACHE_FIRST)
+                self.conversations.append(user_id, "assistant", response)
+                return response
+        try:
+            # Determine which AI service and model to use (/ai and /models choices take precedence)
+            with tracer.span("model_router.route") as span:
+                route = self.model_router.route(
+                    prompt,
+                    conversation_history,
+                    provider=self.user_ai_preference.get(user_id, self.default_ai),
+                    model=self.user_model_preference.get(user_id),
+                    fastest=shed_level >= FASTEST_MODEL
                 )
+                if shed_level >= FASTEST_MODEL:
+                    self.shedder.record_shed(FASTEST_MODEL)
+                if span:
+                    span.set_attribute("provider", route.provider)
+                    span.set_attribute("model", route.model)
+                    span.set_attribute("reason", route.reason)
+                    span.set_attribute("shed_level", shed_level)
             
-            # Add assistant response to conversation history
-            conversation_history.append({"role": "assistant", "content": response})
-            
-            # Update conversation history (keep last 10 messages to manage memory)
-            self.conversations[user_id] = conversation_history[-Config.MAX_CONVERSATION_LENGTH:]
-            
-            # Send response to user
-            await update.message.reply_text(response)
-            
-            self.logger.info(f"Sent response to {user.username} ({user_id})")
+            # Wait for a provider slot (fair across users; long prompts cost more)
+            with tracer.span("scheduler.wait") as span:
+                waited = await self.scheduler.acquire(user_id, 1.0 + len(prompt) / Config.SCHEDULER_COST_CHARS)
+                if span:
+                    span.set_attribute("wait_ms", round(waited * 1000, 1))
             
-        except Exception as e:
-            self.logger.error(f"Error processing message from {user_id}: {str(e)}")
-            await update.message.reply_text(
-                "❌ I'm having trouble processing your message right now. "
-                "Please try again in a moment. If the problem persists, "
-                "contact the administrator."
-            )
+            # Generate response using selected AI service
+            try:
+                generation_started = time.monotonic()
+                if route.provider == "together" and self.together_available:
+                    response = await self.together_service.generate_response(
+                        prompt, 
+                        conversation_history,
+                        model_name=route.model
+                    )
+                else:
+                    # Default to Gemini AI
+                    response = await self.gemini_service.generate_response(
+                        prompt, 
+                        conversation_history,
+                        model_name=route.model
+                    )
+            finally:
+                # Cancellation aborts the provider's HTTP request, so nothing is in flight past this point
+                self.scheduler.release()
+        except asyncio.CancelledError:
+            # Superseded or cleared: a later prompt answers this one, or none does
+            self.conversations.remove_message(user_id, user_message)
+            raise
+        
+        if recorder.record_responses:
+            recorder.record_response(update.update_id, user_id, route.provider, route.model,
+                                     time.monotonic() - generation_started, response)
+        
+        if first_turn:
+            self.shedder.cache.put(prompt, response)
+        
+        # Add assistant response to conversation history
+        self.conversations.append(user_id, "assistant", response)
+        return response
     
     async def setup_webhook(self):
         """Set up the webhook with Telegram."""
         try:
             webhook_url = f"{self.webhook_url}/webhook"
-            await self.application.bot.set_webhook(webhook_url)
-            self.logger.info(f"Webhook set to: {webhook_url}")
+            await self.application.bot.set_webhook(webhook_url, **webhook_ingest.webhook_options())
+            self.logger.info("Webhook set to: %s", webhook_url)
         except Exception as e:
-            self.logger.error(f"Failed to set webhook: {str(e)}")
+            self.logger.error("Failed to set webhook: %s", e)
             raise
     
-    async def initialize(self):
-        """Initialize the bot application."""
+    async def initialize(self, set_webhook: bool = True):
+        """
+        Initialize the bot application.
+        
+        Args:
+            set_webhook: Register the webhook with Telegram (sharded workers leave this to the front process)
+        """
         await self.application.initialize()
-        await self.setup_webhook()
+        if set_webhook:
+            await self.setup_webhook()
+        self._snapshot_task = asyncio.create_task(self.snapshots.run(self.conversations, self._export_state))
+        self._loop_monitor_task = asyncio.create_task(self.loop_monitor.run())
+        self._shedder_task = asyncio.create_task(self.shedder.run())
         self.logger.info("Bot initialized with webhook")
     
+    async def export_user_state(self, predicate: Callable[[int], bool], remove: bool = True) -> Dict[str, Dict[int, Any]]:
+        """
+        Return, and by default remove, the per-user state of users matching a predicate.
+        
+        Runs on the bot's event loop, so no handler sees a half-moved user.
+        
+        Args:
+            predicate: Returns True for user IDs whose state should be handed over
+            remove: Drop the state here; False only copies it, for a hand-over not yet confirmed
+            
+        Returns:
+            Picklable state sections keyed by user ID
+        """
+        def take(mapping, user_id):
+            return mapping.pop(user_id) if remove else mapping[user_id]
+        
+        state: Dict[str, Dict[int, Any]] = {"conversations": {}, "ai_preference": {}, "model_preference": {}, "rate_limits": {}}
+        for user_id in [uid for uid in self.conversations if predicate(uid)]:
+            state["conversations"][user_id] = list(take(self.conversations, user_id))
+        for user_id in [uid for uid in self.user_ai_preference if predicate(uid)]:
+            state["ai_preference"][user_id] = take(self.user_ai_preference, user_id)
+        for user_id in [uid for uid in self.user_model_preference if predicate(uid)]:
+            state["model_preference"][user_id] = take(self.user_model_preference, user_id)
+        for user_id in [uid for uid in self.rate_limiter.user_requests if predicate(uid)]:
+            state["rate_limits"][user_id] = list(take(self.rate_limiter.user_requests, user_id))
+        return state
+    
+    async def import_user_state(self, state: Dict[str, Dict[int, Any]]):
+        """Take over per-user state exported by export_user_state()."""
+        self.conversations.update(state.get("conversations", {}))
+        self.user_ai_preference.update(state.get("ai_preference", {}))
+        self.user_model_preference.update(state.get("model_preference", {}))
+        for user_id, timestamps in state.get("rate_limits", {}).items():
+            self.rate_limiter.user_requests[user_id].extend(timestamps)
+    
+    def _memory_structures(self) -> Dict[str, Any]:
+        """Long-lived per-user structures, caches and queues measured by /memstats."""
+        return {
+            "conversations": self.conversations,
+            "user_ai_preference": self.user_ai_preference,
+            "user_model_preference": self.user_model_preference,
+            "rate_limiter.user_requests": self.rate_limiter.user_requests,
+            "response_cache": self.shedder.cache,
+            "dedup_window": self.deduplicator,
+            "scheduler": self.scheduler,
+            "debouncer": self.debouncer,
+            "generations": self.generations,
+            "loop_monitor": self.loop_monitor,
+            "faq_index": self.faq,
+        }
+    
+    def _export_state(self) -> Dict[str, Any]:
+        """State other than conversations to keep across restarts (JSON-serializable copies)."""
+        state = {
+            "ai_preference": dict(self.user_ai_preference),
+            "model_preference": dict(self.user_model_preference),
+            "rate_limits": {user_id: list(timestamps) for user_id, timestamps in self.rate_limiter.user_requests.items() if timestamps},
+            "model_stats": model_stats.export(),
+        }
+        # Only an admin's /thinking override; the configured default may change between deploys
+        if self.gemini_service.thinking_budget != Config.GEMINI_THINKING_BUDGET:
+            state["thinking_budget"] = self.gemini_service.thinking_budget
+        return state
+    
+    def _import_state(self, state: Dict[str, Any]):
+        """Restore state saved by _export_state() (user IDs come back as JSON strings)."""
+        self.user_ai_preference.update((int(user_id), ai) for user_id, ai in state.get("ai_preference", {}).items())
+        self.user_model_preference.update((int(user_id), model) for user_id, model in state.get("model_preference", {}).items())
+        for user_id, timestamps in state.get("rate_limits", {}).items():
+            self.rate_limiter.user_requests[int(user_id)].extend(timestamps)
+        model_stats.load(state.get("model_stats", {}))
+        if "thinking_budget" in state:
+            try:
+                self.gemini_service.set_thinking_budget(state["thinking_budget"])
+            except ValueError as e:
+                self.logger.warning("Ignoring saved thinking budget: %s", e)
+    
+    def save_snapshot(self):
+        """Save a state snapshot, capturing the state on the bot's event loop."""
+        if not self.snapshots.enabled:
+            return
+        
+        async def capture():
+            return self.conversations.snapshot_items(), self._export_state()
+        
+        try:
+            items, state = asyncio.run_coroutine_threadsafe(capture(), self.loop).result(timeout=30)
+            self.snapshots.write(items, state)
+        except Exception as e:
+            self.logger.error("Failed to save snapshot: %s", e)
+    
+    def prewarm_providers(self):
+        """Import provider SDKs, build their clients and open connections in the background once serving has started."""
+        if not Config.PROVIDER_PREWARM:
+            self.providers_ready.set()
+            return
+        
+        services = [self.gemini_service]
+        if self.together_available:
+            services.append(self.together_service)
+        
+        def prewarm():
+            time.sleep(Config.PROVIDER_PREWARM_DELAY)
+            for service in services:
+                try:
+                    service.prewarm()
+                except Exception as e:
+                    self.logger.warning("Failed to pre-warm %s: %s", type(service).__name__, e)
+            self.providers_ready.set()
+        
+        threading.Thread(target=prewarm, name="provider-prewarm", daemon=True).start()
+    
+    def start_event_loop(self, set_webhook: bool = True):
+        """Start the background event loop and initialize the bot on it."""
+        self.loop = asyncio.new_event_loop()
+        loop_thread = threading.Thread(target=self.loop.run_forever, name="bot-event-loop", daemon=True)
+        loop_thread.start()
+        asyncio.run_coroutine_threadsafe(self.initialize(set_webhook), self.loop).result()
+        self.health_prober.start()
+        self.prewarm_providers()
+    
     def run_webhook(self, host='0.0.0.0', port=5000):
         """Run the webhook server."""
-        self.logger.info(f"Starting webhook server on {host}:{port}")
+        self.logger.info("Starting webhook server on %s:%s", host, port)
         
-        # Initialize the bot in a separate thread
-        def init_bot():
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            loop.run_until_complete(self.initialize())
+        # Updates are processed on a long-lived loop in a separate thread
+        self.start_event_loop()
         
-        init_thread = threading.Thread(target=init_bot)
-        init_thread.start()
-        init_thread.join()
+        # Shut down on SIGTERM (deploys, restarts) as on Ctrl+C, so the final snapshot is saved
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
         
         # Start Flask server
-        self.flask_app.run(host=host, port=port, debug=False)
\ No newline at end of file
+        self.deduplicator.start()
+        try:
+            self.flask_app.run(host=host, port=port, debug=False)
+        finally:
+            self.save_snapshot()
+            self.deduplicator.stop()
\ No newline at end of file